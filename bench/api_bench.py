@@ -0,0 +1,288 @@
+"""Бенчмарк REST API на синтетических данных: задержки и пиковая память по маршрутам.
+
+Запуск: python bench/api_bench.py [--courses 1000] [--sessions 500000]
+        [--participants 50000] [--enroll 8] [--seed 42] [--requests 500]
+        [--save-baseline base.json] [--compare base.json] [--tolerance 0.2]
+
+Данные генерируются детерминированно от --seed и кэшируются в файле БД во
+временном каталоге (повторный запуск с теми же параметрами не генерирует
+заново); каждый прогон работает с копией, поэтому записи не накапливаются.
+Запросы идут через test_client приложения из main.py. Сначала проход
+задержек (p50/p95/p99), затем короткий проход под tracemalloc - пик памяти
+на запрос. --save-baseline сохраняет результат в JSON, --compare сравнивает
+с сохранённым и завершает с кодом 1, если p95 или пик памяти хуже более чем
+на --tolerance.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert
+
+from extensions import db
+from models import Course, Participant, ReminderOffset, Session, participants_sessions
+
+BASE_DT = datetime(2025, 1, 1, 8, 0)
+SLOTS_PER_DAY = 8
+STATUSES = ['planned'] * 8 + ['completed', 'canceled']
+CHUNK = 50000
+
+
+def dataset_path(args) -> str:
+    name = f"api_bench_{args.courses}_{args.sessions}_{args.participants}_{args.enroll}_{args.seed}.db"
+    return os.path.join(tempfile.gettempdir(), name)
+
+
+def chunks(rows, size: int = CHUNK):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def generate(path: str, args):
+    """Курсы, занятия по SLOTS_PER_DAY в день, участники с 1-2 смещениями
+    напоминаний и записи: у участников разная "активность" (вес по Ципфу),
+    у занятий - разный размер группы вокруг --enroll."""
+    rng = random.Random(args.seed)
+    engine = create_engine(f'sqlite:///{path}')
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Course), [
+            {'name': f'Курс {i}', 'direction': f'Направление {i % 12}', 'group': f'Группа {i % 40}'}
+            for i in range(args.courses)
+        ])
+        for batch in chunks(
+            {
+                'course_id': rng.randrange(args.courses) + 1,
+                'date_time': BASE_DT + timedelta(days=i // SLOTS_PER_DAY, hours=i % SLOTS_PER_DAY),
+                'duration_minutes': rng.choice([45, 90, 90, 120]),
+                'instructor': f'Преподаватель {rng.randrange(300)}',
+                'location': f'Ауд. {rng.randrange(1, 200)}',
+                'status': rng.choice(STATUSES),
+                'five_min_warn_sent': False,
+            }
+            for i in range(args.sessions)
+        ):
+            conn.execute(insert(Session), batch)
+        for batch in chunks(
+            {'name': f'Участник {i}', 'telegram_id': 10_000_000 + i, 'contact': f'user{i}@example.com',
+             'notifications_enabled': True, 'warn_5_min': False}
+            for i in range(args.participants)
+        ):
+            conn.execute(insert(Participant), batch)
+        conn.execute(insert(ReminderOffset), [
+            {'participant_id': p_id, 'minutes': m}
+            for p_id in range(1, args.participants + 1)
+            for m in ([1440, 60] if p_id % 3 else [60])
+        ])
+
+        weights = [1 / (i + 1) for i in range(args.participants)]
+        cum = list(itertools.accumulate(weights))
+
+        def enrollments():
+            for s_id in range(1, args.sessions + 1):
+                size = max(0, int(rng.gauss(args.enroll, args.enroll / 2)))
+                picked = {p for p in rng.choices(range(1, args.participants + 1), cum_weights=cum, k=size)}
+                for p_id in picked:
+                    yield {'participant_id': p_id, 'session_id': s_id}
+
+        for batch in chunks(enrollments()):
+            conn.execute(insert(participants_sessions), batch)
+    engine.dispose()
+
+
+def prepare(args) -> str:
+    path = dataset_path(args)
+    if not os.path.exists(path):
+        t0 = time.perf_counter()
+        print(f"generating {path} ...", flush=True)
+        generate(path + '.tmp', args)
+        os.replace(path + '.tmp', path)
+        print(f"generated in {time.perf_counter() - t0:.0f}s", flush=True)
+    work = os.path.join(tempfile.mkdtemp(prefix='api_bench_'), 'bench.db')
+    shutil.copyfile(path, work)
+    return work
+
+
+def scenarios(args, client, rng: random.Random) -> Dict[str, Callable[[], Any]]:
+    days = args.sessions // SLOTS_PER_DAY
+    etags: Dict[int, str] = {}
+
+    def rand_session() -> int:
+        return rng.randrange(args.sessions) + 1
+
+    def rand_day() -> str:
+        return (BASE_DT + timedelta(days=rng.randrange(days))).date().isoformat()
+
+    def get_session():
+        return client.get(f'/sessions/{rand_session()}')
+
+    def get_session_304():
+        # карточки, которые клиент уже видел: проверка версии без чтения занятия
+        s_id = rng.randrange(1, 50)
+        if s_id not in etags:
+            etags[s_id] = client.get(f'/sessions/{s_id}').headers['ETag']
+        return client.get(f'/sessions/{s_id}', headers={'If-None-Match': etags[s_id]})
+
+    def schedule_day():
+        day = rand_day()
+        return client.get(f'/schedule?from={day}&to={day}')
+
+    def schedule_page():
+        return client.get(f'/schedule?from={rand_day()}&limit=100')
+
+    def schedule_course():
+        return client.get(f'/schedule?course_id={rng.randrange(args.courses) + 1}&limit=100')
+
+    def regpartses():
+        return client.post(f'/sessions/{rand_session()}/register',
+                           json={'participant_id': rng.randrange(args.participants) + 1})
+
+    # пишущие сценарии последними: чтения идут по исходному набору данных
+    return {
+        'GET /sessions/<id>': get_session,
+        'GET /sessions/<id> 304': get_session_304,
+        'GET /schedule day': schedule_day,
+        'GET /schedule page': schedule_page,
+        'GET /schedule course': schedule_course,
+        'POST /sessions/<id>/register': regpartses,
+    }
+
+
+def pct(values: List[float], q: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def run(main, args) -> Dict[str, Dict[str, float]]:
+    client = main.app.test_client()
+    results: Dict[str, Dict[str, float]] = {}
+    for name, call in scenarios(args, client, random.Random(args.seed)).items():
+        main.responses.clear()
+        for _ in range(args.warmup):
+            call()
+
+        lat = []
+        for _ in range(args.requests):
+            t0 = time.perf_counter()
+            resp = call()
+            lat.append((time.perf_counter() - t0) * 1000)
+            if resp.status_code >= 400:
+                raise SystemExit(f"{name}: HTTP {resp.status_code} {resp.get_data(as_text=True)[:200]}")
+        lat.sort()
+
+        # tracemalloc замедляет выполнение, поэтому память - отдельным коротким проходом
+        main.responses.clear()
+        tracemalloc.start()
+        peak = 0
+        for _ in range(args.memory_requests):
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            call()
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+        tracemalloc.stop()
+
+        results[name] = {
+            'p50': statistics.median(lat),
+            'p95': pct(lat, 0.95),
+            'p99': pct(lat, 0.99),
+            'rps': len(lat) / (sum(lat) / 1000),
+            'peak_kb': peak / 1024,
+        }
+    return results
+
+
+def print_results(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]] = None):
+    print(f"{'endpoint':<32}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}{'peak KB':>10}")
+    for name, r in results.items():
+        line = f"{name:<32}{r['p50']:>9.2f}{r['p95']:>9.2f}{r['p99']:>9.2f}{r['rps']:>9.0f}{r['peak_kb']:>10.0f}"
+        if baseline and name in baseline:
+            b = baseline[name]
+            line += f"   p95 {delta(r['p95'], b['p95']):>+6.0%}  peak {delta(r['peak_kb'], b['peak_kb']):>+6.0%}"
+        print(line)
+
+
+def delta(value: float, base: float) -> float:
+    return (value - base) / base if base else 0.0
+
+
+def regressions(results, baseline, tolerance: float) -> List[Tuple[str, str, float]]:
+    out = []
+    for name, r in results.items():
+        b = baseline.get(name)
+        if not b:
+            continue
+        for metric in ('p95', 'peak_kb'):
+            d = delta(r[metric], b[metric])
+            if d > tolerance:
+                out.append((name, metric, d))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--courses', type=int, default=1000)
+    parser.add_argument('--sessions', type=int, default=500000)
+    parser.add_argument('--participants', type=int, default=50000)
+    parser.add_argument('--enroll', type=int, default=8, help='средний размер группы на занятии')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--requests', type=int, default=500, help='запросов на маршрут в проходе задержек')
+    parser.add_argument('--memory-requests', type=int, default=50, help='запросов на маршрут под tracemalloc')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--save-baseline', help='сохранить результат в JSON')
+    parser.add_argument('--compare', help='сравнить с сохранённым JSON')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='допустимое ухудшение, доля')
+    args = parser.parse_args()
+
+    params = {k: getattr(args, k) for k in ('courses', 'sessions', 'participants', 'enroll', 'seed', 'requests')}
+    work = prepare(args)
+    # main читает конфиг при импорте: БД подменяется до него
+    os.environ['DATABASE_URL'] = f'sqlite:///{work}'
+    import main as app_main
+
+    try:
+        results = run(app_main, args)
+    finally:
+        shutil.rmtree(os.path.dirname(work), ignore_errors=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            saved = json.load(f)
+        if saved['params'] != params:
+            print(f"warning: baseline params differ: {saved['params']}")
+        baseline = saved['results']
+    print_results(results, baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'params': params, 'created_at': datetime.now().isoformat(timespec='seconds'),
+                       'python': sys.version.split()[0], 'results': results}, f, indent=2, ensure_ascii=False)
+        print(f"baseline saved to {args.save_baseline}")
+
+    if baseline:
+        bad = regressions(results, baseline, args.tolerance)
+        for name, metric, d in bad:
+            print(f"REGRESSION {name}: {metric} {d:+.0%}")
+        if bad:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""Задержка и пропускная способность доступа к БД из бота:
+to_thread + app_context (как было) против async-репозитория.
+
+Запуск: python bench/bot_db_latency.py [--updates 5000] [--concurrency 1,16,64]
+Смесь запросов повторяет обработчики: день расписания, карточка занятия,
+профиль участника. Кэши бота не участвуют - меряется только доступ к БД.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import insert, select
+from sqlalchemy.orm import joinedload
+
+from config import Config
+from extensions import db, init_storage
+from models import Course, Participant, ReminderOffset, Session
+from repository import Repository, day_sessions_query
+
+BASE_DT = datetime(2025, 1, 1, 8, 0)
+DAYS = 120
+PARTICIPANTS = 2000
+
+
+def make_app(path: str) -> Flask:
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    db.init_app(app)
+    init_storage(app)
+    return app
+
+
+def seed(app: Flask):
+    with app.app_context():
+        db.create_all()
+        db.session.execute(insert(Course), [{'name': f'Курс {i}'} for i in range(20)])
+        db.session.execute(insert(Session), [
+            {
+                'course_id': i % 20 + 1,
+                'date_time': BASE_DT + timedelta(days=i // 8, hours=i % 8),
+                'status': 'planned',
+                'five_min_warn_sent': False,
+            }
+            for i in range(DAYS * 8)
+        ])
+        db.session.execute(insert(Participant), [
+            {'name': f'Участник {i}', 'telegram_id': 1000 + i, 'notifications_enabled': True, 'warn_5_min': False}
+            for i in range(PARTICIPANTS)
+        ])
+        db.session.execute(insert(ReminderOffset), [
+            {'participant_id': i + 1, 'minutes': 60} for i in range(PARTICIPANTS)
+        ])
+        db.session.commit()
+
+
+def make_ops(n: int):
+    rnd = random.Random(1)
+    ops = []
+    for _ in range(n):
+        kind = rnd.choice(('day', 'session', 'profile'))
+        if kind == 'day':
+            ops.append((kind, (BASE_DT + timedelta(days=rnd.randrange(DAYS))).date()))
+        elif kind == 'session':
+            ops.append((kind, rnd.randint(1, DAYS * 8)))
+        else:
+            ops.append((kind, 1000 + rnd.randrange(PARTICIPANTS)))
+    return ops
+
+
+def thread_op(app: Flask):
+    """Старый путь: замыкание с app_context в asyncio.to_thread."""
+
+    def day_sync(d):
+        with app.app_context():
+            return db.session.execute(day_sessions_query(d).options(joinedload(Session.course))).scalars().all()
+
+    def session_sync(s_id):
+        with app.app_context():
+            return Session.query.options(joinedload(Session.course)).get(s_id)
+
+    def profile_sync(tg_id):
+        with app.app_context():
+            part = Participant.query.filter_by(telegram_id=tg_id).first()
+            return part and db.session.execute(
+                select(ReminderOffset.minutes).where(ReminderOffset.participant_id == part.id)
+            ).scalars().all()
+
+    funcs = {'day': day_sync, 'session': session_sync, 'profile': profile_sync}
+
+    async def op(kind, arg):
+        return await asyncio.to_thread(funcs[kind], arg)
+
+    return op
+
+
+def repo_op(repo: Repository):
+    funcs = {'day': repo.day_sessions, 'session': repo.get_session, 'profile': repo.get_profile}
+
+    async def op(kind, arg):
+        return await funcs[kind](arg)
+
+    return op
+
+
+async def drive(op, ops, concurrency: int):
+    latencies = []
+    queue = list(reversed(ops))
+
+    async def worker():
+        while queue:
+            kind, arg = queue.pop()
+            t0 = time.perf_counter()
+            await op(kind, arg)
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+    latencies.sort()
+    return {
+        'rate': len(ops) / elapsed,
+        'p50': statistics.median(latencies) * 1000,
+        'p95': latencies[int(len(latencies) * 0.95)] * 1000,
+    }
+
+
+async def run(app: Flask, ops, levels):
+    repo = Repository()
+    with app.app_context():
+        repo.init_app(app, db.engine)
+    results = []
+    for concurrency in levels:
+        for name, op in (('to_thread', thread_op(app)), ('async', repo_op(repo))):
+            await drive(op, ops[:200], concurrency)
+            results.append((name, concurrency, await drive(op, ops, concurrency)))
+    await repo.dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--concurrency', default='1,16,64')
+    args = parser.parse_args()
+    levels = [int(c) for c in args.concurrency.split(',')]
+
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        app = make_app(path)
+        seed(app)
+        results = asyncio.run(run(app, make_ops(args.updates), levels))
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    print(f"{'path':<11}{'conc':>6}{'upd/s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, concurrency, res in results:
+        print(f"{name:<11}{concurrency:>6}{res['rate']:>10.0f}{res['p50']:>10.2f}{res['p95']:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+"""Нагрузочный стенд бота: runbotapp против локальной заглушки Bot API.
+
+Запуск: python bench/bot_load.py [--users 50] [--teachers 5] [--duration 30]
+        [--think 0.2] [--latency 0.02] [--rate-limit 0.0] [--retry-after 1]
+
+Бот собирается через main.buildbotapp с base_url заглушки (fakebotapi) и
+забирает апдейты long polling'ом. Каждый пользователь - отдельный чат,
+который кликает по сценарию и ждёт ответа бота перед следующим шагом
+(замкнутый цикл, --think - пауза между шагами):
+  студент: "Расписание" -> следующий месяц -> день;
+  профиль: "Профиль" (при первом входе ещё ФИО и группа);
+  преподаватель: "Мои занятия" -> занятие -> место -> новое место -> применить.
+Меряется время от выдачи апдейта до ответа бота в чат (sendMessage/
+editMessage*) по шагам и устойчивая пропускная способность. --rate-limit
+отвечает 429 на такую долю ответов: шаг без ответа за --timeout считается
+потерянным. Данные - временная БД с занятиями вокруг сегодняшнего дня.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine, insert
+from telegram.ext import Application
+
+from extensions import db
+from fakebotapi import FakeBotApi, TOKEN, text_update, callback_update
+from models import Course, Participant, ReminderOffset, Session, participants_sessions
+
+COURSES = 20
+PARTICIPANTS = 2000
+SESSIONS_PER_DAY = 4
+# занятия от DAYS_BACK дней назад до DAYS_AHEAD вперёд
+DAYS_BACK = 30
+DAYS_AHEAD = 60
+USER_CHAT_BASE = 5_000_000
+TEACHER_CHAT_BASE = 6_000_000
+# записанные участники: уведомления о правках уходят им, а не пользователям стенда
+PARTICIPANT_CHAT_BASE = 10_000_000
+
+
+def seed(path: str, rng: random.Random) -> List[int]:
+    """Возвращает id будущих занятий - их правят преподаватели."""
+    engine = create_engine(f'sqlite:///{path}')
+    db.metadata.create_all(engine)
+    start = datetime.combine(date.today() - timedelta(days=DAYS_BACK), datetime.min.time()).replace(hour=9)
+    rows = [
+        {
+            'course_id': rng.randrange(COURSES) + 1,
+            'date_time': start + timedelta(days=i // SESSIONS_PER_DAY, hours=2 * (i % SESSIONS_PER_DAY)),
+            'duration_minutes': 90,
+            'instructor': f'Преподаватель {rng.randrange(30)}',
+            'location': f'Ауд. {rng.randrange(1, 100)}',
+            'status': 'planned',
+            'five_min_warn_sent': False,
+        }
+        for i in range((DAYS_BACK + DAYS_AHEAD) * SESSIONS_PER_DAY)
+    ]
+    with engine.begin() as conn:
+        conn.execute(insert(Course), [{'name': f'Курс {i}'} for i in range(COURSES)])
+        conn.execute(insert(Session), rows)
+        conn.execute(insert(Participant), [
+            {'name': f'Участник {i}', 'telegram_id': PARTICIPANT_CHAT_BASE + i,
+             'notifications_enabled': True, 'warn_5_min': False}
+            for i in range(PARTICIPANTS)
+        ])
+        conn.execute(insert(ReminderOffset), [
+            {'participant_id': p_id, 'minutes': 60} for p_id in range(1, PARTICIPANTS + 1)
+        ])
+        conn.execute(insert(participants_sessions), [
+            {'participant_id': p_id, 'session_id': s_id}
+            for s_id in range(1, len(rows) + 1)
+            for p_id in rng.sample(range(1, PARTICIPANTS + 1), 10)
+        ])
+    engine.dispose()
+    now = datetime.now()
+    return [i + 1 for i, row in enumerate(rows) if now < row['date_time'] < now + timedelta(days=DAYS_AHEAD - 1)]
+
+
+class Replies:
+    """Ждёт ответов бота в чат; слушатель заглушки вызывается из её потоков."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        # чат -> (сколько ответов ждём, future, времена пришедших)
+        self.pending: Dict[int, Tuple[int, asyncio.Future, List[float]]] = {}
+        self.other = 0
+
+    def listener(self, chat_id: int, at: float, method: str, params: Dict[str, Any]):
+        self.loop.call_soon_threadsafe(self.arrived, chat_id, at)
+
+    def arrived(self, chat_id: int, at: float):
+        st = self.pending.get(chat_id)
+        if not st:
+            # уведомления записанным участникам и хвосты потерянных шагов
+            self.other += 1
+            return
+        count, fut, times = st
+        times.append(at)
+        if len(times) >= count and not fut.done():
+            fut.set_result(times)
+
+    async def wait(self, chat_id: int, count: int, timeout: float) -> Optional[List[float]]:
+        fut = self.loop.create_future()
+        self.pending[chat_id] = (count, fut, [])
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.pending.pop(chat_id, None)
+
+
+class Driver:
+
+    def __init__(self, api: FakeBotApi, replies: Replies, args, upcoming: List[int]):
+        self.api = api
+        self.replies = replies
+        self.args = args
+        self.upcoming = upcoming
+        self.update_ids = itertools.count(1)
+        self.latency: Dict[str, List[float]] = defaultdict(list)
+        self.lost: Dict[str, int] = defaultdict(int)
+        self.handled = 0
+
+    async def step(self, name: str, chat_id: int, update_for, replies: int = 1) -> bool:
+        """Выдаёт апдейт и ждёт replies ответов; задержка - до первого."""
+        upd = update_for(next(self.update_ids))
+        # ожидание регистрируем до выдачи апдейта, чтобы быстрый ответ не потерялся
+        waiter = asyncio.ensure_future(self.replies.wait(chat_id, replies, self.args.timeout))
+        await asyncio.sleep(0)
+        t0 = time.perf_counter()
+        self.api.push([upd])
+        times = await waiter
+        if times is None:
+            self.lost[name] += 1
+            return False
+        self.latency[name].append((times[0] - t0) * 1000)
+        self.handled += 1
+        if self.args.think:
+            await asyncio.sleep(self.args.think)
+        return True
+
+    async def student(self, chat_id: int, rng: random.Random):
+        today = date.today()
+        nxt = date(today.year + today.month // 12, today.month % 12 + 1, 1)
+        if not await self.step('schedule', chat_id, lambda u: text_update(u, chat_id, 'Расписание')):
+            return
+        if not await self.step('calendar_nav', chat_id,
+                               lambda u: callback_update(u, chat_id, f'calendar_nav_{nxt.year}_{nxt.month}')):
+            return
+        day = rng.randint(1, 28)
+        await self.step('schedule_day', chat_id,
+                        lambda u: callback_update(u, chat_id, f'schedule_day_{nxt.year}_{nxt.month}_{day}'))
+
+    async def profile(self, chat_id: int, has_profile: Dict[int, bool]):
+        if not await self.step('profile', chat_id, lambda u: text_update(u, chat_id, 'Профиль')):
+            return
+        if has_profile.get(chat_id):
+            return
+        if not await self.step('profile_fio', chat_id, lambda u: text_update(u, chat_id, f'Пользователь {chat_id}')):
+            return
+        if await self.step('profile_group', chat_id, lambda u: text_update(u, chat_id, 'P2024')):
+            has_profile[chat_id] = True
+
+    async def teacher(self, chat_id: int, rng: random.Random):
+        s_id = rng.choice(self.upcoming)
+        steps = [
+            ('teacher_list', lambda u: text_update(u, chat_id, 'Мои занятия'), 1),
+            ('teacher_select', lambda u: callback_update(u, chat_id, f'manage_session_{s_id}'), 1),
+            ('teacher_edit', lambda u: callback_update(u, chat_id, 'edit_session_location'), 1),
+            ('teacher_value', lambda u: text_update(u, chat_id, f'Ауд. {rng.randrange(100, 200)}'), 1),
+            # правка и "Возвращаюсь в меню преподавателя" - два ответа
+            ('teacher_apply', lambda u: callback_update(u, chat_id, 'apply_session_draft'), 2),
+        ]
+        for name, make, count in steps:
+            if not await self.step(name, chat_id, make, count):
+                # диалог мог остаться посреди ConversationHandler - сбрасываем
+                await self.step('teacher_cancel', chat_id, lambda u: text_update(u, chat_id, '/cancel'))
+                return
+
+    async def user(self, chat_id: int, teacher: bool, deadline: float, has_profile: Dict[int, bool]):
+        rng = random.Random(chat_id)
+        while time.perf_counter() < deadline:
+            if teacher:
+                await self.teacher(chat_id, rng)
+            elif rng.random() < 0.8:
+                await self.student(chat_id, rng)
+            else:
+                await self.profile(chat_id, has_profile)
+
+
+async def run(args, main):
+    api = FakeBotApi(latency=args.latency, rate_limit=args.rate_limit, retry_after=args.retry_after,
+                     seed=args.seed).start()
+    replies = Replies(asyncio.get_running_loop())
+    api.on_reply.append(replies.listener)
+
+    teachers = [TEACHER_CHAT_BASE + i for i in range(args.teachers)]
+    main.TEACHER_IDS.extend(teachers)
+    application = main.buildbotapp(Application.builder().token(TOKEN).base_url(api.base_url))
+    await application.initialize()
+    await main.start_reminders(application)
+    await application.start()
+    await application.updater.start_polling(timeout=10, poll_interval=0, allowed_updates=main.ALLOWED_UPDATES)
+
+    driver = Driver(api, replies, args, args.upcoming)
+    has_profile: Dict[int, bool] = {}
+    t0 = time.perf_counter()
+    deadline = t0 + args.duration
+    await asyncio.gather(
+        *(driver.user(USER_CHAT_BASE + i, False, deadline, has_profile) for i in range(args.users)),
+        *(driver.user(chat_id, True, deadline, has_profile) for chat_id in teachers),
+    )
+    elapsed = time.perf_counter() - t0
+
+    await application.updater.stop()
+    await application.stop()
+    await main.stop_reminders(application)
+    await application.shutdown()
+    api.stop()
+    return driver, elapsed, replies.other, api.limited
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=50, help='студентов (свои чаты)')
+    parser.add_argument('--teachers', type=int, default=5)
+    parser.add_argument('--duration', type=float, default=30, help='секунд нагрузки')
+    parser.add_argument('--think', type=float, default=0.2, help='пауза пользователя между шагами, с')
+    parser.add_argument('--latency', type=float, default=0.02, help='время ответа заглушки на отправку, с')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='доля ответов в чат, получающих 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=10, help='сколько ждать ответа на шаг, с')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='bot_load_')
+    path = os.path.join(work_dir, 'bot.db')
+    args.upcoming = seed(path, random.Random(args.seed))
+    # main читает конфиг при импорте: БД подменяется до него
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    import main as bot_main
+
+    driver, elapsed, other, limited = asyncio.run(run(args, bot_main))
+
+    print(f"{'step':<16}{'n':>7}{'lost':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for name in sorted(set(driver.latency) | set(driver.lost)):
+        lat = sorted(driver.latency.get(name, []))
+        if lat:
+            p = lambda q: lat[min(len(lat) - 1, int(len(lat) * q))]
+            print(f"{name:<16}{len(lat):>7}{driver.lost[name]:>6}{statistics.median(lat):>9.1f}{p(0.95):>9.1f}{p(0.99):>9.1f}")
+        else:
+            print(f"{name:<16}{0:>7}{driver.lost[name]:>6}")
+    print(f"\nanswered updates: {driver.handled} in {elapsed:.1f}s = {driver.handled / elapsed:.1f} upd/s")
+    print(f"other chat messages (notifications): {other}, injected 429: {limited}")
+
+
+if __name__ == '__main__':
+    main()
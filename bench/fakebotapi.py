@@ -0,0 +1,202 @@
+"""Локальная заглушка Bot API для стендов: бот ходит в неё вместо api.telegram.org.
+
+Отдаёт getMe, long-poll getUpdates из очереди push(), на sendMessage/
+editMessageText/editMessageReplyMarkup возвращает правдоподобное сообщение,
+на остальное (answerCallbackQuery, deleteWebhook, ...) - true. Все вызовы
+методов пишутся в calls с временем, чтобы стенд мог мерить задержку до
+ответа бота; ответы в чат дополнительно передаются слушателям on_reply.
+rate_limit - доля ответов в чат, на которые приходит 429 с retry_after,
+как при превышении лимитов настоящего API.
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Tuple
+from urllib.parse import parse_qs
+
+TOKEN = '123456:TEST'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Stand', 'username': 'stand_bot'}
+REPLY_METHODS = ('sendMessage', 'editMessageText', 'editMessageReplyMarkup')
+
+
+class TooManyRequests(Exception):
+
+    def __init__(self, retry_after: int):
+        self.retry_after = retry_after
+
+
+def parse_params(body: bytes, content_type: str) -> Dict[str, Any]:
+    if not body:
+        return {}
+    if content_type.startswith('application/json'):
+        return json.loads(body)
+    params = {}
+    for key, values in parse_qs(body.decode()).items():
+        # PTB шлёт форму, значения не-строк закодированы в JSON
+        try:
+            params[key] = json.loads(values[0])
+        except ValueError:
+            params[key] = values[0]
+    return params
+
+
+class FakeBotApi:
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, net_delay: float = 0.0,
+                 rate_limit: float = 0.0, retry_after: int = 1, seed: int = 0):
+        # latency - время ответа на методы отправки, net_delay - задержка сети в одну
+        # сторону для getUpdates (запрос и ответ), как до настоящего api.telegram.org
+        self.latency = latency
+        self.net_delay = net_delay
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.cond = threading.Condition()
+        self.updates: List[Dict[str, Any]] = []
+        self.calls: List[Tuple[float, str, Dict[str, Any]]] = []
+        self.limited = 0
+        # слушатели ответов в чат: (chat_id, время, метод, параметры), зовутся из потоков сервера
+        self.on_reply: List[Callable[[int, float, str, Dict[str, Any]], None]] = []
+        self.message_id = 0
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/bot'
+
+    def start(self) -> 'FakeBotApi':
+        self.thread.start()
+        return self
+
+    def stop(self):
+        with self.cond:
+            self.cond.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def push(self, updates: List[Dict[str, Any]]):
+        with self.cond:
+            self.updates.extend(updates)
+            self.cond.notify_all()
+
+    def calls_of(self, method: str) -> List[Tuple[float, Dict[str, Any]]]:
+        with self.cond:
+            return [(t, p) for t, m, p in self.calls if m == method]
+
+    def get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        deadline = time.monotonic() + float(params.get('timeout') or 0)
+        with self.cond:
+            # подтверждённые offset'ом апдейты больше не отдаём
+            self.updates = [u for u in self.updates if u['update_id'] >= offset]
+            while not self.updates:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return []
+                self.cond.wait(left)
+            return self.updates[:limit]
+
+    def call(self, method: str, params: Dict[str, Any]) -> Any:
+        with self.cond:
+            self.calls.append((time.perf_counter(), method, params))
+            limited = method in REPLY_METHODS and self.rate_limit and self.rng.random() < self.rate_limit
+            if limited:
+                self.limited += 1
+        if limited:
+            raise TooManyRequests(self.retry_after)
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getUpdates':
+            time.sleep(self.net_delay)
+            res = self.get_updates(params)
+            time.sleep(self.net_delay)
+            return res
+        if self.latency:
+            time.sleep(self.latency)
+        if method in REPLY_METHODS:
+            with self.cond:
+                self.message_id += 1
+                message_id = self.message_id
+            chat_id = int(params.get('chat_id') or 0)
+            for fn in self.on_reply:
+                fn(chat_id, time.perf_counter(), method, params)
+            return {
+                'message_id': params.get('message_id') or message_id,
+                'date': int(time.time()),
+                'chat': {'id': params.get('chat_id') or 0, 'type': 'private'},
+                'from': BOT_USER,
+                'text': params.get('text', ''),
+            }
+        return True
+
+    def handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                method = self.path.rsplit('/', 1)[-1]
+                params = parse_params(body, self.headers.get('Content-Type', ''))
+                status = 200
+                try:
+                    out = json.dumps({'ok': True, 'result': api.call(method, params)}).encode()
+                except TooManyRequests as e:
+                    status = 429
+                    out = json.dumps({
+                        'ok': False,
+                        'error_code': 429,
+                        'description': f'Too Many Requests: retry after {e.retry_after}',
+                        'parameters': {'retry_after': e.retry_after},
+                    }).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def text_update(update_id: int, chat_id: int, text: str) -> Dict[str, Any]:
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': f'User {chat_id}'},
+        'text': text,
+    }
+    if text.startswith('/'):
+        # без entity CommandHandler не распознает команду
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+def callback_update(update_id: int, chat_id: int, data: str, message_id: int = 1) -> Dict[str, Any]:
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'chat_instance': str(chat_id),
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': f'User {chat_id}'},
+            'data': data,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': '...',
+            },
+        },
+    }
+
@@ -0,0 +1,123 @@
+"""Конкурентная нагрузка чтение/запись на SQLite: профиль default против tuned.
+
+Запуск: python bench/sqlite_concurrency.py [--seconds 5] [--writers 4] [--readers 8]
+Каждый профиль работает со своим временным файлом БД.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, select, insert, func
+from sqlalchemy.exc import OperationalError
+
+from config import Config
+from extensions import db, sqlite_pragmas, apply_sqlite_pragmas
+from models import Course, Session
+
+BASE_DT = datetime(2025, 1, 1, 8, 0)
+
+
+def make_engine(path: str, profile: str):
+    config = {k: getattr(Config, k) for k in dir(Config) if k.isupper()}
+    config['SQLITE_PROFILE'] = profile
+    if profile == 'default':
+        engine = create_engine(f'sqlite:///{path}')
+    else:
+        engine = create_engine(f'sqlite:///{path}', **Config.SQLALCHEMY_ENGINE_OPTIONS)
+    apply_sqlite_pragmas(engine, sqlite_pragmas(config))
+    return engine
+
+
+def seed(engine, sessions: int):
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Course), [{'name': f'Курс {i}'} for i in range(20)])
+        conn.execute(insert(Session), [
+            {
+                'course_id': i % 20 + 1,
+                'date_time': BASE_DT + timedelta(minutes=37 * i),
+                'status': 'planned',
+                'five_min_warn_sent': False,
+            }
+            for i in range(sessions)
+        ])
+
+
+def run(profile: str, seconds: float, writers: int, readers: int, sessions: int):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    engine = make_engine(path, profile)
+    seed(engine, sessions)
+    stop = time.monotonic() + seconds
+    counts = {'reads': 0, 'writes': 0, 'locked': 0}
+    lock = threading.Lock()
+
+    def bump(key):
+        with lock:
+            counts[key] += 1
+
+    def writer():
+        rnd = random.Random()
+        while time.monotonic() < stop:
+            try:
+                with engine.begin() as conn:
+                    conn.execute(insert(Session).values(
+                        course_id=rnd.randint(1, 20),
+                        date_time=BASE_DT + timedelta(minutes=rnd.randint(0, 37 * sessions)),
+                        status='planned',
+                        five_min_warn_sent=False,
+                    ))
+                bump('writes')
+            except OperationalError:
+                bump('locked')
+
+    def reader():
+        rnd = random.Random()
+        while time.monotonic() < stop:
+            day = BASE_DT + timedelta(days=rnd.randint(0, 37 * sessions // 1440))
+            try:
+                with engine.connect() as conn:
+                    conn.execute(
+                        select(func.count()).select_from(Session)
+                        .where(Session.date_time >= day, Session.date_time < day + timedelta(days=1))
+                    ).scalar()
+                bump('reads')
+            except OperationalError:
+                bump('locked')
+
+    threads = [threading.Thread(target=writer) for _ in range(writers)]
+    threads += [threading.Thread(target=reader) for _ in range(readers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    engine.dispose()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    return {k: v / seconds for k, v in counts.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--sessions', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'profile':<10}{'reads/s':>12}{'writes/s':>12}{'locked/s':>12}")
+    for profile in ('default', 'tuned'):
+        res = run(profile, args.seconds, args.writers, args.readers, args.sessions)
+        print(f"{profile:<10}{res['reads']:>12.0f}{res['writes']:>12.0f}{res['locked']:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
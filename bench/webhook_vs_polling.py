@@ -0,0 +1,164 @@
+"""Доставка апдейтов до обработчика: long polling против вебхука.
+
+Запуск: python bench/webhook_vs_polling.py [--updates 2000] [--chats 200]
+        [--rate 200] [--net-delay 0.04] [--batch 1] [--recorded updates.jsonl]
+
+Апдейты (записанные, по одному JSON в строке, или сгенерированные)
+выпускаются с заданной частотой. При polling бот забирает их из заглушки
+Bot API через getUpdates. При вебхуке стенд шлёт их POST-ом на
+webhook.make_webhook_app. В обоих режимах сеть моделируется одинаковой
+задержкой в одну сторону (--net-delay). Меряется время от выпуска апдейта
+до входа в обработчик и общая пропускная способность. rate=0 - все апдейты
+сразу (всплеск).
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+from telegram import Update
+from telegram.ext import Application, CallbackQueryHandler, MessageHandler, filters
+
+from chatorder import ChatOrderedUpdateProcessor
+from fakebotapi import FakeBotApi, TOKEN, text_update, callback_update
+from webhook import SECRET_HEADER, WebhookServer, make_webhook_app
+
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+SECRET = 'bench-secret'
+
+
+def load_updates(args) -> List[Dict[str, Any]]:
+    if args.recorded:
+        with open(args.recorded) as f:
+            updates = [json.loads(line) for line in f if line.strip()]
+        for i, upd in enumerate(updates, 1):
+            upd['update_id'] = i
+        return updates
+    updates = []
+    for i in range(1, args.updates + 1):
+        chat_id = 1000 + i % args.chats
+        if i % 3:
+            updates.append(text_update(i, chat_id, 'Расписание'))
+        else:
+            updates.append(callback_update(i, chat_id, f'schedule_day_2025_1_{i % 28 + 1}'))
+    return updates
+
+
+def build_app(api: FakeBotApi, received: Dict[int, float], done: threading.Event, total: int) -> Application:
+    application = (
+        Application.builder().token(TOKEN).base_url(api.base_url)
+        .concurrent_updates(ChatOrderedUpdateProcessor(concurrency=32, max_pending=1024))
+        .build()
+    )
+
+    async def record(update: Update, context):
+        received[update.update_id] = time.perf_counter()
+        if len(received) >= total:
+            done.set()
+
+    application.add_handler(MessageHandler(filters.ALL, record))
+    application.add_handler(CallbackQueryHandler(record))
+    return application
+
+
+def release(updates, rate: float, batch: int, send):
+    """Выпускает апдейты пачками по batch с частотой rate апдейтов/с; возвращает моменты выпуска."""
+    sent_at: Dict[int, float] = {}
+    t0 = time.perf_counter()
+    for i in range(0, len(updates), batch):
+        chunk = updates[i:i + batch]
+        if rate:
+            wait = t0 + i / rate - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        now = time.perf_counter()
+        for upd in chunk:
+            sent_at[upd['update_id']] = now
+        send(chunk)
+    return sent_at
+
+
+async def run_mode(mode: str, updates, args) -> Dict[str, float]:
+    api = FakeBotApi(net_delay=args.net_delay).start()
+    received: Dict[int, float] = {}
+    done = threading.Event()
+    application = build_app(api, received, done, len(updates))
+    loop = asyncio.get_running_loop()
+    await application.initialize()
+    await application.start()
+
+    server = None
+    if mode == 'polling':
+        await application.updater.start_polling(timeout=10, allowed_updates=ALLOWED_UPDATES)
+
+        def send(chunk):
+            api.push(chunk)
+    else:
+        server = WebhookServer(make_webhook_app(application, loop, SECRET, '/telegram'), '127.0.0.1', 0)
+        server.start()
+        client = httpx.Client(base_url=f'http://127.0.0.1:{server.port}', headers={SECRET_HEADER: SECRET})
+        posters = ThreadPoolExecutor(max_workers=32)
+
+        def post(chunk):
+            # телеграм доставляет вебхук с той же задержкой сети
+            time.sleep(args.net_delay)
+            body = chunk if args.batch > 1 else chunk[0]
+            client.post('/telegram', json=body).raise_for_status()
+
+        def send(chunk):
+            posters.submit(post, chunk)
+
+    t0 = time.perf_counter()
+    sent_at = await asyncio.to_thread(release, updates, args.rate, args.batch, send)
+    await asyncio.to_thread(done.wait, 60)
+    elapsed = max(received.values()) - t0 if received else float('nan')
+
+    if mode == 'polling':
+        await application.updater.stop()
+    else:
+        posters.shutdown()
+        client.close()
+        server.stop()
+    await application.stop()
+    await application.shutdown()
+    api.stop()
+
+    lat = sorted((received[u] - sent_at[u]) * 1000 for u in received)
+    return {
+        'handled': len(received),
+        'rate': len(received) / elapsed,
+        'p50': statistics.median(lat),
+        'p95': lat[int(len(lat) * 0.95)],
+        'max': lat[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--chats', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=200, help='апдейтов в секунду, 0 - всплеск')
+    parser.add_argument('--net-delay', type=float, default=0.04, help='задержка сети в одну сторону, с')
+    parser.add_argument('--batch', type=int, default=1, help='апдейтов в одном POST вебхука')
+    parser.add_argument('--recorded', help='файл с записанными апдейтами, JSON в строке')
+    args = parser.parse_args()
+
+    updates = load_updates(args)
+    print(f"{'mode':<10}{'handled':>9}{'upd/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}")
+    for mode in ('polling', 'webhook'):
+        res = asyncio.run(run_mode(mode, updates, args))
+        print(f"{mode:<10}{res['handled']:>9}{res['rate']:>9.0f}{res['p50']:>9.1f}{res['p95']:>9.1f}{res['max']:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import datetime
+import json
+import logging
+from typing import Any, Callable, Dict, List
+
+from sqlalchemy import select, insert, delete, func
+from sqlalchemy.engine import Connection
+
+from models import BusEvent
+
+logger = logging.getLogger(__name__)
+
+handlers: Dict[str, List[Callable[[Any], None]]] = {}
+
+
+def on_event(kind: str):
+    """Обработчик событий шины в процессе бота. Должен быть идемпотентным:
+    доставка "хотя бы один раз", свои же события процесс тоже получает."""
+    def register(fn: Callable[[Any], None]):
+        handlers.setdefault(kind, []).append(fn)
+        return fn
+    return register
+
+
+def publish(conn: Connection, kind: str, payload: Any):
+    """Пишет событие в транзакции вызывающего: уйдёт только вместе с изменением."""
+    conn.execute(insert(BusEvent).values(
+        kind=kind,
+        payload=json.dumps(payload, default=str),
+        created_at=datetime.datetime.now()
+    ))
+
+
+def head_query():
+    return select(func.coalesce(func.max(BusEvent.id), 0))
+
+
+def fetch_query(after: int, limit: int):
+    return (
+        select(BusEvent.id, BusEvent.kind, BusEvent.payload)
+        .where(BusEvent.id > after)
+        .order_by(BusEvent.id)
+        .limit(limit)
+    )
+
+
+def prune_query(before: datetime.datetime):
+    return delete(BusEvent).where(BusEvent.created_at < before)
+
+
+def dispatch(rows) -> int:
+    """Раздаёт события по порядку id, возвращает id последнего."""
+    last = 0
+    for e_id, kind, payload in rows:
+        data = json.loads(payload)
+        for fn in handlers.get(kind, []):
+            try:
+                fn(data)
+            except Exception:
+                logger.exception("bus handler %s failed on event %s", fn.__name__, e_id)
+        last = e_id
+    return last
@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+MISSING = object()
+
+
+class TTLCache:
+    """LRU-кэш с временем жизни записей. Потокобезопасный: инвалидация
+    приходит и из flask-потока, и из потоков бота."""
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        with self.lock:
+            item = self.data.get(key)
+            if item is not None:
+                value, expires = item
+                if expires is None or expires > time.monotonic():
+                    self.data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self.lock:
+            self.data[key] = (value, expires)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+
+class AsyncLoadingCache(TTLCache):
+    """TTLCache, который сам загружает промах через async loader.
+
+    Одновременные промахи по одному ключу ждут одну загрузку. Если во время
+    загрузки была любая инвалидация, её результат в кэш не попадает.
+    """
+
+    def __init__(self, loader: Callable[[Hashable], Awaitable[Any]], maxsize: int = 1024, ttl: Optional[float] = None):
+        super().__init__(maxsize, ttl)
+        self.loader = loader
+        self.inflight: Dict[Hashable, asyncio.Future] = {}
+        self.epoch = 0
+
+    async def load(self, key: Hashable) -> Any:
+        value = self.get(key)
+        if value is not MISSING:
+            return value
+        fut = self.inflight.get(key)
+        if fut is not None:
+            return await asyncio.shield(fut)
+
+        fut = asyncio.get_running_loop().create_future()
+        self.inflight[key] = fut
+        epoch = self.epoch
+        try:
+            value = await self.loader(key)
+            if self.epoch == epoch:
+                self.set(key, value)
+            fut.set_result(value)
+            return value
+        except Exception as e:
+            fut.set_exception(e)
+            # чтобы не было "Future exception was never retrieved", если никто не ждал
+            fut.exception()
+            raise
+        finally:
+            self.inflight.pop(key, None)
+            if not fut.done():
+                # загрузку отменили - ждущие получат CancelledError
+                fut.cancel()
+
+    def invalidate(self, key: Hashable):
+        with self.lock:
+            self.epoch += 1
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.epoch += 1
+            self.data.clear()
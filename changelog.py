@@ -0,0 +1,74 @@
+import datetime
+import threading
+from typing import List, Tuple
+
+from sqlalchemy import event, insert, select
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session as OrmSession
+
+from events import SessionChange, on_sessions_flushed
+from models import ChangeLog, Course
+
+# будит ожидающих /changes после коммита в этом процессе; записи других
+# процессов (бот, соседние воркеры) ожидающие замечают по таймауту опроса
+written = threading.Condition()
+
+
+def record(conn: Connection, entity: str, items: List[Tuple[int, str]]):
+    """Пишет (id, op) в журнал в транзакции вызывающего."""
+    if not items:
+        return
+    conn.info['changelog_written'] = True
+    now = datetime.datetime.now()
+    conn.execute(insert(ChangeLog), [
+        {'entity': entity, 'entity_id': e_id, 'op': op, 'created_at': now} for e_id, op in items
+    ])
+
+
+def fetch_query(since: int, limit: int):
+    return (
+        select(ChangeLog.seq, ChangeLog.entity, ChangeLog.entity_id, ChangeLog.op)
+        .where(ChangeLog.seq > since)
+        .order_by(ChangeLog.seq)
+        .limit(limit)
+    )
+
+
+def wait(timeout: float):
+    with written:
+        written.wait(timeout)
+
+
+@on_sessions_flushed
+def log_session_changes(conn: Connection, changes: List[SessionChange]):
+    # записи на занятие приходят сюда же: меняют состав участников в снимке занятия
+    record(conn, 'session', [(ch.session_id, 'delete' if ch.deleted else 'upsert') for ch in changes])
+
+
+@event.listens_for(OrmSession, 'after_flush')
+def collect_course_changes(orm_session, flush_context):
+    items = [(obj, 'upsert') for obj in orm_session.new if isinstance(obj, Course)]
+    items += [(obj, 'upsert') for obj in orm_session.dirty
+              if isinstance(obj, Course) and orm_session.is_modified(obj, include_collections=False)]
+    items += [(obj, 'delete') for obj in orm_session.deleted if isinstance(obj, Course)]
+    if items:
+        orm_session.info['flushed_courses'] = [(obj.id, op) for obj, op in items]
+
+
+@event.listens_for(OrmSession, 'after_flush_postexec')
+def log_course_changes(orm_session, flush_context):
+    items = orm_session.info.pop('flushed_courses', None)
+    if items:
+        record(orm_session.connection(), 'course', items)
+
+
+@event.listens_for(Engine, 'commit')
+def wake_waiters(conn):
+    if conn.info.pop('changelog_written', False):
+        with written:
+            written.notify_all()
+
+
+@event.listens_for(Engine, 'rollback')
+def forget_written(conn):
+    conn.info.pop('changelog_written', None)
@@ -0,0 +1,59 @@
+import asyncio
+from typing import Any, Awaitable, Dict, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+def chat_key(update: object) -> Optional[int]:
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return None
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Апдейты разных чатов обрабатываются параллельно, одного чата - строго по очереди.
+
+    Так ConversationHandler видит шаги диалога в исходном порядке, а медленный
+    обработчик (рассылка после правки занятия) держит только свой чат.
+    concurrency - сколько апдейтов выполняется одновременно; max_pending -
+    сколько всего может ждать (ограничение базового класса). Апдейт, ждущий
+    свой чат, слот выполнения не занимает.
+    """
+
+    def __init__(self, concurrency: int, max_pending: int):
+        super().__init__(max(max_pending, concurrency))
+        self.concurrency = concurrency
+        self.running = asyncio.Semaphore(concurrency)
+        # чат -> (блокировка, сколько апдейтов её ждут или держат)
+        self.chats: Dict[int, Tuple[asyncio.Lock, int]] = {}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        self.chats.clear()
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = chat_key(update)
+        if key is None:
+            async with self.running:
+                await coroutine
+            return
+
+        lock, users = self.chats.get(key) or (asyncio.Lock(), 0)
+        self.chats[key] = (lock, users + 1)
+        try:
+            async with lock:
+                async with self.running:
+                    await coroutine
+        finally:
+            lock, users = self.chats[key]
+            if users == 1:
+                del self.chats[key]
+            else:
+                self.chats[key] = (lock, users - 1)
@@ -3,9 +3,67 @@ import os
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 class Config:
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'sqdb.db')
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///' + os.path.join(basedir, 'sqdb.db'))
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # профиль SQLite: flask-поток, потоки бота и job queue пишут в один файл.
+    # SQLITE_PROFILE=default оставляет настройки sqlite как есть
+    SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'tuned')
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 64 * 1024))
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_POOL_OVERFLOW', 20)),
+        'pool_timeout': 30,
+        'connect_args': {'timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)) / 1000},
+    }
     TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', "8040223094:AAElyrJhhiWa0BNUruceJJcwgeYmoHk6Y68")
     DEVELOPER_CHAT_ID = os.environ.get('DEVELOPER_CHAT_ID', "1397562239")
     SECRET_KEY = os.environ.get('SECRET_KEY', 'super-root')
-    TEACHER_IDS = [int(os.environ.get('DEVELOPER_CHAT_ID', "1397562239"))]
\ No newline at end of file
+    TEACHER_IDS = [int(os.environ.get('DEVELOPER_CHAT_ID', "1397562239"))]
+    NOTIFY_RATE_PER_SEC = float(os.environ.get('NOTIFY_RATE_PER_SEC', 30))
+    NOTIFY_CHAT_INTERVAL_SEC = float(os.environ.get('NOTIFY_CHAT_INTERVAL_SEC', 1.0))
+    NOTIFY_CONCURRENCY = int(os.environ.get('NOTIFY_CONCURRENCY', 20))
+    NOTIFY_MAX_RETRIES = int(os.environ.get('NOTIFY_MAX_RETRIES', 3))
+    OUTBOX_POLL_INTERVAL_SEC = float(os.environ.get('OUTBOX_POLL_INTERVAL_SEC', 2))
+    OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 50))
+    OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 5))
+    # смещения напоминаний в минутах, которые участник может включить в боте
+    REMINDER_OFFSETS = [int(m) for m in os.environ.get('REMINDER_OFFSETS', '1440,60,5').split(',')]
+    REMINDER_BATCH_SIZE = int(os.environ.get('REMINDER_BATCH_SIZE', 500))
+    DB_EXECUTOR_WORKERS = int(os.environ.get('DB_EXECUTOR_WORKERS', 4))
+    DB_EXECUTOR_QUEUE = int(os.environ.get('DB_EXECUTOR_QUEUE', 64))
+    # BOT_CONCURRENT_UPDATES=1 - прежняя последовательная обработка
+    BOT_CONCURRENT_UPDATES = int(os.environ.get('BOT_CONCURRENT_UPDATES', 32))
+    BOT_MAX_PENDING_UPDATES = int(os.environ.get('BOT_MAX_PENDING_UPDATES', 1024))
+    # polling или webhook. Без WEBHOOK_URL вебхук не регистрируется в телеграме:
+    # апдейты шлёт внешний прокси или тестовый стенд, и WEBHOOK_SECRET обязателен -
+    # без него бот в режиме webhook не запускается
+    BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+    WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+    WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+    WEBHOOK_LISTEN = os.environ.get('WEBHOOK_LISTEN', '0.0.0.0')
+    WEBHOOK_PORT = int(os.environ.get('WEBHOOK_PORT', 8443))
+    WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/telegram')
+    API_DEBUG = os.environ.get('API_DEBUG', '') in ('1', 'true')
+    # шина событий API -> бот
+    BUS_POLL_INTERVAL_SEC = float(os.environ.get('BUS_POLL_INTERVAL_SEC', 0.5))
+    BUS_BATCH_SIZE = int(os.environ.get('BUS_BATCH_SIZE', 500))
+    BUS_RETENTION_SEC = int(os.environ.get('BUS_RETENTION_SEC', 3600))
+    PROFILE_CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE', 10000))
+    PROFILE_CACHE_TTL_SEC = float(os.environ.get('PROFILE_CACHE_TTL_SEC', 300))
+    # TTL страхует от правок курсов, которые не сбрасывают кэш дня
+    DAY_CACHE_SIZE = int(os.environ.get('DAY_CACHE_SIZE', 366))
+    DAY_CACHE_TTL_SEC = float(os.environ.get('DAY_CACHE_TTL_SEC', 3600))
+    CALENDAR_CACHE_SIZE = int(os.environ.get('CALENDAR_CACHE_SIZE', 64))
+    # тела GET /schedule и /sessions/<id> по версии данных
+    RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 512))
+    # как часто ожидающий /changes перечитывает журнал (записи других процессов)
+    CHANGES_POLL_SEC = float(os.environ.get('CHANGES_POLL_SEC', 1.0))
+    # фиды .ics: сколько дней прошлого отдавать и IANA-пояс для времени занятий (пусто - плавающее)
+    ICAL_PAST_DAYS = int(os.environ.get('ICAL_PAST_DAYS', 30))
+    ICAL_TIMEZONE = os.environ.get('ICAL_TIMEZONE', '')
+    # до какой даты вперёд разворачиваются серии без конца, если запрос не задал окно
+    SERIES_HORIZON_DAYS = int(os.environ.get('SERIES_HORIZON_DAYS', 180))
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+
+class DbBusy(Exception):
+    """Очередь пула БД заполнена, работа не принята."""
+
+
+class FuncStats:
+
+    def __init__(self):
+        self.calls = 0
+        self.rejected = 0
+        self.errors = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.run_total = 0.0
+        self.run_max = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'calls': self.calls,
+            'rejected': self.rejected,
+            'errors': self.errors,
+            'wait_avg_ms': self.wait_total / self.calls * 1000 if self.calls else 0.0,
+            'wait_max_ms': self.wait_max * 1000,
+            'run_avg_ms': self.run_total / self.calls * 1000 if self.calls else 0.0,
+            'run_max_ms': self.run_max * 1000,
+        }
+
+
+class DbExecutor:
+    """Отдельный пул потоков для блокирующей работы с БД.
+
+    Не больше workers + max_queue задач одновременно: лишние сразу получают
+    DbBusy вместо того, чтобы копиться. По каждой функции считает время
+    ожидания в очереди и время выполнения.
+    """
+
+    def __init__(self, workers: int = 4, max_queue: int = 64):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='db')
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.pending_max = 0
+        self.stats: Dict[str, FuncStats] = {}
+
+    def func_stats(self, name: str) -> FuncStats:
+        st = self.stats.get(name)
+        if st is None:
+            st = self.stats[name] = FuncStats()
+        return st
+
+    async def run(self, fn: Callable, *args, reject: bool = True) -> Any:
+        """reject=False - работу нельзя терять (запись после отправки), ставится сверх лимита."""
+        name = fn.__name__
+        with self.lock:
+            if reject and self.pending >= self.workers + self.max_queue:
+                self.func_stats(name).rejected += 1
+                raise DbBusy(name)
+            self.pending += 1
+            self.pending_max = max(self.pending_max, self.pending)
+        submitted = time.perf_counter()
+
+        def call():
+            started = time.perf_counter()
+            ok = False
+            try:
+                res = fn(*args)
+                ok = True
+                return res
+            finally:
+                finished = time.perf_counter()
+                with self.lock:
+                    self.pending -= 1
+                    st = self.func_stats(name)
+                    st.calls += 1
+                    st.errors += not ok
+                    st.wait_total += started - submitted
+                    st.wait_max = max(st.wait_max, started - submitted)
+                    st.run_total += finished - started
+                    st.run_max = max(st.run_max, finished - started)
+
+        return await asyncio.get_running_loop().run_in_executor(self.pool, call)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'pending': self.pending,
+                'pending_max': self.pending_max,
+                'funcs': {name: st.as_dict() for name, st in self.stats.items()},
+            }
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
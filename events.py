@@ -0,0 +1,119 @@
+from typing import Any, Callable, Dict, List, Optional
+import datetime
+
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session as OrmSession
+
+from models import Session
+
+
+class SessionChange:
+    """Что случилось с занятием в закоммиченной транзакции."""
+
+    def __init__(self, session_id: int, date_time: Optional[datetime.datetime], status: Optional[str],
+                 old_date_time: Optional[datetime.datetime] = None, deleted: bool = False,
+                 registration: bool = False):
+        self.session_id = session_id
+        self.date_time = date_time
+        self.status = status
+        self.old_date_time = old_date_time
+        self.deleted = deleted
+        # поменялся только состав записавшихся, журнал напоминаний уже обновлён по парам
+        self.registration = registration
+
+    def dates(self) -> List[datetime.date]:
+        return sorted({dt.date() for dt in (self.date_time, self.old_date_time) if dt})
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'session_id': self.session_id,
+            'date_time': self.date_time.isoformat() if self.date_time else None,
+            'status': self.status,
+            'old_date_time': self.old_date_time.isoformat() if self.old_date_time else None,
+            'deleted': self.deleted,
+            'registration': self.registration,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'SessionChange':
+        parse = lambda v: datetime.datetime.fromisoformat(v) if v else None
+        return cls(data['session_id'], parse(data['date_time']), data['status'],
+                   old_date_time=parse(data['old_date_time']), deleted=data['deleted'],
+                   registration=data.get('registration', False))
+
+
+listeners: List[Callable[[List[SessionChange]], None]] = []
+flush_listeners: List[Callable[[Connection, List[SessionChange]], None]] = []
+
+
+def on_sessions_changed(fn: Callable[[List[SessionChange]], None]):
+    """Слушатель после коммита; вызывается в потоке, который коммитил."""
+    listeners.append(fn)
+    return fn
+
+
+def on_sessions_flushed(fn: Callable[[Connection, List[SessionChange]], None]):
+    """Слушатель внутри транзакции: может писать в БД тем же соединением."""
+    flush_listeners.append(fn)
+    return fn
+
+
+def emit(changes: List[SessionChange]):
+    if not changes:
+        return
+    for fn in listeners:
+        fn(changes)
+
+
+def record_changes(orm_session, changes: List[SessionChange]):
+    """Для записей мимо ORM (Core insert/update), вызывать до коммита: flush-слушатели
+    отрабатывают сразу в той же транзакции, остальные - после коммита."""
+    if not changes:
+        return
+    conn = orm_session.connection()
+    for fn in flush_listeners:
+        fn(conn, changes)
+    orm_session.info.setdefault('session_changes', []).extend(changes)
+
+
+def old_value(obj, attr: str):
+    hist = inspect(obj).attrs[attr].history
+    return hist.deleted[0] if hist.deleted else getattr(obj, attr)
+
+
+@event.listens_for(OrmSession, 'after_flush')
+def collect_session_changes(orm_session, flush_context):
+    # после flush у новых строк уже есть id, у изменённых - история атрибутов
+    changes = []
+    for obj in orm_session.new:
+        if isinstance(obj, Session):
+            changes.append(SessionChange(obj.id, obj.date_time, obj.status))
+    for obj in orm_session.dirty:
+        if isinstance(obj, Session) and orm_session.is_modified(obj):
+            changes.append(SessionChange(obj.id, obj.date_time, obj.status, old_date_time=old_value(obj, 'date_time')))
+    for obj in orm_session.deleted:
+        if isinstance(obj, Session):
+            changes.append(SessionChange(obj.id, None, None, old_date_time=obj.date_time, deleted=True))
+    orm_session.info.setdefault('session_changes', []).extend(changes)
+    orm_session.info['flushed_changes'] = changes
+
+
+@event.listens_for(OrmSession, 'after_flush_postexec')
+def run_flush_listeners(orm_session, flush_context):
+    changes = orm_session.info.pop('flushed_changes', [])
+    if not changes:
+        return
+    conn = orm_session.connection()
+    for fn in flush_listeners:
+        fn(conn, changes)
+
+
+@event.listens_for(OrmSession, 'after_commit')
+def dispatch_session_changes(orm_session):
+    emit(orm_session.info.pop('session_changes', []))
+
+
+@event.listens_for(OrmSession, 'after_rollback')
+def drop_session_changes(orm_session):
+    orm_session.info.pop('session_changes', None)
@@ -1,3 +1,39 @@
+from typing import Any, Dict, List
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+db = SQLAlchemy()
+
+
+def sqlite_pragmas(config: Dict[str, Any]) -> List[str]:
+    if config.get('SQLITE_PROFILE', 'tuned') == 'default':
+        return []
+    return [
+        f"PRAGMA journal_mode={config.get('SQLITE_JOURNAL_MODE', 'WAL')}",
+        f"PRAGMA synchronous={config.get('SQLITE_SYNCHRONOUS', 'NORMAL')}",
+        f"PRAGMA busy_timeout={int(config.get('SQLITE_BUSY_TIMEOUT_MS', 5000))}",
+        f"PRAGMA mmap_size={int(config.get('SQLITE_MMAP_SIZE', 0))}",
+        # отрицательное значение - размер в килобайтах, а не в страницах
+        f"PRAGMA cache_size=-{int(config.get('SQLITE_CACHE_SIZE_KB', 2000))}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+
+
+def apply_sqlite_pragmas(engine: Engine, pragmas: List[str]):
+    """Выполняет pragmas на каждом новом соединении пула."""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_conn, conn_record):
+        cur = dbapi_conn.cursor()
+        for pragma in pragmas:
+            cur.execute(pragma)
+        cur.close()
+
 
-db = SQLAlchemy()
\ No newline at end of file
+def init_storage(app):
+    with app.app_context():
+        apply_sqlite_pragmas(db.engine, sqlite_pragmas(app.config))
@@ -0,0 +1,84 @@
+import datetime
+from typing import Iterable, List, Optional
+from zoneinfo import ZoneInfo
+
+from models import Session
+
+PRODID = '-//xakaton-course//schedule//RU'
+
+STATUSES = {
+    'planned': 'CONFIRMED',
+    'completed': 'CONFIRMED',
+    'rescheduled': 'CONFIRMED',
+    'canceled': 'CANCELLED',
+}
+
+
+def escape(value: str) -> str:
+    return (value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def fold(line: str) -> str:
+    # строки не длиннее 75 байт, продолжение начинается с пробела (RFC 5545, 3.1)
+    out, cur, size = [], '', 0
+    for ch in line:
+        n = len(ch.encode())
+        if size + n > 75:
+            out.append(cur)
+            cur, size = ' ', 1
+        cur += ch
+        size += n
+    out.append(cur)
+    return '\r\n'.join(out)
+
+
+def fmt_dt(dt: datetime.datetime, tz: Optional[ZoneInfo] = None) -> str:
+    # с поясом - в UTC с суффиксом Z: TZID без компонента VTIMEZONE RFC 5545 не допускает
+    if tz is None:
+        return dt.strftime('%Y%m%dT%H%M%S')
+    return dt.replace(tzinfo=tz).astimezone(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def event_lines(s: Session, stamp: str, tz: Optional[ZoneInfo]) -> List[str]:
+    end = s.date_time + datetime.timedelta(minutes=s.duration_minutes or 90)
+    course = s.course.name if s.course else 'Занятие'
+    details = [f'Преподаватель: {s.instructor}' if s.instructor else '', s.comment or '']
+    # у даты серии UID не меняется, когда её сохраняют занятием
+    uid = f'series-{s.series_id}-{s.occurrence_date:%Y%m%d}' if s.series_id else f'session-{s.id}'
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:{uid}@xakaton-course',
+        f'DTSTAMP:{stamp}',
+        f'DTSTART:{fmt_dt(s.date_time, tz)}',
+        f'DTEND:{fmt_dt(end, tz)}',
+        f'SUMMARY:{escape(course)}',
+        f'STATUS:{STATUSES.get(s.status, "CONFIRMED")}',
+    ]
+    if s.location:
+        lines.append(f'LOCATION:{escape(s.location)}')
+    if any(details):
+        lines.append(f'DESCRIPTION:{escape(chr(10).join(d for d in details if d))}')
+    lines.append('END:VEVENT')
+    return lines
+
+
+def render_calendar(name: str, sessions: Iterable[Session], tzid: Optional[str] = None) -> str:
+    """VCALENDAR с занятиями. Время в БД локальное: без tzid события "плавающие"
+    (в часовом поясе клиента), с tzid (IANA) - переводятся из него в UTC."""
+    tz = ZoneInfo(tzid) if tzid else None
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        f'PRODID:{PRODID}',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{escape(name)}',
+    ]
+    if tzid:
+        lines.append(f'X-WR-TIMEZONE:{tzid}')
+    for s in sessions:
+        lines.extend(event_lines(s, stamp, tz))
+    lines.append('END:VCALENDAR')
+    return ''.join(fold(line) + '\r\n' for line in lines)
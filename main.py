@@ -1,21 +1,30 @@
 import os
-from datetime import datetime, date, time, timedelta
+import base64
+import binascii
+import hashlib
+import json
+import secrets
+from datetime import datetime, date, time, timedelta, timezone
 import threading
 import asyncio
 import calendar
 from typing import Dict, Any, Optional, List, Tuple
 import sys
+import logging
+from time import monotonic
 
-from flask import Flask, request, jsonify, current_app
+from flask import Flask, request, jsonify, current_app, Response, stream_with_context, abort
 from flask_admin import Admin
 from flask_admin.contrib.sqla import ModelView
 
-from sqlalchemy.orm import joinedload
-from sqlalchemy import func
+from sqlalchemy.orm import selectinload
+from sqlalchemy import or_, and_, select, insert, delete, text, true
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import (
     Application,
+    ApplicationBuilder,
     CommandHandler,
     MessageHandler,
     filters,
@@ -26,14 +35,39 @@ from telegram.ext import (
 )
 
 from config import Config
-from extensions import db
-from models import Course, Participant, Session
+from extensions import db, init_storage
+from models import Course, Participant, Session, SessionSeries, SeriesException, NotificationOutbox, Reminder, ReminderOffset, participants_sessions
+from notify import Notifier, DeliveryReport, session_notice, notice_chats
+from cache import MISSING, AsyncLoadingCache, TTLCache
+from dbexec import DbExecutor, DbBusy
+from chatorder import ChatOrderedUpdateProcessor
+from webhook import run_webhook
+from repository import Repository, day_sessions_query, month_counts_query, upcoming_sessions_query, due_reminders_query
+from schema import upgrade_schema
+from events import SessionChange, on_sessions_flushed, on_sessions_changed, record_changes, emit
+import bus
+import versions
+import changelog
+from ical import render_calendar
+import series
+from reminders import (
+    ReminderScheduler, sync_session_reminders, sync_participant_reminders,
+    insert_reminders, drop_registration_reminders, fmt_offset
+)
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.config.from_object(Config)
 app.secret_key = app.config.get('SECRET_KEY')
 
 db.init_app(app)
+init_storage(app)
+
+# бот работает с БД через async-репозиторий, flask - через db.session
+repo = Repository()
+with app.app_context():
+    repo.init_app(app, db.engine)
 
 admin = Admin(app, name='Учительская')
 admin.add_view(ModelView(Participant, db.session, name='Участники'))
@@ -45,6 +79,24 @@ jqu: Optional[JobQueue] = None
 
 TEACHER_IDS = app.config.get('TEACHER_IDS', [])
 
+REMINDER_OFFSETS = app.config.get('REMINDER_OFFSETS', [1440, 60, 5])
+
+# других типов апдейтов бот не обрабатывает
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
+# блокирующая работа с БД со стороны бота; при переполнении очереди - DbBusy
+db_executor = DbExecutor(
+    workers=app.config.get('DB_EXECUTOR_WORKERS', 4),
+    max_queue=app.config.get('DB_EXECUTOR_QUEUE', 64),
+)
+
+notifier = Notifier(
+    rate=app.config.get('NOTIFY_RATE_PER_SEC', 30),
+    chat_interval=app.config.get('NOTIFY_CHAT_INTERVAL_SEC', 1.0),
+    concurrency=app.config.get('NOTIFY_CONCURRENCY', 20),
+    max_retries=app.config.get('NOTIFY_MAX_RETRIES', 3),
+)
+
 def is_teacher(user_id: int) -> bool:
     return user_id in TEACHER_IDS
 
@@ -72,30 +124,419 @@ def crsess():
     db.session.commit()
     return jsonify({"id": sess.id})
 
+def reminder_offsets_from(data: Dict[str, Any]) -> List[int]:
+    if 'reminder_offsets' in data:
+        return sorted({int(m) for m in data['reminder_offsets'] if int(m) > 0}, reverse=True)
+    return [5] if data.get('warn_5_min', False) else []
+
 @app.route('/participants', methods=['POST'])
 def addpart():
     data = request.json
+    offsets = reminder_offsets_from(data)
     part = Participant(
-        name=data['name'], 
-        contact=data.get('contact', ''), 
+        name=data['name'],
+        contact=data.get('contact', ''),
         telegram_id=data.get('telegram_id'),
         notifications_enabled=data.get('notifications_enabled', True),
-        warn_5_min=data.get('warn_5_min', False)
+        warn_5_min=5 in offsets
     )
     db.session.add(part)
+    db.session.flush()
+    db.session.add_all(ReminderOffset(participant_id=part.id, minutes=m) for m in offsets)
+    if part.telegram_id:
+        bus.publish(db.session.connection(), 'participants', [part.telegram_id])
     db.session.commit()
     return jsonify({"id": part.id})
 
+def register_query():
+    # дубль упирается в ux_participants_sessions и молча пропускается: повтор и гонка двух запросов безопасны
+    return sqlite_insert(participants_sessions).on_conflict_do_nothing()
+
+def registration_changed(sessions: List[Session], pairs=None):
+    """Запись мимо ORM: версии, журнал изменений и шина - через flush-слушатели.
+
+    Журнал напоминаний правится только по затронутым парам: pairs - условие на
+    participants_sessions для новых записей (отписка удаляет строки сама).
+    """
+    if pairs is not None:
+        conn = db.session.connection()
+        schedule_reminders(conn, insert_reminders(conn, pairs))
+    record_changes(db.session(), [SessionChange(s.id, s.date_time, s.status, registration=True) for s in sessions])
+
 @app.route('/sessions/<int:session_id>/register', methods=['POST'])
 def regpartses(session_id):
     data = request.json
     part_id = data['participant_id']
     sess = Session.query.get_or_404(session_id)
-    part = Participant.query.get_or_404(part_id)
-    if part not in sess.participants:
-        sess.participants.append(part)
+    Participant.query.get_or_404(part_id)
+    res = db.session.execute(register_query(), {"participant_id": part_id, "session_id": session_id})
+    if res.rowcount:
+        registration_changed([sess], and_(participants_sessions.c.session_id == session_id,
+                                          participants_sessions.c.participant_id == part_id))
+    db.session.commit()
+    return jsonify({"status": "registered", "created": bool(res.rowcount)})
+
+@app.route('/sessions/<int:session_id>/register/<int:participant_id>', methods=['DELETE'])
+def unregpartses(session_id, participant_id):
+    sess = Session.query.get_or_404(session_id)
+    res = db.session.execute(delete(participants_sessions).where(
+        participants_sessions.c.session_id == session_id,
+        participants_sessions.c.participant_id == participant_id
+    ))
+    if res.rowcount:
+        drop_registration_reminders(db.session.connection(), session_id, participant_id)
+        registration_changed([sess])
+    db.session.commit()
+    return jsonify({"status": "unregistered", "deleted": bool(res.rowcount)})
+
+@app.route('/courses/<int:course_id>/enroll', methods=['POST'])
+def enroll_course(course_id):
+    """Записывает группу на все будущие занятия курса одним INSERT ... SELECT.
+
+    Группа - список participant_ids или from_course_id: все, кто записан хоть
+    на одно занятие того курса (в том числе этого же - дозапись на новые занятия).
+    """
+    Course.query.get_or_404(course_id)
+    data = request.json or {}
+    if isinstance(data.get('participant_ids'), list):
+        group = select(Participant.id.label('participant_id')).where(Participant.id.in_(data['participant_ids']))
+    elif isinstance(data.get('from_course_id'), int):
+        group = (
+            select(participants_sessions.c.participant_id)
+            .join(Session, Session.id == participants_sessions.c.session_id)
+            .where(Session.course_id == data['from_course_id'])
+            .distinct()
+        )
+    else:
+        return jsonify({"error": "participant_ids or from_course_id required"}), 400
+
+    targets = Session.query.filter(Session.course_id == course_id, Session.date_time >= datetime.now()).all()
+    if not targets:
+        return jsonify({"sessions": 0, "registered": 0})
+    group = group.subquery()
+    pairs = (
+        select(group.c.participant_id, Session.id)
+        .select_from(group)
+        .join(Session, true())
+        .where(Session.id.in_([s.id for s in targets]))
+    )
+    res = db.session.execute(
+        sqlite_insert(participants_sessions).from_select(['participant_id', 'session_id'], pairs).on_conflict_do_nothing()
+    )
+    if res.rowcount:
+        registration_changed(targets, and_(participants_sessions.c.session_id.in_([s.id for s in targets]),
+                                           participants_sessions.c.participant_id.in_(select(group.c.participant_id))))
+    db.session.commit()
+    return jsonify({"sessions": len(targets), "registered": res.rowcount})
+
+def serialize_series(ser: SessionSeries) -> Dict[str, Any]:
+    return {
+        "id": ser.id,
+        "course_id": ser.course_id,
+        "start_date": ser.start_date.isoformat(),
+        "until": ser.until.isoformat() if ser.until else None,
+        "time": ser.start_time.strftime('%H:%M'),
+        "interval_weeks": ser.interval_weeks,
+        "duration_minutes": ser.duration_minutes,
+        "instructor": ser.instructor,
+        "location": ser.location,
+        "comment": ser.comment,
+        "exceptions": sorted(e.occurrence_date.isoformat() for e in ser.exceptions),
+    }
+
+SERIES_FIELDS = ('until', 'duration_minutes', 'instructor', 'location', 'comment')
+
+def apply_series_fields(ser: SessionSeries, data: Dict[str, Any]):
+    """Общие поля POST и PUT /series; ValueError/TypeError при неверных значениях."""
+    if 'until' in data:
+        ser.until = date.fromisoformat(data['until']) if data['until'] else None
+    if 'duration_minutes' in data:
+        ser.duration_minutes = int(data['duration_minutes'])
+    for field in ('instructor', 'location', 'comment'):
+        if field in data:
+            setattr(ser, field, data[field])
+
+@app.route('/series', methods=['POST'])
+def create_series():
+    """Еженедельное (interval_weeks=1) или раз в две недели (2) занятие курса."""
+    data = request.json
+    try:
+        ser = SessionSeries(
+            course_id=int(data['course_id']),
+            start_date=date.fromisoformat(data['start_date']),
+            start_time=time.fromisoformat(data['time']),
+            interval_weeks=int(data.get('interval_weeks', 1)),
+            duration_minutes=90,
+            instructor='',
+            location='',
+        )
+        apply_series_fields(ser, data)
+        if ser.interval_weeks not in (1, 2):
+            raise ValueError
+    except (KeyError, ValueError, TypeError):
+        return jsonify({"error": "course_id, start_date, time required; interval_weeks is 1 or 2"}), 400
+    Course.query.get_or_404(ser.course_id)
+    db.session.add(ser)
+    db.session.commit()
+    return jsonify({"id": ser.id})
+
+@app.route('/series/<int:series_id>', methods=['GET'])
+def get_series(series_id):
+    return jsonify(serialize_series(SessionSeries.query.get_or_404(series_id)))
+
+@app.route('/series/<int:series_id>', methods=['PUT'])
+def update_series(series_id):
+    """Меняет ещё не сохранённые даты; сохранённые занятия правятся через /sessions/<id>."""
+    ser = SessionSeries.query.get_or_404(series_id)
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "JSON object required"}), 400
+    try:
+        apply_series_fields(ser, {k: v for k, v in data.items() if k in SERIES_FIELDS})
+    except (ValueError, TypeError):
+        return jsonify({"error": "invalid field value"}), 400
+    db.session.commit()
+    return jsonify({"id": ser.id})
+
+def occurrence_date_or_404(ser: SessionSeries, occ_date: str) -> date:
+    try:
+        on = date.fromisoformat(occ_date)
+    except ValueError:
+        abort(404)
+    if not series.is_occurrence(ser, on):
+        abort(404)
+    return on
+
+@app.route('/series/<int:series_id>/exceptions', methods=['POST'])
+def add_series_exception(series_id):
+    ser = SessionSeries.query.get_or_404(series_id)
+    on = occurrence_date_or_404(ser, (request.json or {}).get('date', ''))
+    s_id = db.session.scalar(series.materialized_query(series_id, on))
+    if s_id:
+        return jsonify({"error": f"occurrence is already session {s_id}, cancel or delete it instead"}), 409
+    if on not in {e.occurrence_date for e in ser.exceptions}:
+        ser.exceptions.append(SeriesException(occurrence_date=on))
         db.session.commit()
-    return jsonify({"status": "registered"})
+    return jsonify({"id": ser.id, "skipped": on.isoformat()})
+
+@app.route('/series/<int:series_id>/exceptions/<occ_date>', methods=['DELETE'])
+def del_series_exception(series_id, occ_date):
+    ser = SessionSeries.query.get_or_404(series_id)
+    on = occurrence_date_or_404(ser, occ_date)
+    for exc in ser.exceptions:
+        if exc.occurrence_date == on:
+            db.session.delete(exc)
+    db.session.commit()
+    return jsonify({"id": ser.id, "restored": on.isoformat()})
+
+def materialize_or_404(series_id: int, occ_date: str) -> int:
+    on = occurrence_date_or_404(SessionSeries.query.get_or_404(series_id), occ_date)
+    s_id = series.materialize(db.session(), series_id, on)
+    if s_id is None:
+        abort(404)
+    return s_id
+
+@app.route('/series/<int:series_id>/occurrences/<occ_date>', methods=['POST'])
+def materialize_occurrence(series_id, occ_date):
+    """Сохраняет дату серии занятием (если ещё нет) и отдаёт его id для правки."""
+    s_id = materialize_or_404(series_id, occ_date)
+    db.session.commit()
+    return jsonify({"id": s_id})
+
+@app.route('/series/<int:series_id>/occurrences/<occ_date>/register', methods=['POST'])
+def regoccurrence(series_id, occ_date):
+    return regpartses(materialize_or_404(series_id, occ_date))
+
+def bulk_items() -> List[Any]:
+    data = request.json
+    items = data.get('items') if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        raise ValueError("expected a list of items")
+    return items
+
+def is_int(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def bulk_validate(items: List[Any], make_row) -> Tuple[List[Tuple[int, Dict[str, Any]]], List[Dict[str, Any]]]:
+    """Проверяет весь пакет целиком: (индекс, строка) для валидных, список ошибок для остальных."""
+    rows, errors = [], []
+    for i, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise ValueError("item must be an object")
+            rows.append((i, make_row(item)))
+        except KeyError as e:
+            errors.append({"index": i, "error": f"missing field {e.args[0]}"})
+        except (ValueError, TypeError) as e:
+            errors.append({"index": i, "error": str(e)})
+    return rows, errors
+
+def bulk_insert(model, items: List[Any], make_row, after_insert=None):
+    """Вставляет пакет одним executemany в одной транзакции.
+
+    По умолчанию при любой ошибке валидации ничего не пишется (400).
+    С ?partial=1 валидные строки вставляются, а ошибки возвращаются рядом;
+    ids идут в порядке входных данных, None на месте отклонённых.
+    """
+    partial = request.args.get('partial') in ('1', 'true')
+    rows, errors = bulk_validate(items, make_row)
+    if errors and not partial:
+        return jsonify({"errors": errors}), 400
+
+    ids: List[Optional[int]] = [None] * len(items)
+    if rows:
+        stmt = insert(model).returning(model.id, sort_by_parameter_order=True)
+        new_ids = db.session.execute(stmt, [row for _, row in rows]).scalars().all()
+        if after_insert:
+            after_insert(list(zip(new_ids, [row for _, row in rows])))
+        db.session.commit()
+        for (i, _), new_id in zip(rows, new_ids):
+            ids[i] = new_id
+    res: Dict[str, Any] = {"ids": ids}
+    if partial:
+        res["errors"] = errors
+    return jsonify(res)
+
+@app.route('/courses/bulk', methods=['POST'])
+def create_courses_bulk():
+    try:
+        items = bulk_items()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def make_row(item):
+        if not item['name']:
+            raise ValueError("name is empty")
+        return {"name": item['name'], "direction": item.get('direction', ''), "group": item.get('group', '')}
+
+    def record_new(inserted):
+        changelog.record(db.session.connection(), 'course', [(c_id, 'upsert') for c_id, _ in inserted])
+
+    return bulk_insert(Course, items, make_row, after_insert=record_new)
+
+@app.route('/sessions/bulk', methods=['POST'])
+def crsess_bulk():
+    try:
+        items = bulk_items()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # только int: остальное (в том числе нехэшируемое) отклонит make_row ошибкой элемента
+    c_ids = {it.get('course_id') for it in items if isinstance(it, dict) and is_int(it.get('course_id'))}
+    known_c_ids = set(db.session.execute(select(Course.id).where(Course.id.in_(c_ids))).scalars())
+
+    def make_row(item):
+        if not is_int(item['course_id']):
+            raise ValueError("course_id must be an integer")
+        if item['course_id'] not in known_c_ids:
+            raise ValueError(f"unknown course_id {item['course_id']}")
+        return {
+            "course_id": item['course_id'],
+            "date_time": datetime.fromisoformat(item['date_time']),
+            "duration_minutes": int(item.get('duration_minutes', 90)),
+            "instructor": item.get('instructor', ''),
+            "location": item.get('location', ''),
+            "status": item.get('status', 'planned'),
+            "comment": item.get('comment'),
+            "five_min_warn_sent": False,
+        }
+
+    def record_new(inserted):
+        # Core insert мимо ORM-событий, сообщаем о новых занятиях сами
+        record_changes(db.session(), [
+            SessionChange(s_id, row["date_time"], row["status"]) for s_id, row in inserted
+        ])
+
+    return bulk_insert(Session, items, make_row, after_insert=record_new)
+
+@app.route('/participants/bulk', methods=['POST'])
+def addpart_bulk():
+    try:
+        items = bulk_items()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    tg_ids = [it.get('telegram_id') for it in items if isinstance(it, dict) and is_int(it.get('telegram_id'))]
+    taken_tg_ids = set(db.session.execute(
+        select(Participant.telegram_id).where(Participant.telegram_id.in_(tg_ids))
+    ).scalars())
+
+    offsets_by_row: Dict[int, List[int]] = {}
+
+    def make_row(item):
+        tg_id = item.get('telegram_id')
+        if tg_id is not None:
+            if not is_int(tg_id):
+                raise ValueError("telegram_id must be an integer")
+            if tg_id in taken_tg_ids:
+                raise ValueError(f"telegram_id {tg_id} already exists")
+            taken_tg_ids.add(tg_id)
+        if not item['name']:
+            raise ValueError("name is empty")
+        row = {
+            "name": item['name'],
+            "contact": item.get('contact', ''),
+            "telegram_id": tg_id,
+            "notifications_enabled": bool(item.get('notifications_enabled', True)),
+        }
+        offsets = reminder_offsets_from(item)
+        row["warn_5_min"] = 5 in offsets
+        offsets_by_row[id(row)] = offsets
+        return row
+
+    def add_offsets(inserted):
+        tg_ids = [row["telegram_id"] for _, row in inserted if row["telegram_id"] is not None]
+        if tg_ids:
+            bus.publish(db.session.connection(), 'participants', tg_ids)
+        offset_rows = [
+            {"participant_id": p_id, "minutes": m}
+            for p_id, row in inserted for m in offsets_by_row[id(row)]
+        ]
+        if offset_rows:
+            db.session.execute(insert(ReminderOffset), offset_rows)
+
+    return bulk_insert(Participant, items, make_row, after_insert=add_offsets)
+
+@app.route('/sessions/<int:session_id>/register/bulk', methods=['POST'])
+def regpartses_bulk(session_id):
+    sess = Session.query.get_or_404(session_id)
+    try:
+        items = bulk_items()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    partial = request.args.get('partial') in ('1', 'true')
+
+    # элементы - id участников или объекты {"participant_id": ...}
+    items = [it.get('participant_id') if isinstance(it, dict) else it for it in items]
+    known_p_ids = set(db.session.execute(
+        select(Participant.id).where(Participant.id.in_([it for it in items if isinstance(it, int)]))
+    ).scalars())
+
+    rows, errors, seen = [], [], set()
+    for i, p_id in enumerate(items):
+        if p_id not in known_p_ids:
+            errors.append({"index": i, "error": f"unknown participant_id {p_id}"})
+        elif p_id not in seen:
+            rows.append({"participant_id": p_id, "session_id": session_id})
+            seen.add(p_id)
+    if errors and not partial:
+        return jsonify({"errors": errors}), 400
+
+    if rows:
+        # уже записанные пропускает уникальный индекс, без чтения состава занятия
+        if db.session.execute(register_query(), rows).rowcount:
+            registration_changed([sess], and_(participants_sessions.c.session_id == session_id,
+                                              participants_sessions.c.participant_id.in_(list(seen))))
+        db.session.commit()
+    bad = {e["index"] for e in errors}
+    res: Dict[str, Any] = {"ids": [None if i in bad else p_id for i, p_id in enumerate(items)]}
+    if partial:
+        res["errors"] = errors
+    return jsonify(res)
+
+def enqueue_notice(session_id: int, msg: str):
+    """Кладёт уведомление в outbox в текущей транзакции; отправит dispatch_outbox."""
+    db.session.add(NotificationOutbox(session_id=session_id, message=msg))
 
 @app.route('/sessions/<int:session_id>', methods=['PUT'])
 def update_session(session_id):
@@ -140,7 +581,6 @@ def update_session(session_id):
             has_changed = True
     
     if has_changed:
-        db.session.commit()
         n_msg = "Занятие было обновлено."
         if sess.status != orig_status and sess.status in ('canceled', 'rescheduled'):
             n_msg = f"Статус занятия изменен на: {sess.status.capitalize()}"
@@ -150,106 +590,432 @@ def update_session(session_id):
             n_msg = "Место проведения занятия изменено."
         elif sess.instructor != orig_instr:
             n_msg = "Преподаватель занятия изменен."
-        
-        if tgapp:
-            tgapp.create_task(notpar(sess.id, n_msg))
+
+        enqueue_notice(sess.id, n_msg)
+        db.session.commit()
     
     return jsonify({"id": sess.id})
 
+def serialize_session(s: Session) -> Dict[str, Any]:
+    return {
+        "id": s.id,
+        "course_id": s.course_id,
+        "course_name": s.course.name if s.course else None,
+        "date_time": s.date_time.isoformat(),
+        "duration_minutes": s.duration_minutes,
+        "instructor": s.instructor,
+        "location": s.location,
+        "status": s.status,
+        "comment": s.comment,
+        "five_min_warn_sent": s.five_min_warn_sent,
+        "participants": [{"id": p.id, "name": p.name} for p in s.participants],
+        # у несохранённой даты серии id = null, адрес - пара series_id + occurrence_date
+        "series_id": s.series_id,
+        "occurrence_date": s.occurrence_date.isoformat() if s.occurrence_date else None
+    }
+
+# готовые тела GET-ответов по (маршрут, параметры, etag): новая версия данных - новый ключ
+responses = TTLCache(maxsize=app.config.get('RESPONSE_CACHE_SIZE', 512))
+
+def conditional(keys: List[str], cache_key: Tuple, build, mimetype: str, daily: bool = False):
+    """Условный GET по версиям данных.
+
+    Версии читаются из data_version до запроса самих данных: совпавший
+    If-None-Match (или If-Modified-Since не раньше последнего изменения) получает
+    304, не трогая таблицы занятий. daily - ответ зависит и от сегодняшней даты:
+    она входит в ETag, а начало дня - в Last-Modified. build() вызывается только
+    при промахе кэша тел; если он вернул не строку (ответ с ошибкой), тот отдаётся как есть.
+    """
+    if daily:
+        cache_key = cache_key + (date.today(),)
+    vers = versions.read(db.session.connection(), keys)
+    etag = '-'.join(f"{vers[k][0]}" for k in keys) + '-' + hashlib.sha1(repr(cache_key).encode()).hexdigest()[:12]
+    changed = [at.replace(tzinfo=timezone.utc) for _, at in vers.values() if at]
+    if daily:
+        changed.append(datetime.combine(date.today(), time.min).astimezone(timezone.utc))
+    modified_at = max(changed) if changed else None
+    last_modified = http_second(modified_at) if modified_at else None
+
+    if request.if_none_match:
+        if request.if_none_match.contains(etag):
+            return not_modified(etag, last_modified)
+    elif last_modified and request.if_modified_since and modified_at <= request.if_modified_since:
+        return not_modified(etag, last_modified)
+
+    body = responses.get((cache_key, etag))
+    if body is MISSING:
+        body = build()
+        if not isinstance(body, str):
+            return body
+        responses.set((cache_key, etag), body)
+    resp = app.response_class(body, mimetype=mimetype)
+    resp.set_etag(etag)
+    if last_modified:
+        resp.last_modified = last_modified
+    return resp
+
+def conditional_json(keys: List[str], cache_key: Tuple, build, daily: bool = False):
+    def body():
+        payload = build()
+        return app.json.dumps(payload) + "\n" if isinstance(payload, dict) else payload
+    return conditional(keys, cache_key, body, app.json.mimetype, daily)
+
+def http_second(at: datetime) -> Optional[datetime]:
+    """Last-Modified с точностью до секунды: момент изменения, округлённый вверх.
+
+    Пока эта секунда не закончилась, в неё ещё может попасть правка, а клиент с
+    таким If-Modified-Since получил бы 304 на устаревшие данные - тогда только ETag.
+    """
+    second = at.replace(microsecond=0)
+    if second < at:
+        second += timedelta(seconds=1)
+    return second if second <= datetime.now(timezone.utc) else None
+
+def not_modified(etag: str, last_modified: Optional[datetime]) -> Response:
+    resp = app.response_class(status=304)
+    resp.set_etag(etag)
+    if last_modified:
+        resp.last_modified = last_modified
+    return resp
+
 @app.route('/sessions/<int:session_id>', methods=['GET'])
 def get_session(session_id):
-    sess = Session.query.get_or_404(session_id)
-    return jsonify({
-        "id": sess.id,
-        "course_id": sess.course_id,
-        "course_name": sess.course.name if sess.course else None,
-        "date_time": sess.date_time.isoformat(),
-        "duration_minutes": sess.duration_minutes,
-        "instructor": sess.instructor,
-        "location": sess.location,
-        "status": sess.status,
-        "comment": sess.comment,
-        "five_min_warn_sent": sess.five_min_warn_sent,
-        "participants": [{"id": p.id, "name": p.name} for p in sess.participants]
-    })
+    # в ответе имена курса и участников, поэтому кроме версии занятия - версия справочников
+    return conditional_json(
+        [versions.session_key(session_id), versions.REFS],
+        ('session', session_id),
+        lambda: serialize_session(Session.query.get_or_404(session_id))
+    )
+
+SCHEDULE_PAGE_SIZE = 100
+SCHEDULE_MAX_PAGE_SIZE = 500
+
+def encode_cursor(s: Session) -> str:
+    dt, key_id = series.sort_key(s)
+    raw = f"{dt.isoformat()}|{key_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+    dt_str, s_id = raw.rsplit('|', 1)
+    return datetime.fromisoformat(dt_str), int(s_id)
+
+def parse_schedule_args(args) -> Dict[str, Any]:
+    """Разбирает фильтры /schedule, ValueError при неверных значениях."""
+    flt: Dict[str, Any] = {}
+    if args.get('from'):
+        flt['from'] = datetime.fromisoformat(args['from'])
+    if args.get('to'):
+        to_dt = args['to']
+        flt['to'] = datetime.fromisoformat(to_dt)
+        if len(to_dt) == 10:
+            # дата без времени - включаем весь день
+            flt['to'] = datetime.combine(flt['to'].date(), time.max)
+    if args.get('course_id'):
+        flt['course_id'] = int(args['course_id'])
+    if args.get('status'):
+        flt['status'] = [st for st in args['status'].split(',') if st]
+    return flt
+
+def schedule_query(flt: Dict[str, Any]):
+    query = Session.query
+    if 'from' in flt:
+        query = query.filter(Session.date_time >= flt['from'])
+    if 'to' in flt:
+        query = query.filter(Session.date_time <= flt['to'])
+    if 'course_id' in flt:
+        query = query.filter(Session.course_id == flt['course_id'])
+    if 'status' in flt:
+        query = query.filter(Session.status.in_(flt['status']))
+    return query
+
+def schedule_page_query(flt: Dict[str, Any], after: Optional[Tuple[datetime, int]], limit: int):
+    query = schedule_query(flt)
+    if after:
+        a_dt, a_id = after
+        query = query.filter(or_(
+            Session.date_time > a_dt,
+            and_(Session.date_time == a_dt, Session.id > a_id)
+        ))
+    return query.order_by(Session.date_time, Session.id).limit(limit + 1)
+
+def schedule_page(flt: Dict[str, Any], after: Optional[Tuple[datetime, int]], limit: int) -> Tuple[List[Session], Optional[Session]]:
+    """Одна страница расписания по ключу (date_time, id).
+
+    Курсы и участники подгружаются пакетно (selectinload), поэтому на страницу
+    уходит фиксированное число запросов независимо от её размера.
+    """
+    query = schedule_page_query(flt, after, limit)
+    rows = query.options(selectinload(Session.course), selectinload(Session.participants)).all()
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1]
+    return rows, None
+
+SERIES_HORIZON_DAYS = app.config.get('SERIES_HORIZON_DAYS', 180)
+
+def schedule_page_with_series(flt: Dict[str, Any], after: Optional[Tuple[datetime, int]], limit: int) -> Tuple[List[Any], Optional[Any]]:
+    """Страница расписания вместе с несохранёнными датами серий.
+
+    Даты серий разворачиваются только в окне страницы: от фильтра или курсора
+    до фильтра to (без него - SERIES_HORIZON_DAYS вперёд), но не дальше
+    последнего занятия полной страницы. Порядок и курсор - series.sort_key.
+    """
+    sessions, last = schedule_page(flt, after, limit)
+    if 'status' in flt and 'planned' not in flt['status']:
+        return sessions, last
+    start = max(flt.get('from', datetime.min), after[0] if after else datetime.min)
+    end = flt.get('to') or datetime.now() + timedelta(days=SERIES_HORIZON_DAYS)
+    if last:
+        end = min(end, last.date_time)
+    if start > end:
+        return sessions, last
+    occs = series.occurrences(db.session, start, end, flt.get('course_id'))
+    if after:
+        occs = [o for o in occs if series.sort_key(o) > after]
+    merged = sorted(sessions + occs, key=series.sort_key)
+    if last or len(merged) > limit:
+        return merged[:limit], merged[limit - 1]
+    return merged, None
 
 @app.route('/schedule', methods=['GET'])
 def get_schedule():
-    sessions = Session.query.order_by(Session.date_time).all()
-    res = []
-    for s in sessions:
-        res.append({
-            "id": s.id,
-            "course_id": s.course_id,
-            "course_name": s.course.name if s.course else None,
-            "date_time": s.date_time.isoformat(),
-            "duration_minutes": s.duration_minutes,
-            "instructor": s.instructor,
-            "location": s.location,
-            "status": s.status,
-            "comment": s.comment,
-            "five_min_warn_sent": s.five_min_warn_sent,
-            "participants": [{"id": p.id, "name": p.name} for p in s.participants]
-        })
-    return jsonify(res)
+    try:
+        flt = parse_schedule_args(request.args)
+        limit = min(int(request.args.get('limit', SCHEDULE_PAGE_SIZE)), SCHEDULE_MAX_PAGE_SIZE)
+        if limit <= 0:
+            raise ValueError
+        after = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except (ValueError, binascii.Error):
+        return jsonify({"error": "invalid filter, limit or cursor"}), 400
+
+    def build():
+        sessions, last = schedule_page_with_series(flt, after, limit)
+        return {
+            "sessions": [serialize_session(s) for s in sessions],
+            "next_cursor": encode_cursor(last) if last else None
+        }
+
+    args = tuple(sorted(request.args.items(multi=True)))
+    # без to окно серий считается от сегодняшнего дня - отсюда daily
+    return conditional_json([versions.GLOBAL], ('schedule', args), build, daily=True)
+
+EXPORT_CHUNK_SIZE = 1000
+
+@app.route('/schedule/export', methods=['GET'])
+def export_schedule():
+    if request.args.get('format', 'ndjson') != 'ndjson':
+        return jsonify({"error": "unsupported format"}), 400
+    try:
+        flt = parse_schedule_args(request.args)
+    except ValueError:
+        return jsonify({"error": "invalid filter"}), 400
+
+    def gen():
+        # идём по таблице страницами по ключу, в памяти держим только текущую;
+        # даты серий - как в /schedule (без to - на SERIES_HORIZON_DAYS вперёд)
+        after = None
+        while True:
+            sessions, last = schedule_page_with_series(flt, after, EXPORT_CHUNK_SIZE)
+            for s in sessions:
+                yield json.dumps(serialize_session(s), ensure_ascii=False) + "\n"
+            if not last:
+                break
+            after = series.sort_key(last)
+            db.session.expunge_all()
+
+    return Response(stream_with_context(gen()), mimetype='application/x-ndjson')
+
+ICAL_PAST_DAYS = app.config.get('ICAL_PAST_DAYS', 30)
+
+def calendar_since() -> datetime:
+    return datetime.combine(date.today() - timedelta(days=ICAL_PAST_DAYS), time.min)
+
+def calendar_sessions(query) -> List[Session]:
+    query = query.filter(Session.date_time >= calendar_since()).order_by(Session.date_time, Session.id)
+    return query.options(selectinload(Session.course)).all()
+
+def calendar_feed(cache_key: Tuple, build):
+    # окно фида сдвигается раз в сутки, поэтому daily: дата в ETag, начало дня в Last-Modified;
+    # версия 'global' растёт при любых изменениях занятий, записей и курсов
+    return conditional([versions.GLOBAL], cache_key, build, 'text/calendar', daily=True)
+
+@app.route('/participants/<int:participant_id>/calendar.ics', methods=['GET'])
+def participant_calendar(participant_id):
+    def build():
+        part = Participant.query.get_or_404(participant_id)
+        sessions = calendar_sessions(Session.query.join(participants_sessions).filter(
+            participants_sessions.c.participant_id == participant_id))
+        return render_calendar(f"Занятия: {part.name}", sessions, app.config.get('ICAL_TIMEZONE'))
+    return calendar_feed(('participant_ics', participant_id), build)
+
+@app.route('/courses/<int:course_id>/calendar.ics', methods=['GET'])
+def course_calendar(course_id):
+    def build():
+        course = Course.query.get_or_404(course_id)
+        sessions = calendar_sessions(Session.query.filter(Session.course_id == course_id))
+        # несохранённые даты серий курса - до горизонта серий
+        horizon = datetime.now() + timedelta(days=SERIES_HORIZON_DAYS)
+        occs = series.occurrences(db.session, calendar_since(), horizon, course_id)
+        sessions = sorted(sessions + occs, key=series.sort_key)
+        return render_calendar(f"Курс: {course.name}", sessions, app.config.get('ICAL_TIMEZONE'))
+    return calendar_feed(('course_ics', course_id), build)
+
+CHANGES_PAGE_SIZE = 500
+CHANGES_MAX_WAIT_SEC = 60
+CHANGES_KEEPALIVE_SEC = 15
+CHANGES_POLL_SEC = app.config.get('CHANGES_POLL_SEC', 1.0)
+
+def serialize_course(c: Course) -> Dict[str, Any]:
+    return {"id": c.id, "name": c.name, "direction": c.direction, "group": c.group}
+
+def changes_page(since: int, limit: int) -> Tuple[List[Dict[str, Any]], int]:
+    """Записи журнала после since и следующий курсор.
+
+    data - текущий снимок строки, подгруженный пакетно на всю страницу;
+    null, если строка уже удалена (её delete придёт дальше по журналу).
+    Транзакция чтения закрывается, чтобы следующий опрос видел новые коммиты.
+    """
+    rows = db.session.execute(changelog.fetch_query(since, limit)).all()
+    s_ids = {e_id for _, entity, e_id, op in rows if entity == 'session' and op == 'upsert'}
+    c_ids = {e_id for _, entity, e_id, op in rows if entity == 'course' and op == 'upsert'}
+    snapshots: Dict[Tuple[str, int], Dict[str, Any]] = {}
+    if s_ids:
+        query = Session.query.filter(Session.id.in_(s_ids))
+        for s in query.options(selectinload(Session.course), selectinload(Session.participants)):
+            snapshots[('session', s.id)] = serialize_session(s)
+    if c_ids:
+        for c in Course.query.filter(Course.id.in_(c_ids)):
+            snapshots[('course', c.id)] = serialize_course(c)
+    ser_ids = {e_id for _, entity, e_id, op in rows if entity == 'series' and op == 'upsert'}
+    if ser_ids:
+        for ser in SessionSeries.query.filter(SessionSeries.id.in_(ser_ids)).options(selectinload(SessionSeries.exceptions)):
+            snapshots[('series', ser.id)] = serialize_series(ser)
+    db.session.rollback()
+
+    changes = [
+        {"seq": seq, "entity": entity, "id": e_id, "op": op, "data": snapshots.get((entity, e_id))}
+        for seq, entity, e_id, op in rows
+    ]
+    return changes, rows[-1].seq if rows else since
+
+def changes_stream(since: int, limit: int):
+    idle = 0.0
+    while True:
+        changes, since = changes_page(since, limit)
+        for ch in changes:
+            yield f"id: {ch['seq']}\nevent: change\ndata: {json.dumps(ch, ensure_ascii=False)}\n\n"
+        if changes:
+            idle = 0.0
+            continue
+        changelog.wait(CHANGES_POLL_SEC)
+        idle += CHANGES_POLL_SEC
+        if idle >= CHANGES_KEEPALIVE_SEC:
+            # комментарий SSE не даёт прокси закрыть простаивающее соединение
+            yield ": keepalive\n\n"
+            idle = 0.0
+
+@app.route('/changes', methods=['GET'])
+def get_changes():
+    """Изменения занятий, записей и курсов после курсора since.
+
+    Обычный запрос отдаёт страницу сразу; с wait=<сек> ждёт первых изменений
+    (long-poll). mode=sse или Accept: text/event-stream - поток Server-Sent
+    Events, переподключение продолжает с Last-Event-ID.
+    """
+    try:
+        since = int(request.args.get('since') or request.headers.get('Last-Event-ID') or 0)
+        limit = min(int(request.args.get('limit', CHANGES_PAGE_SIZE)), CHANGES_PAGE_SIZE)
+        wait = min(float(request.args.get('wait', 0)), CHANGES_MAX_WAIT_SEC)
+        if since < 0 or limit <= 0 or wait < 0:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": "invalid since, limit or wait"}), 400
 
-async def notpar(session_id: int, msg: str):
+    if request.args.get('mode') == 'sse' or request.accept_mimetypes.best == 'text/event-stream':
+        return Response(stream_with_context(changes_stream(since, limit)), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    deadline = monotonic() + wait
+    changes, next_since = changes_page(since, limit)
+    while not changes and monotonic() < deadline:
+        changelog.wait(min(CHANGES_POLL_SEC, deadline - monotonic()))
+        changes, next_since = changes_page(since, limit)
+    return jsonify({"changes": changes, "next": next_since})
+
+async def notpar(session_id: int, msg: str, only_chats: Optional[List[int]] = None) -> DeliveryReport:
     global tgapp
 
     if not tgapp:
-        return
+        return DeliveryReport()
+
+    sess = await repo.session_recipients(session_id)
+    if not sess:
+        return DeliveryReport()
+    return await send_notice(session_notice(sess, msg), notice_chats(sess), only_chats)
 
-    def getspnotsync():
+async def send_notice(text: str, chats: List[int], only_chats: Optional[List[int]] = None) -> DeliveryReport:
+    if not tgapp:
+        return DeliveryReport()
+    msgs = [(chat_id, text) for chat_id in chats if only_chats is None or chat_id in only_chats]
+    return await notifier.send(tgapp.bot, msgs, parse_mode='HTML')
+
+def deliver_outbox_row(s_id: int, msg: str, only_chats: Optional[List[int]],
+                       text: Optional[str], recipients: Optional[List[int]]):
+    # у строк со снимком (удалённое занятие) живой строки уже нет
+    if recipients is not None:
+        return send_notice(text, recipients, only_chats)
+    return notpar(s_id, msg, only_chats)
+
+async def dispatch_outbox(context: ContextTypes.DEFAULT_TYPE):
+    """Разбирает outbox пачками. Строка помечается доставленной только после рассылки,
+    поэтому после падения бота неотправленное уйдёт при следующем запуске."""
+    batch_size = app.config.get('OUTBOX_BATCH_SIZE', 50)
+    max_attempts = app.config.get('OUTBOX_MAX_ATTEMPTS', 5)
+
+    def get_pending_sync():
         with app.app_context():
-            sess = Session.query.options(db.joinedload(Session.course), db.joinedload(Session.participants)).get(session_id)
-            if not sess:
-                return None, []
-
-            s_info = {
-                'course_name': sess.course.name if sess.course else 'Курс',
-                'date_time': sess.date_time,
-                'location': sess.location,
-                'instructor': sess.instructor,
-                'status': sess.status,
-                'comment': sess.comment
-            }
-            to_notify = []
-            for p in sess.participants:
-                if p.telegram_id:
-                    to_notify.append({
-                        'telegram_id': p.telegram_id,
-                        'name': p.name,
-                        'notifications_enabled': p.notifications_enabled,
-                    })
-            return s_info, to_notify
-
-    s_info, to_notify = await asyncio.to_thread(getspnotsync)
-
-    if not s_info:
+            rows = NotificationOutbox.query.filter(
+                NotificationOutbox.delivered_at.is_(None),
+                NotificationOutbox.next_attempt_at <= datetime.now()
+            ).order_by(NotificationOutbox.id).limit(batch_size).all()
+            return [
+                (r.id, r.session_id, r.message, json.loads(r.retry_chats) if r.retry_chats else None,
+                 r.text, json.loads(r.recipients) if r.recipients is not None else None)
+                for r in rows
+            ]
+
+    try:
+        pending = await db_executor.run(get_pending_sync)
+    except DbBusy:
+        # пул занят - разберём на следующем тике
+        return
+    if not pending:
         return
 
-    for p_data in to_notify:
-        u_id = p_data['telegram_id']
-        if p_data['notifications_enabled']:
-            n_text = (
-                f"Уведомление о занятии:\n"
-                f"{msg}\n\n"
-                f"Курс: {s_info['course_name']}\n"
-                f"Дата и время: {s_info['date_time'].strftime('%d.%m.%Y %H:%M')}\n"
-                f"Место: {s_info['location'] or 'Не указано'}\n"
-                f"Инструктор: {s_info['instructor'] or 'Не указан'}"
-            )
-            if s_info['comment']:
-                 n_text += f"\nКомментарий: {s_info['comment']}"
-
-            try:
-                await tgapp.bot.send_message(
-                    chat_id=u_id,
-                    text=n_text,
-                    parse_mode='HTML'
-                )
-            except Exception as e:
-                pass
+    reports = await asyncio.gather(
+        *(deliver_outbox_row(*row[1:]) for row in pending),
+        return_exceptions=True
+    )
+
+    def mark_sync():
+        with app.app_context():
+            now = datetime.now()
+            for (o_id, *_), report in zip(pending, reports):
+                row = NotificationOutbox.query.get(o_id)
+                row.attempts += 1
+                if isinstance(report, BaseException):
+                    row.next_attempt_at = now + timedelta(seconds=30 * 2 ** min(row.attempts, 6))
+                    continue
+                row.sent_count += report.sent
+                row.failed_count = report.failed
+                if report.failed and row.attempts < max_attempts:
+                    row.retry_chats = json.dumps(report.failed_chats)
+                    row.next_attempt_at = now + timedelta(seconds=30 * 2 ** row.attempts)
+                else:
+                    row.delivered_at = now
+            db.session.commit()
+
+    await db_executor.run(mark_sync, reject=False)
 
 TOKEN = app.config.get('TELEGRAM_BOT_TOKEN')
 DEVELOPER_CHAT_ID = int(app.config.get('DEVELOPER_CHAT_ID'))
@@ -262,8 +1028,8 @@ SUGGEST_IDEA_TEXT = range(10)
     MANAGE_SESSION_SELECT, MANAGE_SESSION_ACTION,
     EDIT_SESSION_DATE, EDIT_SESSION_TIME, EDIT_SESSION_STATUS,
     EDIT_SESSION_INSTRUCTOR, EDIT_SESSION_LOCATION, EDIT_SESSION_COMMENT,
-    EDIT_SESSION_DURATION_MINUTES
-) = range(100, 116) 
+    EDIT_SESSION_DURATION_MINUTES, ADD_SESSION_REPEAT
+) = range(100, 117) 
 
 mainkeyb = ReplyKeyboardMarkup(
     [
@@ -283,25 +1049,31 @@ teachkeyb = ReplyKeyboardMarkup(
     one_time_keyboard=False,
 )
 
-def getsetkeysync(user_id: int) -> InlineKeyboardMarkup:
-    with app.app_context():
-        part = Participant.query.filter_by(telegram_id=user_id).first()
-        settings = {'notifications_enabled': True, 'warn_5_min': False}
-        if part:
-            settings['notifications_enabled'] = part.notifications_enabled
-            settings['warn_5_min'] = part.warn_5_min
-        
-        n_text = "Выкл. уведомлений" if settings['notifications_enabled'] else "Вкл. уведомлений"
-        warn_text = "Не предупреждать за 5 мин" if settings['warn_5_min'] else "Предупреждать за 5 мин до события"
+async def load_profile(user_id: int) -> Optional[Dict[str, Any]]:
+    return await repo.get_profile(user_id)
 
-        kb = [
-            [InlineKeyboardButton(n_text, callback_data='toggle_notifications')],
-            [InlineKeyboardButton(warn_text, callback_data='toggle_warning_time')],
-            [InlineKeyboardButton("Предложить идею разработчику", callback_data='suggest_idea')],
-        ]
-        return InlineKeyboardMarkup(kb)
+# профиль участника по telegram_id; None тоже кэшируется - профиля ещё нет
+participant_profiles = AsyncLoadingCache(
+    load_profile,
+    maxsize=app.config.get('PROFILE_CACHE_SIZE', 10000),
+    ttl=app.config.get('PROFILE_CACHE_TTL_SEC', 300),
+)
+
+def getsetkey(profile: Optional[Dict[str, Any]]) -> InlineKeyboardMarkup:
+    notifications_enabled = profile['notifications_enabled'] if profile else True
+    offsets = profile['offsets'] if profile else frozenset()
+
+    n_text = "Выкл. уведомлений" if notifications_enabled else "Вкл. уведомлений"
+
+    kb = [[InlineKeyboardButton(n_text, callback_data='toggle_notifications')]]
+    for m in REMINDER_OFFSETS:
+        warn_text = f"Не напоминать за {fmt_offset(m)}" if m in offsets else f"Напоминать за {fmt_offset(m)} до занятия"
+        kb.append([InlineKeyboardButton(warn_text, callback_data=f'toggle_reminder_{m}')])
+    kb.append([InlineKeyboardButton("Предложить идею разработчику", callback_data='suggest_idea')])
+    return InlineKeyboardMarkup(kb)
 
-def build_calendar(year: int, month: int) -> InlineKeyboardMarkup:
+def build_calendar(year: int, month: int, counts: Optional[Dict[int, int]] = None) -> InlineKeyboardMarkup:
+    counts = counts or {}
     kb = []
     kb.append([InlineKeyboardButton(f"{calendar.month_name[month]} {year}", callback_data="ignore")])
     week_days = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
@@ -314,7 +1086,8 @@ def build_calendar(year: int, month: int) -> InlineKeyboardMarkup:
                 row.append(InlineKeyboardButton(" ", callback_data="ignore"))
             else:
                 cb_data = f"schedule_day_{year}_{month}_{day}"
-                row.append(InlineKeyboardButton(str(day), callback_data=cb_data))
+                label = f"{day}·{counts[day]}" if day in counts else str(day)
+                row.append(InlineKeyboardButton(label, callback_data=cb_data))
         kb.append(row)
     
     today = date.today()
@@ -330,6 +1103,32 @@ def build_calendar(year: int, month: int) -> InlineKeyboardMarkup:
     ])
     return InlineKeyboardMarkup(kb)
 
+# версия данных по месяцу; растёт при любой записи занятия этого месяца
+month_versions: Dict[Tuple[int, int], int] = {}
+
+async def load_month_calendar(key: Tuple[int, int, int, date]) -> InlineKeyboardMarkup:
+    year, month, _, _ = key
+    counts = await repo.month_counts(year, month)
+    start = datetime(year, month, 1)
+    end = datetime(year, month, calendar.monthrange(year, month)[1], 23, 59, 59)
+    for occ in await repo.occurrences(start, end):
+        counts[occ.date_time.day] = counts.get(occ.date_time.day, 0) + 1
+    return build_calendar(year, month, counts)
+
+# готовые клавиатуры по (год, месяц, версия, сегодня); старые версии вытесняет LRU
+month_calendars = AsyncLoadingCache(load_month_calendar, maxsize=app.config.get('CALENDAR_CACHE_SIZE', 64))
+
+@on_sessions_changed
+def bump_month_versions(changes: List[SessionChange]):
+    for ch in changes:
+        for d in ch.dates():
+            key = (d.year, d.month)
+            month_versions[key] = month_versions.get(key, 0) + 1
+
+async def month_calendar(year: int, month: int) -> InlineKeyboardMarkup:
+    version = month_versions.get((year, month), 0)
+    return await month_calendars.load((year, month, version, date.today()))
+
 def getstatkey(current_status: str) -> InlineKeyboardMarkup:
     statuses = ['planned', 'completed', 'canceled', 'rescheduled']
     btns = []
@@ -358,17 +1157,13 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 async def profmen(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     u_id = update.effective_user.id
 
-    def get_part_from_db_sync():
-        with app.app_context():
-            return Participant.query.filter_by(telegram_id=u_id).first()
-    
-    part = await asyncio.to_thread(get_part_from_db_sync)
+    part = await participant_profiles.load(u_id)
 
     if part:
         await update.message.reply_text(
             f"<b>Ваш профиль:</b>\n"
-            f"<b>ФИО:</b> {part.name}\n"
-            f"<b>Группа/Компания:</b> {part.contact if part.contact else 'Не указано'}\n",
+            f"<b>ФИО:</b> {part['name']}\n"
+            f"<b>Группа/Компания:</b> {part['contact'] if part['contact'] else 'Не указано'}\n",
             parse_mode='HTML',
             reply_markup=mainkeyb,
         )
@@ -394,29 +1189,9 @@ async def askgrcmp(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     grp_cmp = update.message.text
     fio = context.user_data.pop('profile_fio')
 
-    def save_or_update_part_sync():
-        with app.app_context():
-            part = Participant.query.filter_by(telegram_id=u_id).first()
-            if not part:
-                part = Participant(
-                    telegram_id=u_id, 
-                    name=fio, 
-                    contact=grp_cmp,
-                    notifications_enabled=True,
-                    warn_5_min=False
-                )
-                db.session.add(part)
-            else:
-                part.name = fio
-                part.contact = grp_cmp
-            db.session.commit()
-            
-            return {
-                'name': part.name,
-                'contact': part.contact
-            }
-
-    p_data_saved = await asyncio.to_thread(save_or_update_part_sync)
+    part = await repo.save_profile(u_id, fio, grp_cmp)
+    p_data_saved = {'name': part.name, 'contact': part.contact}
+    participant_profiles.invalidate(u_id)
 
     await update.message.reply_text(
         f"<b>Ваш профиль успешно сохранен!</b>\n"
@@ -433,7 +1208,7 @@ async def cancproff(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 async def schent(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     today = date.today()
-    kb = build_calendar(today.year, today.month)
+    kb = await month_calendar(today.year, today.month)
     await update.message.reply_text("Выберите дату:", reply_markup=kb)
 
 async def calenhan(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -445,7 +1220,7 @@ async def calenhan(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         parts = data.split('_')
         year = int(parts[2])
         month = int(parts[3])
-        new_kb = build_calendar(year, month)
+        new_kb = await month_calendar(year, month)
         await query.edit_message_reply_markup(reply_markup=new_kb)
     elif data.startswith("schedule_day_"):
         parts = data.split('_')
@@ -468,53 +1243,47 @@ async def calenhan(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     elif data == "ignore":
         pass
 
-async def fetschapi(sel_date: date) -> str:
-
-    def getsessfdsync():
-        with app.app_context():
-            start_of_day = datetime.combine(sel_date, time.min)
-            end_of_day = datetime.combine(sel_date, time.max)
-            
-            sessions = Session.query.filter(
-                Session.date_time >= start_of_day,
-                Session.date_time <= end_of_day
-            ).order_by(Session.date_time).all()
-            
-            s_data = []
-            for s in sessions:
-                c_name = s.course.name if s.course else "Неизвестный курс"
-                s_data.append({
-                    "time": s.date_time.strftime('%H:%M'),
-                    "duration": s.duration_minutes,
-                    "course_name": c_name,
-                    "instructor": s.instructor,
-                    "location": s.location,
-                    "status": s.status,
-                    "comment": s.comment
-                })
-            return s_data
-
-    s_data = await asyncio.to_thread(getsessfdsync)
-
-    if not s_data:
+def render_day(sessions: List[Session]) -> str:
+    if not sessions:
         return "На этот день занятий нет! 🎉"
-    
-    res_str = ""
-    for s_info in s_data:
-        res_str += (
-            f"<b>{s_info['time']}</b> ({s_info['duration']} мин.) - {s_info['course_name']}\n"
-            f"  <i>Инструктор:</i> {s_info['instructor'] or 'Не указан'}\n"
-            f"  <i>Место:</i> {s_info['location'] or 'Не указано'}\n"
-            f"  <i>Статус:</i> {s_info['status']}\n"
+    parts = []
+    for s in sessions:
+        c_name = s.course.name if s.course else "Неизвестный курс"
+        parts.append(
+            f"<b>{s.date_time.strftime('%H:%M')}</b> ({s.duration_minutes} мин.) - {c_name}\n"
+            f"  <i>Инструктор:</i> {s.instructor or 'Не указан'}\n"
+            f"  <i>Место:</i> {s.location or 'Не указано'}\n"
+            f"  <i>Статус:</i> {s.status}\n"
         )
-        if s_info['comment']:
-            res_str += f"  <i>Комментарий:</i> {s_info['comment']}\n"
-        res_str += "\n"
-    return res_str
+        if s.comment:
+            parts.append(f"  <i>Комментарий:</i> {s.comment}\n")
+        parts.append("\n")
+    return "".join(parts)
+
+async def load_day_schedule(sel_date: date) -> str:
+    sessions = await repo.day_sessions(sel_date)
+    occs = await repo.occurrences(datetime.combine(sel_date, time.min), datetime.combine(sel_date, time.max))
+    return render_day(sorted(sessions + occs, key=series.sort_key))
+
+# готовый текст расписания на день; сбрасывается при любой записи занятия этого дня
+day_schedules = AsyncLoadingCache(
+    load_day_schedule,
+    maxsize=app.config.get('DAY_CACHE_SIZE', 366),
+    ttl=app.config.get('DAY_CACHE_TTL_SEC', 3600),
+)
+
+@on_sessions_changed
+def drop_day_schedules(changes: List[SessionChange]):
+    for ch in changes:
+        for d in ch.dates():
+            day_schedules.invalidate(d)
+
+async def fetschapi(sel_date: date) -> str:
+    return await day_schedules.load(sel_date)
 
 async def settings_entry(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     u_id = update.effective_user.id
-    kb = getsetkeysync(u_id)
+    kb = getsetkey(await participant_profiles.load(u_id))
     await update.message.reply_text("Ваши настройки уведомлений:", reply_markup=kb)
 
 async def sett(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Optional[int]:
@@ -523,34 +1292,28 @@ async def sett(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Optional[i
 
     u_id = update.effective_user.id
 
-    def gettogsett(u_id: int, setting_name: str):
-        with app.app_context():
-            part = Participant.query.filter_by(telegram_id=u_id).first()
-            if part:
-                current_val = getattr(part, setting_name)
-                new_val = not current_val
-                setattr(part, setting_name, new_val)
-                db.session.commit()
-                return new_val
-            return None
-
     if query.data == 'toggle_notifications':
-        new_val = await asyncio.to_thread(gettogsett, u_id, 'notifications_enabled')
+        new_val = await repo.toggle_notifications(u_id)
+        participant_profiles.invalidate(u_id)
         if new_val is not None:
             status_text = "включены" if new_val else "выключены"
             await query.edit_message_text(
                 f"Уведомления теперь {status_text}.\nВаши настройки уведомлений:",
-                reply_markup=getsetkeysync(u_id)
+                reply_markup=getsetkey(await participant_profiles.load(u_id))
             )
         else:
             await query.edit_message_text("Не удалось обновить настройки уведомлений. Профиль не найден.")
-    elif query.data == 'toggle_warning_time':
-        new_val = await asyncio.to_thread(gettogsett, u_id, 'warn_5_min')
+    elif query.data == 'toggle_warning_time' or query.data.startswith('toggle_reminder_'):
+        # toggle_warning_time - кнопка из старых сообщений, это смещение 5 минут
+        minutes = 5 if query.data == 'toggle_warning_time' else int(query.data.split('_')[-1])
+        new_val, instants = await repo.toggle_reminder(u_id, minutes)
+        reminder_scheduler.add(instants)
+        participant_profiles.invalidate(u_id)
         if new_val is not None:
-            status_text = "за 5 минут до события" if new_val else "не будут"
+            status_text = f"за {fmt_offset(minutes)} включено" if new_val else f"за {fmt_offset(minutes)} выключено"
             await query.edit_message_text(
-                f"Бот будет предупреждать {status_text}.\nВаши настройки уведомлений:",
-                reply_markup=getsetkeysync(u_id)
+                f"Напоминание {status_text}.\nВаши настройки уведомлений:",
+                reply_markup=getsetkey(await participant_profiles.load(u_id))
             )
         else:
             await query.edit_message_text("Не удалось обновить настройки времени предупреждения. Профиль не найден.")
@@ -596,11 +1359,7 @@ async def addsstart(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         await update.message.reply_text("У вас нет прав преподавателя.")
         return ConversationHandler.END
     
-    def getcoursync():
-        with app.app_context():
-            return Course.query.order_by(Course.name).all()
-
-    courses = await asyncio.to_thread(getcoursync)
+    courses = await repo.list_courses()
     
     if not courses:
         await update.message.reply_text("Пока нет доступных курсов. Сначала добавьте курсы через админку.", reply_markup=teachkeyb)
@@ -667,6 +1426,18 @@ async def addlocrec(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 async def addcomrec(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     comm = update.message.text
     context.user_data['new_session_comment'] = comm if comm != '-' else None
+    kb = [
+        [InlineKeyboardButton("Только это занятие", callback_data="add_session_repeat_0")],
+        [InlineKeyboardButton("Каждую неделю", callback_data="add_session_repeat_1")],
+        [InlineKeyboardButton("Раз в две недели", callback_data="add_session_repeat_2")],
+    ]
+    await update.message.reply_text("Повторять занятие?", reply_markup=InlineKeyboardMarkup(kb))
+    return ADD_SESSION_REPEAT
+
+async def addrepeatrec(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    weeks = int(query.data.split('_')[-1])
 
     c_id = context.user_data.get('new_session_course_id')
     s_dt = context.user_data.get('new_session_datetime')
@@ -675,30 +1446,39 @@ async def addcomrec(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     loc = context.user_data.get('new_session_location')
     comm_final = context.user_data.get('new_session_comment')
 
-    def crsess_sync(c_id, s_dt, dur, instr, loc, comm_final):
-        with app.app_context():
-            new_sess = Session(
-                course_id=c_id,
-                date_time=s_dt,
-                duration_minutes=dur,
-                instructor=instr,
-                location=loc,
-                comment=comm_final,
-                status='planned',
-                five_min_warn_sent=False
-            )
-            db.session.add(new_sess)
-            db.session.commit()
-            return new_sess.id, new_sess.course.name if new_sess.course else "Неизвестный курс"
-
-    s_id, c_name = await asyncio.to_thread(
-        crsess_sync, c_id, s_dt, dur, instr, loc, comm_final
-    )
+    if weeks:
+        # серия без конца: даты разворачиваются при показе, строками станут при правке или записи
+        new_sess = await repo.create_series(
+            course_id=c_id,
+            start_date=s_dt.date(),
+            start_time=s_dt.time(),
+            interval_weeks=weeks,
+            duration_minutes=dur,
+            instructor=instr,
+            location=loc,
+            comment=comm_final
+        )
+        repeat = "каждую неделю" if weeks == 1 else "раз в две недели"
+    else:
+        new_sess = await repo.create_session(
+            course_id=c_id,
+            date_time=s_dt,
+            duration_minutes=dur,
+            instructor=instr,
+            location=loc,
+            comment=comm_final,
+            status='planned',
+            five_min_warn_sent=False
+        )
+        repeat = "нет"
+    c_name = new_sess.course.name if new_sess.course else "Неизвестный курс"
 
-    await update.message.reply_text(
+    await query.edit_message_text(f"Повтор: {repeat}")
+    await query.message.reply_text(
         f"Занятие успешно добавлено!\n"
         f"Курс: {c_name}\n"
         f"Дата и время: {s_dt.strftime('%d.%m.%Y %H:%M')}\n"
+        f"Повтор: {repeat}\n"
         f"Инструктор: {instr}\n"
         f"Место: {loc}\n"
         f"Комментарий: {comm_final or 'Нет'}",
@@ -717,17 +1497,11 @@ async def manage_sessions_start(update: Update, context: ContextTypes.DEFAULT_TY
         await update.message.reply_text("У вас нет прав преподавателя.")
         return ConversationHandler.END
 
-    def get_upcoming_sessions_sync():
-        with app.app_context():
-            two_m_from_now = datetime.now() + timedelta(days=60)
-            sessions = Session.query.options(db.joinedload(Session.course)).filter(
-                Session.date_time >= datetime.now() - timedelta(hours=1),
-                Session.date_time <= two_m_from_now,
-                Session.status.in_(['planned', 'rescheduled'])
-            ).order_by(Session.date_time).all()
-            return sessions
-    
-    sessions = await asyncio.to_thread(get_upcoming_sessions_sync)
+    now = datetime.now()
+    sessions = await repo.upcoming_sessions(now)
+    # даты серий в том же окне; занятием дата сохраняется только при применении правок или удалении
+    occs = await repo.occurrences(now - timedelta(hours=1), now + timedelta(days=60))
+    sessions = sorted(sessions + occs, key=series.sort_key)
 
     if not sessions:
         await update.message.reply_text("Нет предстоящих занятий для управления.", reply_markup=teachkeyb)
@@ -737,40 +1511,52 @@ async def manage_sessions_start(update: Update, context: ContextTypes.DEFAULT_TY
     for s in sessions:
         c_name = s.course.name if s.course else "Неизвестный курс"
         s_text = f"{s.date_time.strftime('%d.%m.%Y %H:%M')} - {c_name} ({s.instructor or 'Без инструктора'})"
-        kb.append([InlineKeyboardButton(s_text, callback_data=f"manage_session_{s.id}")])
+        if s.id is None:
+            data = f"manage_occurrence_{s.series_id}_{s.occurrence_date.strftime('%Y%m%d')}"
+        else:
+            data = f"manage_session_{s.id}"
+        kb.append([InlineKeyboardButton(s_text, callback_data=data)])
     kb.append([InlineKeyboardButton("Отмена", callback_data="cancel_manage_session")])
     await update.message.reply_text("Выберите занятие для управления:", reply_markup=InlineKeyboardMarkup(kb))
     return MANAGE_SESSION_SELECT
 
-async def managsel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    query = update.callback_query
-    await query.answer()
-    s_id = int(query.data.split('_')[-1])
-    context.user_data['mngid'] = s_id
-
-    def get_session_details_sync(s_id):
-        with app.app_context():
-            return Session.query.options(db.joinedload(Session.course)).get(s_id)
-
-    sess = await asyncio.to_thread(get_session_details_sync, s_id)
-
-    if not sess:
-        await query.edit_message_text("Занятие не найдено или было удалено.", reply_markup=teachkeyb)
-        context.user_data.clear()
-        return ConversationHandler.END
-
+# черновик правок занятия: поля Session, которые преподаватель уже ввёл, но ещё не применил
+DRAFT_FIELDS = {
+    'date_time': "Дата и время",
+    'duration_minutes': "Длительность",
+    'status': "Статус",
+    'instructor': "Преподаватель",
+    'location': "Место",
+    'comment': "Комментарий",
+}
+
+def fmt_draft_value(field: str, value: Any) -> str:
+    if field == 'date_time':
+        return value.strftime('%d.%m.%Y %H:%M')
+    if field == 'duration_minutes':
+        return f"{value} мин."
+    if field == 'status':
+        return value.capitalize()
+    return value or 'Нет'
+
+def session_menu(sess: Session, draft: Dict[str, Any]) -> Tuple[str, InlineKeyboardMarkup]:
+    """Карточка занятия с учётом черновика и клавиатура действий."""
     c_name = sess.course.name if sess.course else "Неизвестный курс"
+    val = lambda field: draft.get(field, getattr(sess, field))
+    mark = lambda field: " ✏️" if field in draft else ""
     s_details = (
         f"<b>Выбрано занятие:</b>\n"
         f"<b>Курс:</b> {c_name}\n"
-        f"<b>Дата и время:</b> {sess.date_time.strftime('%d.%m.%Y %H:%M')}\n"
-        f"<b>Длительность:</b> {sess.duration_minutes} мин.\n"
-        f"<b>Инструктор:</b> {sess.instructor or 'Не указан'}\n"
-        f"<b>Место:</b> {sess.location or 'Не указано'}\n"
-        f"<b>Статус:</b> {sess.status.capitalize()}\n"
-        f"<b>Комментарий:</b> {sess.comment or 'Нет'}\n\n"
-        f"Что вы хотите изменить?"
+        f"<b>Дата и время:</b> {val('date_time').strftime('%d.%m.%Y %H:%M')}{mark('date_time')}\n"
+        f"<b>Длительность:</b> {val('duration_minutes')} мин.{mark('duration_minutes')}\n"
+        f"<b>Инструктор:</b> {val('instructor') or 'Не указан'}{mark('instructor')}\n"
+        f"<b>Место:</b> {val('location') or 'Не указано'}{mark('location')}\n"
+        f"<b>Статус:</b> {val('status').capitalize()}{mark('status')}\n"
+        f"<b>Комментарий:</b> {val('comment') or 'Нет'}{mark('comment')}\n\n"
     )
+    if draft:
+        s_details += "✏️ - изменения в черновике. Примените их, чтобы сохранить и оповестить участников.\n"
+    s_details += "Что вы хотите изменить?"
 
     kb = [
         [InlineKeyboardButton("Изменить дату/время", callback_data="edit_session_datetime")],
@@ -779,12 +1565,129 @@ async def managsel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         [InlineKeyboardButton("Изменить инструктора", callback_data="edit_session_instructor")],
         [InlineKeyboardButton("Изменить место", callback_data="edit_session_location")],
         [InlineKeyboardButton("Изменить комментарий", callback_data="edit_session_comment")],
-        [InlineKeyboardButton("Удалить занятие", callback_data="delete_session")],
-        [InlineKeyboardButton("Отмена", callback_data="cancel_manage_session")]
     ]
-    await query.edit_message_text(s_details, parse_mode='HTML', reply_markup=InlineKeyboardMarkup(kb))
+    if draft:
+        kb.append([InlineKeyboardButton(f"✅ Применить изменения ({len(draft)})", callback_data="apply_session_draft")])
+        kb.append([InlineKeyboardButton("Сбросить черновик", callback_data="discard_session_draft")])
+    kb.append([InlineKeyboardButton("Удалить занятие", callback_data="delete_session")])
+    kb.append([InlineKeyboardButton("Отмена", callback_data="cancel_manage_session")])
+    return s_details, InlineKeyboardMarkup(kb)
+
+async def managed_session(context: ContextTypes.DEFAULT_TYPE) -> Optional[Any]:
+    """Выбранное занятие: Session по mngid или несохранённая дата серии (Occurrence) по mngocc."""
+    if context.user_data.get('mngid'):
+        return await repo.get_session(context.user_data['mngid'])
+    ser_id, on = context.user_data['mngocc']
+    sess = await repo.occurrence(ser_id, on)
+    if sess is not None and sess.id is not None:
+        # дату уже сохранили в другом месте (правка, запись) - дальше работаем со строкой
+        context.user_data['mngid'] = sess.id
+    return sess
+
+async def managed_session_id(context: ContextTypes.DEFAULT_TYPE) -> Optional[int]:
+    """id выбранного занятия; несохранённую дату серии сохраняет строкой."""
+    if context.user_data.get('mngid'):
+        return context.user_data['mngid']
+    ser_id, on = context.user_data['mngocc']
+    context.user_data['mngid'] = await repo.materialize(ser_id, on)
+    return context.user_data['mngid']
+
+async def show_session_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    sess = await managed_session(context)
+    if not sess:
+        msg = update.callback_query.message if update.callback_query else update.message
+        await msg.reply_text("Занятие не найдено или было удалено.", reply_markup=teachkeyb)
+        context.user_data.clear()
+        return ConversationHandler.END
+
+    s_details, kb = session_menu(sess, context.user_data.setdefault('draft', {}))
+    if update.callback_query:
+        await update.callback_query.edit_message_text(s_details, parse_mode='HTML', reply_markup=kb)
+    else:
+        await update.message.reply_text(s_details, parse_mode='HTML', reply_markup=kb)
     return MANAGE_SESSION_ACTION
 
+async def stage_edit(update: Update, context: ContextTypes.DEFAULT_TYPE, field: str, value: Any) -> int:
+    context.user_data.setdefault('draft', {})[field] = value
+    return await show_session_menu(update, context)
+
+async def managsel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    s_id = int(query.data.split('_')[-1])
+    context.user_data['mngid'] = s_id
+    context.user_data['draft'] = {}
+    return await show_session_menu(update, context)
+
+async def managocc(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    _, _, ser_id, on = query.data.split('_')
+    # карточка строится по дате серии, строкой она станет при применении правок или удалении
+    context.user_data['mngid'] = None
+    context.user_data['mngocc'] = (int(ser_id), datetime.strptime(on, '%Y%m%d').date())
+    context.user_data['draft'] = {}
+    return await show_session_menu(update, context)
+
+def draft_notice(old: Dict[str, Any], sess: Session) -> Optional[str]:
+    """Одно уведомление на все применённые поля; None, если по факту ничего не поменялось."""
+    lines = []
+    for field, label in DRAFT_FIELDS.items():
+        if field not in old or old[field] == getattr(sess, field):
+            continue
+        if field == 'comment':
+            lines.append("Комментарий к занятию обновлен.")
+        else:
+            lines.append(f"{label}: {fmt_draft_value(field, getattr(sess, field))}")
+    if not lines:
+        return None
+    return "Занятие изменено:\n" + "\n".join(lines)
+
+async def applydraft(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    s_id = await managed_session_id(context)
+    draft = context.user_data.get('draft') or {}
+
+    def apply(sess: Session) -> Optional[str]:
+        old = {field: getattr(sess, field) for field in draft}
+        for field, value in draft.items():
+            setattr(sess, field, value)
+        if 'date_time' in draft and draft['date_time'] != old['date_time']:
+            if 'status' not in draft and sess.status == 'planned':
+                sess.status = 'rescheduled'
+                old.setdefault('status', 'planned')
+            sess.five_min_warn_sent = False
+        if 'status' in draft and sess.status in ('canceled', 'rescheduled'):
+            sess.five_min_warn_sent = False
+        return draft_notice(old, sess)
+
+    # правки и уведомление в outbox одной транзакцией; рассылку сделает dispatch_outbox
+    res = await repo.edit_session(s_id, apply) if s_id else None
+    if not res:
+        await query.edit_message_text("Занятие не найдено или было удалено.")
+        await query.message.reply_text("Возвращаюсь в меню преподавателя.", reply_markup=teachkeyb)
+        context.user_data.clear()
+        return ConversationHandler.END
+
+    sess, notice = res
+    c_name = sess.course.name if sess.course else "Курс"
+    if notice:
+        await query.edit_message_text(
+            f"Изменения занятия по курсу '{c_name}' сохранены, участники получат одно уведомление.\n\n{notice}"
+        )
+    else:
+        await query.edit_message_text(f"Изменений для занятия по курсу '{c_name}' нет.")
+    await query.message.reply_text("Возвращаюсь в меню преподавателя.", reply_markup=teachkeyb)
+    context.user_data.clear()
+    return ConversationHandler.END
+
+async def discarddraft(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer("Черновик сброшен")
+    context.user_data['draft'] = {}
+    return await show_session_menu(update, context)
+
 async def editstart(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
@@ -804,39 +1707,11 @@ async def editdaterec(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 async def edittimerec(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
         new_time = datetime.strptime(update.message.text, '%H:%M').time()
-        s_id = context.user_data['mngid']
-        old_date = context.user_data['new_edit_date']
-        new_dt = datetime.combine(old_date, new_time)
-
-        def update_sess_dt_sync(s_id, new_dt):
-            with app.app_context():
-                sess = Session.query.get(s_id)
-                if sess:
-                    old_dt = sess.date_time
-                    sess.date_time = new_dt
-                    sess.status = 'rescheduled' if sess.status == 'planned' and new_dt != old_dt else sess.status
-                    sess.five_min_warn_sent = False
-                    db.session.commit()
-                    return sess.course.name if sess.course else "Курс"
-                return None
-
-        c_name = await asyncio.to_thread(update_sess_dt_sync, s_id, new_dt)
-
-        if c_name:
-            await update.message.reply_text(
-                f"Дата и время занятия по курсу '{c_name}' успешно обновлены на {new_dt.strftime('%d.%m.%Y %H:%M')}.",
-                reply_markup=teachkeyb
-            )
-            await notpar(s_id, f"Дата и время занятия изменены на: {new_dt.strftime('%d.%m.%Y %H:%M')}")
-        else:
-            await update.message.reply_text("Ошибка при обновлении занятия.", reply_markup=teachkeyb)
-        
-        context.user_data.clear()
-        return ConversationHandler.END
-
     except ValueError:
         await update.message.reply_text("Неверный формат времени. Пожалуйста, введите время в формате ЧЧ:ММ.")
         return EDIT_SESSION_TIME
+    new_dt = datetime.combine(context.user_data.pop('new_edit_date'), new_time)
+    return await stage_edit(update, context, 'date_time', new_dt)
 
 async def editdur(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
@@ -849,46 +1724,16 @@ async def editdurrec(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         new_dur = int(update.message.text)
         if new_dur <= 0:
             raise ValueError
-
-        s_id = context.user_data['mngid']
-
-        def update_sess_dur_sync(s_id, new_dur):
-            with app.app_context():
-                sess = Session.query.get(s_id)
-                if sess:
-                    sess.duration_minutes = new_dur
-                    db.session.commit()
-                    return sess.course.name if sess.course else "Курс"
-                return None
-        
-        c_name = await asyncio.to_thread(update_sess_dur_sync, s_id, new_dur)
-
-        if c_name:
-            await update.message.reply_text(
-                f"Длительность занятия по курсу '{c_name}' успешно обновлена на {new_dur} мин.",
-                reply_markup=teachkeyb
-            )
-            await notpar(s_id, f"Длительность занятия изменена на: {new_dur} минут.")
-        else:
-            await update.message.reply_text("Ошибка при обновлении занятия.", reply_markup=teachkeyb)
-
-        context.user_data.clear()
-        return ConversationHandler.END
     except ValueError:
         await update.message.reply_text("Неверный формат длительности. Пожалуйста, введите целое число минут.")
         return EDIT_SESSION_DURATION_MINUTES
+    return await stage_edit(update, context, 'duration_minutes', new_dur)
 
 async def editstat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    s_id = context.user_data['mngid']
-
-    def get_current_status_sync(s_id):
-        with app.app_context():
-            sess = Session.query.get(s_id)
-            return sess.status if sess else 'planned'
-
-    cur_status = await asyncio.to_thread(get_current_status_sync, s_id)
+    sess = await managed_session(context)
+    cur_status = context.user_data.get('draft', {}).get('status') or (sess.status if sess else 'planned')
     kb = getstatkey(cur_status)
     await query.edit_message_text(f"Текущий статус: <b>{cur_status.capitalize()}</b>. Выберите новый статус:", parse_mode='HTML', reply_markup=kb)
     return EDIT_SESSION_STATUS
@@ -897,33 +1742,7 @@ async def editstatss(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
     new_status = query.data.split('_')[-1]
-    s_id = context.user_data['mngid']
-
-    def update_sess_status_sync(s_id, new_status):
-        with app.app_context():
-            sess = Session.query.get(s_id)
-            if sess:
-                old_status = sess.status
-                if old_status != new_status:
-                    sess.status = new_status
-                    if new_status in ['canceled', 'rescheduled']:
-                        sess.five_min_warn_sent = False
-                    db.session.commit()
-                    return sess.course.name if sess.course else "Курс", old_status, new_status
-            return None, None, None
-
-    c_name, old_status, new_status_c = await asyncio.to_thread(update_sess_status_sync, s_id, new_status)
-
-    if c_name:
-        await query.message.reply_text(
-            f"Статус занятия по курсу '{c_name}' успешно обновлен с '{old_status.capitalize()}' на '{new_status_c.capitalize()}'.",
-            reply_markup=teachkeyb
-        )
-        await notpar(s_id, f"Статус занятия изменен на: {new_status_c.capitalize()}")
-    else:
-        await query.message.reply_text("Ошибка при обновлении статуса занятия.", reply_markup=teachkeyb)
-    
-    context.user_data.clear()
+    return await stage_edit(update, context, 'status', new_status)
 
 async def editteach(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
@@ -932,31 +1751,7 @@ async def editteach(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return EDIT_SESSION_INSTRUCTOR
 
 async def editinstrec(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    new_instr = update.message.text
-    s_id = context.user_data['mngid']
-
-    def update_sess_instr_sync(s_id, new_instr):
-        with app.app_context():
-            sess = Session.query.get(s_id)
-            if sess:
-                sess.instructor = new_instr
-                db.session.commit()
-                return sess.course.name if sess.course else "Курс"
-            return None
-
-    c_name = await asyncio.to_thread(update_sess_instr_sync, s_id, new_instr)
-
-    if c_name:
-        await update.message.reply_text(
-            f"Преподаватель занятия по курсу '{c_name}' успешно обновлен на '{new_instr}'.",
-            reply_markup=teachkeyb
-        )
-        await notpar(s_id, f"Преподаватель занятия изменен на: {new_instr}")
-    else:
-        await update.message.reply_text("Ошибка при обновлении преподавателя занятия.", reply_markup=teachkeyb)
-    
-    context.user_data.clear()
-    return ConversationHandler.END
+    return await stage_edit(update, context, 'instructor', update.message.text)
 
 async def editloc(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
@@ -965,31 +1760,7 @@ async def editloc(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return EDIT_SESSION_LOCATION
 
 async def editlocrec(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    new_loc = update.message.text
-    s_id = context.user_data['mngid']
-
-    def updlocsync(s_id, new_loc):
-        with app.app_context():
-            sess = Session.query.get(s_id)
-            if sess:
-                sess.location = new_loc
-                db.session.commit()
-                return sess.course.name if sess.course else "Курс"
-            return None
-
-    c_name = await asyncio.to_thread(updlocsync, s_id, new_loc)
-
-    if c_name:
-        await update.message.reply_text(
-            f"Место проведения занятия по курсу '{c_name}' успешно обновлено на '{new_loc}'.",
-            reply_markup=teachkeyb
-        )
-        await notpar(s_id, f"Место проведения занятия изменено на: {new_loc}")
-    else:
-        await update.message.reply_text("Ошибка при обновлении места проведения занятия.", reply_markup=teachkeyb)
-    
-    context.user_data.clear()
-    return ConversationHandler.END
+    return await stage_edit(update, context, 'location', update.message.text)
 
 async def editcom(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
@@ -999,41 +1770,12 @@ async def editcom(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 async def editcomrec(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     new_comm = update.message.text
-    s_id = context.user_data['mngid']
-
-    def update_sess_comm_sync(s_id, new_comm):
-        with app.app_context():
-            sess = Session.query.get(s_id)
-            if sess:
-                sess.comment = new_comm if new_comm != '-' else None
-                db.session.commit()
-                return sess.course.name if sess.course else "Курс"
-            return None
-
-    c_name = await asyncio.to_thread(update_sess_comm_sync, s_id, new_comm)
-
-    if c_name:
-        await update.message.reply_text(
-            f"Комментарий к занятию по курсу '{c_name}' успешно обновлен.",
-            reply_markup=teachkeyb
-        )
-        await notpar(s_id, f"Комментарий к занятию обновлен.")
-    else:
-        await update.message.reply_text("Ошибка при обновлении комментария к занятию.", reply_markup=teachkeyb)
-    
-    context.user_data.clear()
-    return ConversationHandler.END
+    return await stage_edit(update, context, 'comment', new_comm if new_comm != '-' else None)
 
 async def delconf(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    s_id = context.user_data['mngid']
-
-    def getdelsync(s_id):
-        with app.app_context():
-            return Session.query.options(db.joinedload(Session.course)).get(s_id)
-    
-    sess_to_del = await asyncio.to_thread(getdelsync, s_id)
+    sess_to_del = await managed_session(context)
 
     if not sess_to_del:
         await query.edit_message_text("Занятие не найдено или уже удалено.", reply_markup=teachkeyb)
@@ -1044,7 +1786,7 @@ async def delconf(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     s_dt = sess_to_del.date_time.strftime('%d.%m.%Y %H:%M')
     
     kb = InlineKeyboardMarkup([
-        [InlineKeyboardButton("Да, удалить", callback_data=f"confirm_delete_session_{s_id}")],
+        [InlineKeyboardButton("Да, удалить", callback_data=f"confirm_delete_session_{sess_to_del.id or 0}")],
         [InlineKeyboardButton("Нет, отмена", callback_data="cancel_manage_session")]
     ])
     await query.edit_message_text(
@@ -1056,20 +1798,19 @@ async def delconf(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 async def delssexec(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    s_id = int(query.data.split('_')[-1])
+    # 0 - несохранённая дата серии: сохраняется и удаляется, удаление оставляет исключение серии
+    s_id = int(query.data.split('_')[-1]) or await managed_session_id(context)
 
-    def delsync(s_id):
-        with app.app_context():
-            sess = Session.query.options(db.joinedload(Session.course)).get(s_id)
-            if sess:
-                c_name = sess.course.name if sess.course else "Курс"
-                s_dt = sess.date_time.strftime('%d.%m.%Y %H:%M')
-                db.session.delete(sess)
-                db.session.commit()
-                return c_name, s_dt
-            return None, None
+    def notice(sess: Session) -> str:
+        c_name = sess.course.name if sess.course else "Курс"
+        return f"Занятие по курсу '{c_name}' ({sess.date_time.strftime('%d.%m.%Y %H:%M')}) было отменено (удалено)."
 
-    c_name, s_dt = await asyncio.to_thread(delsync, s_id)
+    # после удаления получателей не собрать: уведомление уходит в outbox той же транзакцией
+    sess = await repo.delete_session(s_id, notice) if s_id else None
+    c_name, s_dt = None, None
+    if sess:
+        c_name = sess.course.name if sess.course else "Курс"
+        s_dt = sess.date_time.strftime('%d.%m.%Y %H:%M')
 
     try:
         await query.delete_message()
@@ -1081,7 +1822,6 @@ async def delssexec(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             f"Занятие по курсу '{c_name}' ({s_dt}) успешно удалено.",
             reply_markup=teachkeyb
         )
-        await notpar(s_id, f"Занятие по курсу '{c_name}' ({s_dt}) было отменено (удалено).")
     else:
         await query.message.reply_text("Ошибка при удалении занятия или оно уже было удалено.", reply_markup=teachkeyb)
     
@@ -1097,7 +1837,11 @@ async def cancelss(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data.clear()
     return ConversationHandler.END
 
-async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def error_handler(update: Optional[object], context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not isinstance(update, Update):
+        # ошибка фоновой задачи (poll_bus, dispatch_outbox, prune_bus): отвечать некому
+        logger.error("job failed", exc_info=context.error)
+        return
     if update.effective_message:
         await update.effective_message.reply_text("Произошла ошибка. Пожалуйста, попробуйте еще раз.")
     if context.user_data:
@@ -1108,91 +1852,181 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         else:
             await update.effective_message.reply_text("Возвращаюсь в главное меню.", reply_markup=mainkeyb)
 
-async def chkupcm(context: ContextTypes.DEFAULT_TYPE):
-    now = datetime.now()
-    
-    n_time_lb = now + timedelta(minutes=4, seconds=45)
-    n_time_ub = now + timedelta(minutes=5, seconds=15)
+def fmt_db_stats(snap: Dict[str, Any]) -> str:
+    lines = [
+        f"<b>Пул БД:</b> {snap['workers']} потоков, очередь до {snap['max_queue']}",
+        f"Сейчас в работе: {snap['pending']}, максимум: {snap['pending_max']}",
+    ]
+    for name, st in sorted(snap['funcs'].items()):
+        lines.append(
+            f"<code>{name}</code>: {st['calls']} выз., отказов {st['rejected']}, ошибок {st['errors']}\n"
+            f"  ожидание {st['wait_avg_ms']:.1f}/{st['wait_max_ms']:.1f} мс, "
+            f"работа {st['run_avg_ms']:.1f}/{st['run_max_ms']:.1f} мс (сред./макс.)"
+        )
+    return "\n".join(lines)
 
-    def get_sessions_for_warning_sync():
+async def dbstats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_teacher(update.effective_user.id):
+        await update.message.reply_text("У вас нет прав преподавателя.")
+        return
+    await update.message.reply_text(fmt_db_stats(db_executor.snapshot()), parse_mode='HTML')
+
+async def chkupcm():
+    """Обход журнала напоминаний: наступившие pending-строки одним запросом
+    по частичному индексу, стоимость зависит только от их числа."""
+    batch_size = app.config.get('REMINDER_BATCH_SIZE', 500)
+
+    while True:
+        now = datetime.now()
+        rows = await repo.due_reminders(now, batch_size)
+        if not rows:
+            return
+
+        states: Dict[str, List[int]] = {'sent': [], 'failed': [], 'skipped': [], 'missed': []}
+        msgs, to_send = [], []
+        for r in rows:
+            if r.date_time <= now:
+                states['missed'].append(r.id)
+            elif not r.telegram_id or not r.notifications_enabled:
+                states['skipped'].append(r.id)
+            else:
+                n_msg = (
+                    f"⚡️ <b>Занятие через {fmt_offset(r.offset_minutes)}</b> ⚡️\n\n"
+                    f"<b>Курс:</b> {r.name or 'Курс'}\n"
+                    f"<b>Когда:</b> {r.date_time.strftime('%H:%M %d.%m.%Y')}\n"
+                    f"<b>Где:</b> {r.location or 'Не указано'}\n"
+                    f"<b>Инструктор:</b> {r.instructor or 'Не указан'}"
+                )
+                if r.comment:
+                     n_msg += f"\n<b>Комментарий:</b> {r.comment}"
+                msgs.append((r.telegram_id, n_msg))
+                to_send.append(r)
+
+        report = await notifier.send(tgapp.bot, msgs, parse_mode='HTML')
+        failed = set(report.failed_chats)
+        for r in to_send:
+            states['failed' if r.telegram_id in failed else 'sent'].append(r.id)
+        warned_s_ids = sorted({r.session_id for r in to_send if r.offset_minutes == 5 and r.telegram_id not in failed})
+        await repo.mark_reminders(now, states, warned_s_ids)
+
+        if len(rows) < batch_size:
+            return
+
+reminder_scheduler = ReminderScheduler(chkupcm)
+
+@on_sessions_flushed
+def sync_reminder_ledger(conn, changes: List[SessionChange]):
+    # перенос или удаление занятия обнуляет и уже отправленные напоминания
+    moved = {ch.session_id for ch in changes if ch.deleted or (ch.old_date_time and ch.old_date_time != ch.date_time)}
+    # записи и отписки правят журнал по своим парам сами (registration_changed)
+    rest = {ch.session_id for ch in changes if not ch.registration} - moved
+    instants = sync_session_reminders(conn, moved, reset=True) + sync_session_reminders(conn, rest)
+    schedule_reminders(conn, instants)
+
+@on_sessions_flushed
+def publish_session_changes(conn, changes: List[SessionChange]):
+    bus.publish(conn, 'sessions', [ch.as_dict() for ch in changes])
+
+def schedule_reminders(conn, instants: List[datetime]):
+    """Новые моменты журнала: в свой планировщик (если это процесс бота) и в шину."""
+    reminder_scheduler.add(instants)
+    if instants:
+        bus.publish(conn, 'reminders', [at.isoformat() for at in instants])
+
+# события из других процессов (API-воркеры); свои приходят повторно, обработчики идемпотентны
+
+@bus.on_event('sessions')
+def replay_session_changes(data: List[Dict[str, Any]]):
+    emit([SessionChange.from_dict(d) for d in data])
+
+@bus.on_event('reminders')
+def schedule_published_reminders(data: List[str]):
+    reminder_scheduler.add([datetime.fromisoformat(at) for at in data])
+
+@bus.on_event('participants')
+def drop_published_profiles(data: List[int]):
+    for tg_id in data:
+        participant_profiles.invalidate(tg_id)
+
+@bus.on_event('series')
+def drop_series_caches(data: List[int]):
+    # серия меняет даты на месяцы вперёд: дни и месяцы пересобираются заново
+    day_schedules.clear()
+    month_calendars.clear()
+
+bus_cursor = 0
+
+async def poll_bus(context: ContextTypes.DEFAULT_TYPE):
+    global bus_cursor
+    rows = await repo.bus_events(bus_cursor, app.config.get('BUS_BATCH_SIZE', 500))
+    if rows:
+        bus_cursor = bus.dispatch(rows)
+    elif await repo.bus_head() < bus_cursor:
+        # id пошли заново (старая таблица без AUTOINCREMENT или пересозданная БД):
+        # читаем всё, что есть - обработчики идемпотентны
+        logger.warning("bus head went back below cursor %s, rereading bus", bus_cursor)
+        bus_cursor = 0
+
+async def prune_bus(context: ContextTypes.DEFAULT_TYPE):
+    await repo.prune_bus(datetime.now() - timedelta(seconds=app.config.get('BUS_RETENTION_SEC', 3600)))
+
+def backfill_reminder_offsets_sync():
+    """Участникам со старым флагом warn_5_min без записей смещений добавляет 5 минут."""
+    with app.app_context():
+        p_ids = db.session.execute(
+            select(Participant.id).where(
+                Participant.warn_5_min == True,
+                ~select(ReminderOffset.id).where(ReminderOffset.participant_id == Participant.id).exists()
+            )
+        ).scalars().all()
+        if p_ids:
+            db.session.execute(insert(ReminderOffset), [{"participant_id": p_id, "minutes": 5} for p_id in p_ids])
+            sync_participant_reminders(db.session.connection(), p_ids)
+            db.session.commit()
+
+async def start_reminders(application: Application):
+    def get_upcoming_reminders_sync():
         with app.app_context():
-            sessions = Session.query.options(db.joinedload(Session.course), db.joinedload(Session.participants)).filter(
-                Session.date_time >= n_time_lb,
-                Session.date_time <= n_time_ub,
-                Session.status == 'planned',
-                Session.five_min_warn_sent == False
-            ).all()
-
-            s_list = []
-            for sess in sessions:
-                parts_data = []
-                for p in sess.participants:
-                    if p.telegram_id:
-                        parts_data.append({
-                            'telegram_id': p.telegram_id,
-                            'name': p.name,
-                            'notifications_enabled': p.notifications_enabled,
-                            'warn_5_min': p.warn_5_min
-                        })
-                if parts_data:
-                    s_list.append({
-                        'id': sess.id,
-                        'course_name': sess.course.name if sess.course else 'Курс',
-                        'date_time': sess.date_time,
-                        'location': sess.location,
-                        'instructor': sess.instructor,
-                        'comment': sess.comment,
-                        'participants': parts_data
-                    })
-            return s_list
-
-    sessions_for_warning = await asyncio.to_thread(get_sessions_for_warning_sync)
-
-    for s_info in sessions_for_warning:
-        s_id = s_info['id']
-        
-        n_msg = (
-            f"⚡️ <b>Занятие скоро начнется!</b> ⚡️\n\n"
-            f"<b>Курс:</b> {s_info['course_name']}\n"
-            f"<b>Когда:</b> {s_info['date_time'].strftime('%H:%M %d.%m.%Y')}\n"
-            f"<b>Где:</b> {s_info['location'] or 'Не указано'}\n"
-            f"<b>Инструктор:</b> {s_info['instructor'] or 'Не указан'}"
-        )
-        if s_info['comment']:
-             n_msg += f"\n<b>Комментарий:</b> {s_info['comment']}"
-        
-        any_n_sent = False
-
-        for p_data in s_info['participants']:
-            u_id = p_data['telegram_id']
-            if p_data['notifications_enabled'] and p_data['warn_5_min']:
-                try:
-                    await context.bot.send_message(
-                        chat_id=u_id,
-                        text=n_msg,
-                        parse_mode='HTML'
-                    )
-                    any_n_sent = True
-                except Exception as e:
-                    pass
-        
-        if any_n_sent:
-            def mark_session_warned_sync(s_id: int):
-                with app.app_context():
-                    sess = Session.query.get(s_id)
-                    if sess:
-                        sess.five_min_warn_sent = True
-                        db.session.commit()
-            await asyncio.to_thread(mark_session_warned_sync, s_id)
+            return db.session.execute(
+                select(Reminder.due_at).where(Reminder.state == 'pending').distinct()
+            ).scalars().all()
+
+    global bus_cursor
+    # всё до этого id уже отражено в БД, которую читаем ниже; дальше - через шину
+    bus_cursor = await repo.bus_head()
+    await db_executor.run(backfill_reminder_offsets_sync, reject=False)
+    reminder_scheduler.start(await db_executor.run(get_upcoming_reminders_sync, reject=False))
+
+async def stop_reminders(application: Application):
+    await reminder_scheduler.stop()
+    await repo.dispose()
+    db_executor.shutdown()
 
 def runapiapp():
-    app.run(debug=True, use_reloader=False, host='0.0.0.0', port=5000)
+    # для продакшена - wsgi.py под многопроцессным WSGI-сервером
+    app.run(debug=app.config.get('API_DEBUG', False), use_reloader=False, host='0.0.0.0', port=5000)
 
-def runbotapp():
+def buildbotapp(builder: Optional[ApplicationBuilder] = None) -> Application:
+    """Бот со всеми обработчиками и фоновыми задачами, без запуска.
+
+    builder - для стендов (свой base_url заглушки Bot API); по умолчанию
+    настоящий API с токеном из конфига.
+    """
     global tgapp, jqu
-    tgapp = Application.builder().token(TOKEN).build()
+    # апдейты разных чатов параллельно, одного чата - по порядку (ConversationHandler)
+    upd_proc = ChatOrderedUpdateProcessor(
+        concurrency=app.config.get('BOT_CONCURRENT_UPDATES', 32),
+        max_pending=app.config.get('BOT_MAX_PENDING_UPDATES', 1024),
+    )
+    tgapp = (
+        (builder or Application.builder().token(TOKEN))
+        .concurrent_updates(upd_proc)
+        .post_init(start_reminders).post_shutdown(stop_reminders)
+        .build()
+    )
     jqu = tgapp.job_queue
     tgapp.add_handler(CommandHandler("start", start))
+    tgapp.add_handler(CommandHandler("dbstats", dbstats))
     tgapp.add_handler(MessageHandler(filters.Regex("^Назад в главное меню$"), start))
     prof_conv_h = ConversationHandler(
         entry_points=[MessageHandler(filters.Regex("^Профиль$"), profmen)],
@@ -1215,7 +2049,7 @@ def runbotapp():
         fallbacks=[CommandHandler("cancel", cancidconv), MessageHandler(filters.Regex("^Отмена$"), cancidconv)],
     )
     tgapp.add_handler(sett_conv_h)
-    tgapp.add_handler(CallbackQueryHandler(sett, pattern=r"^(toggle_notifications|toggle_warning_time|suggest_idea)"))
+    tgapp.add_handler(CallbackQueryHandler(sett, pattern=r"^(toggle_notifications|toggle_warning_time|toggle_reminder_\d+|suggest_idea)"))
 
     tgapp.add_handler(MessageHandler(filters.Regex("^Меню преподавателя$"), teachmenu))
 
@@ -1229,6 +2063,7 @@ def runbotapp():
             ADD_SESSION_INSTRUCTOR: [MessageHandler(filters.TEXT & ~filters.COMMAND, addinstrec)],
             ADD_SESSION_LOCATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, addlocrec)],
             ADD_SESSION_COMMENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, addcomrec)],
+            ADD_SESSION_REPEAT: [CallbackQueryHandler(addrepeatrec, pattern=r"^add_session_repeat_[012]$")],
         },
         fallbacks=[CommandHandler("cancel", addcancel), MessageHandler(filters.Regex("^Отмена$"), addcancel)],
         map_to_parent={ ConversationHandler.END: MANAGE_SESSION_SELECT }
@@ -1240,6 +2075,7 @@ def runbotapp():
         states={
             MANAGE_SESSION_SELECT: [
                 CallbackQueryHandler(managsel, pattern=r"^manage_session_\d+$"),
+                CallbackQueryHandler(managocc, pattern=r"^manage_occurrence_\d+_\d{8}$"),
                 CallbackQueryHandler(cancelss, pattern=r"^cancel_manage_session$")
             ],
             MANAGE_SESSION_ACTION: [
@@ -1249,6 +2085,8 @@ def runbotapp():
                 CallbackQueryHandler(editteach, pattern=r"^edit_session_instructor$"),
                 CallbackQueryHandler(editloc, pattern=r"^edit_session_location$"),
                 CallbackQueryHandler(editcom, pattern=r"^edit_session_comment$"),
+                CallbackQueryHandler(applydraft, pattern=r"^apply_session_draft$"),
+                CallbackQueryHandler(discarddraft, pattern=r"^discard_session_draft$"),
                 CallbackQueryHandler(delconf, pattern=r"^delete_session$"),
                 CallbackQueryHandler(delssexec, pattern=r"^confirm_delete_session_\d+$"),
                 CallbackQueryHandler(cancelss, pattern=r"^cancel_manage_session$"),
@@ -1276,15 +2114,80 @@ def runbotapp():
 
     tgapp.add_error_handler(error_handler)
 
-    jqu.run_repeating(chkupcm, interval=30, first=5) 
+    jqu.run_repeating(dispatch_outbox, interval=app.config.get('OUTBOX_POLL_INTERVAL_SEC', 2), first=1)
+    jqu.run_repeating(poll_bus, interval=app.config.get('BUS_POLL_INTERVAL_SEC', 0.5), first=0.5)
+    jqu.run_repeating(prune_bus, interval=600, first=60)
+    return tgapp
 
-    tgapp.run_polling(allowed_updates=Update.ALL_TYPES)
+def runbotapp():
+    buildbotapp()
+    if app.config.get('BOT_MODE') == 'webhook':
+        url = app.config.get('WEBHOOK_URL')
+        secret = app.config.get('WEBHOOK_SECRET')
+        if not secret:
+            if not url:
+                # апдейты шлёт прокси или стенд: он должен знать секрет заранее
+                sys.exit("BOT_MODE=webhook without WEBHOOK_URL requires WEBHOOK_SECRET")
+            # телеграм получает секрет через setWebhook, знать его никому больше не нужно
+            secret = secrets.token_urlsafe(32)
+        asyncio.run(run_webhook(
+            tgapp,
+            listen=app.config.get('WEBHOOK_LISTEN', '0.0.0.0'),
+            port=app.config.get('WEBHOOK_PORT', 8443),
+            path=app.config.get('WEBHOOK_PATH', '/telegram'),
+            secret=secret,
+            url=url,
+            allowed_updates=ALLOWED_UPDATES,
+            post_init=start_reminders,
+            post_shutdown=stop_reminders,
+        ))
+    else:
+        tgapp.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 def reset_database():
     with app.app_context():
         db.drop_all()
         db.create_all()
 
+def plan_checks() -> List[Tuple[str, Any, str]]:
+    """Горячие запросы и индекс, который должен быть в их плане."""
+    now = datetime.now()
+    after = (now, 1)
+    return [
+        ("fetschapi", day_sessions_query(now.date()), "ix_session_date_time"),
+        ("build_calendar", month_counts_query(now.year, now.month), "ix_session_date_time"),
+        ("manage_sessions_start", upcoming_sessions_query(now), "ix_session_status_date_time"),
+        ("chkupcm", due_reminders_query(now, 500), "ix_reminder_pending_due"),
+        ("get_schedule", schedule_page_query({}, after, SCHEDULE_PAGE_SIZE), "ix_session_date_time"),
+        ("get_schedule?status", schedule_page_query({'status': ['planned']}, after, SCHEDULE_PAGE_SIZE), "ix_session_status_date_time"),
+        ("get_schedule?course_id", schedule_page_query({'course_id': 1}, after, SCHEDULE_PAGE_SIZE), "ix_session_course_id_date_time"),
+        ("get_schedule participants",
+         select(participants_sessions).where(participants_sessions.c.session_id.in_([1, 2, 3])),
+         "ux_participants_sessions"),
+        ("sync_participant_reminders",
+         select(Reminder.id).where(Reminder.participant_id == 1, Reminder.state == 'pending'),
+         "ix_reminder_participant_id"),
+    ]
+
+def query_plan(query) -> List[str]:
+    """Шаги EXPLAIN QUERY PLAN; вызывать внутри app_context."""
+    stmt = query.statement if hasattr(query, 'statement') else query
+    sql = str(stmt.compile(dialect=db.engine.dialect, compile_kwargs={"literal_binds": True}))
+    return [row[-1] for row in db.session.execute(text("EXPLAIN QUERY PLAN " + sql))]
+
+def check_query_plans() -> bool:
+    """Печатает планы plan_checks, False если индекс не используется (те же проверки - tests/test_query_plans.py)."""
+    ok = True
+    with app.app_context():
+        for name, query, index in plan_checks():
+            plan = query_plan(query)
+            used = any(index in step for step in plan)
+            ok = ok and used
+            print(f"{'OK  ' if used else 'FAIL'} {name}: expected {index}")
+            for step in plan:
+                print(f"       {step}")
+    return ok
+
 if __name__ == '__main__':
     req_part_attrs = ['telegram_id', 'notifications_enabled', 'warn_5_min']
     req_sess_attrs = ['five_min_warn_sent']
@@ -1304,9 +2207,21 @@ if __name__ == '__main__':
         reset_database()
         sys.exit(0)
     
-    with app.app_context():
-        db.create_all()
+    if len(sys.argv) > 1 and sys.argv[1] == 'check_plans':
+        with app.app_context():
+            upgrade_schema()
+        sys.exit(0 if check_query_plans() else 1)
 
-    flask_thread = threading.Thread(target=runapiapp)
-    flask_thread.start()
-    runbotapp()
\ No newline at end of file
+    with app.app_context():
+        upgrade_schema()
+
+    # api и bot - отдельные процессы; без аргумента оба в одном (для разработки)
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'all'
+    if mode == 'api':
+        runapiapp()
+    elif mode == 'bot':
+        runbotapp()
+    else:
+        flask_thread = threading.Thread(target=runapiapp)
+        flask_thread.start()
+        runbotapp()
\ No newline at end of file
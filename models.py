@@ -3,7 +3,10 @@ import datetime
 
 participants_sessions = db.Table('participants_sessions',
     db.Column('participant_id', db.Integer, db.ForeignKey('participant.id')),
-    db.Column('session_id', db.Integer, db.ForeignKey('session.id'))
+    db.Column('session_id', db.Integer, db.ForeignKey('session.id')),
+    # индексом, а не ограничением таблицы: так его можно добавить в уже существующую БД
+    db.Index('ux_participants_sessions', 'session_id', 'participant_id', unique=True),
+    db.Index('ix_participants_sessions_participant_id', 'participant_id'),
 )
 
 class Course(db.Model):
@@ -12,6 +15,7 @@ class Course(db.Model):
     direction = db.Column(db.String(64))
     group = db.Column(db.String(64))
     sessions = db.relationship('Session', backref='course', cascade='all, delete-orphan', lazy=True)
+    series = db.relationship('SessionSeries', backref='course', cascade='all, delete-orphan', lazy=True)
 
 class Participant(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -23,6 +27,14 @@ class Participant(db.Model):
     warn_5_min = db.Column(db.Boolean, default=False, nullable=False)
 
 class Session(db.Model):
+    __table_args__ = (
+        db.Index('ix_session_date_time', 'date_time'),
+        db.Index('ix_session_status_date_time', 'status', 'date_time'),
+        db.Index('ix_session_course_id_date_time', 'course_id', 'date_time'),
+        # одна сохранённая строка на дату серии
+        db.Index('ux_session_series_occurrence', 'series_id', 'occurrence_date', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
     date_time = db.Column(db.DateTime, nullable=False)
@@ -32,4 +44,118 @@ class Session(db.Model):
     status = db.Column(db.String(32), default='planned')
     comment = db.Column(db.Text)
     participants = db.relationship('Participant', secondary=participants_sessions, back_populates='sessions')
-    five_min_warn_sent = db.Column(db.Boolean, default=False, nullable=False)
\ No newline at end of file
+    five_min_warn_sent = db.Column(db.Boolean, default=False, nullable=False)
+    # занятие серии, сохранённое при правке или записи; occurrence_date - дата по правилу,
+    # даже если само занятие потом перенесли
+    series_id = db.Column(db.Integer, db.ForeignKey('session_series.id'))
+    occurrence_date = db.Column(db.Date)
+
+class NotificationOutbox(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    # без внешнего ключа: уведомление об удалении занятия переживает саму строку
+    session_id = db.Column(db.Integer, nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    # снимок на момент записи (удаление занятия): готовый текст и telegram_id получателей
+    # в JSON; пусто - текст и получатели берутся из живой строки занятия при рассылке
+    text = db.Column(db.Text)
+    recipients = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.now, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.datetime.now, nullable=False, index=True)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    retry_chats = db.Column(db.Text)
+    sent_count = db.Column(db.Integer, default=0, nullable=False)
+    failed_count = db.Column(db.Integer, default=0, nullable=False)
+    delivered_at = db.Column(db.DateTime, index=True)
+
+
+class ReminderOffset(db.Model):
+    """За сколько минут до занятия участник хочет получить напоминание."""
+    __table_args__ = (db.UniqueConstraint('participant_id', 'minutes'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    participant_id = db.Column(db.Integer, db.ForeignKey('participant.id'), nullable=False)
+    minutes = db.Column(db.Integer, nullable=False)
+
+
+class Reminder(db.Model):
+    """Журнал напоминаний: одна строка на (занятие, участник, смещение).
+
+    Строки создаются заранее при записи на занятие и изменении времени,
+    поэтому обход находит только наступившие pending по частичному индексу.
+    """
+    __table_args__ = (
+        db.UniqueConstraint('session_id', 'participant_id', 'offset_minutes'),
+        db.Index('ix_reminder_pending_due', 'due_at', sqlite_where=db.text("state = 'pending'")),
+        db.Index('ix_reminder_participant_id', 'participant_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.Integer, db.ForeignKey('session.id'), nullable=False)
+    participant_id = db.Column(db.Integer, db.ForeignKey('participant.id'), nullable=False)
+    offset_minutes = db.Column(db.Integer, nullable=False)
+    due_at = db.Column(db.DateTime, nullable=False)
+    state = db.Column(db.String(16), default='pending', nullable=False)
+    sent_at = db.Column(db.DateTime)
+
+
+class BusEvent(db.Model):
+    """Событие для других процессов (API -> бот). Пишется в той же транзакции,
+    что и изменение; id растёт в порядке коммитов, т.к. писатель в sqlite один.
+    AUTOINCREMENT: после очистки старых событий id не начинаются заново с 1."""
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(32), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.now, nullable=False, index=True)
+
+
+class DataVersion(db.Model):
+    """Монотонные версии данных для условных GET: 'global', 'refs' (имена курсов
+    и участников внутри ответов) и 'session:<id>'."""
+    key = db.Column(db.String(32), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    # UTC, для Last-Modified
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+
+class ChangeLog(db.Model):
+    """Журнал изменений для /changes: только дописывается, seq - курсор клиента."""
+    seq = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    # 'session' (в том числе записи на занятие), 'course' или 'series'
+    entity = db.Column(db.String(16), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    # 'upsert' или 'delete'
+    op = db.Column(db.String(8), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+
+class SessionSeries(db.Model):
+    """Повторяющееся занятие: раз в interval_weeks недель в день недели start_date.
+
+    Даты разворачиваются в занятия только внутри окна запроса (series.py);
+    строкой Session дата становится при правке или записи на неё.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False, index=True)
+    start_date = db.Column(db.Date, nullable=False)
+    # включительно; None - без конца
+    until = db.Column(db.Date)
+    start_time = db.Column(db.Time, nullable=False)
+    interval_weeks = db.Column(db.Integer, default=1, nullable=False)
+    duration_minutes = db.Column(db.Integer, default=90)
+    instructor = db.Column(db.String(128))
+    location = db.Column(db.String(128))
+    comment = db.Column(db.Text)
+    exceptions = db.relationship('SeriesException', backref='series', cascade='all, delete-orphan', lazy=True)
+
+
+class SeriesException(db.Model):
+    """Пропущенная дата серии (праздник, отмена без сохранения занятия)."""
+    __table_args__ = (
+        db.Index('ux_series_exception', 'series_id', 'occurrence_date', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    series_id = db.Column(db.Integer, db.ForeignKey('session_series.id'), nullable=False)
+    occurrence_date = db.Column(db.Date, nullable=False)
@@ -0,0 +1,163 @@
+import asyncio
+import random
+import time
+from datetime import timedelta
+from typing import Dict, Any, List, Tuple, Iterable
+
+from telegram import Bot
+from telegram.error import RetryAfter, NetworkError, TimedOut, BadRequest
+
+
+class TokenBucket:
+    """Глобальный лимит отправки: rate сообщений в секунду, всплеск до capacity."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def block(self, seconds: float):
+        # после flood control телеграм не примет ничего, пауза общая для всех
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ChatLimiter:
+    """Не чаще одного сообщения в interval секунд в один чат."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.next_at: Dict[int, float] = {}
+        self.locks: Dict[int, asyncio.Lock] = {}
+
+    async def acquire(self, chat_id: int):
+        lock = self.locks.setdefault(chat_id, asyncio.Lock())
+        async with lock:
+            wait = self.next_at.get(chat_id, 0.0) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self.next_at[chat_id] = time.monotonic() + self.interval
+        if len(self.next_at) > 10000:
+            self.prune()
+
+    def prune(self):
+        now = time.monotonic()
+        for chat_id, at in list(self.next_at.items()):
+            if at <= now and not self.locks[chat_id].locked():
+                del self.next_at[chat_id]
+                del self.locks[chat_id]
+
+
+def session_notice(sess, msg: str) -> str:
+    """Текст уведомления участникам занятия: msg и карточка занятия."""
+    text = (
+        f"Уведомление о занятии:\n"
+        f"{msg}\n\n"
+        f"Курс: {sess.course.name if sess.course else 'Курс'}\n"
+        f"Дата и время: {sess.date_time.strftime('%d.%m.%Y %H:%M')}\n"
+        f"Место: {sess.location or 'Не указано'}\n"
+        f"Инструктор: {sess.instructor or 'Не указан'}"
+    )
+    if sess.comment:
+        text += f"\nКомментарий: {sess.comment}"
+    return text
+
+
+def notice_chats(sess) -> List[int]:
+    """telegram_id записанных на занятие, у которых включены уведомления."""
+    return [p.telegram_id for p in sess.participants if p.telegram_id and p.notifications_enabled]
+
+
+class DeliveryReport:
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.failed_chats: List[int] = []
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'failed_chats': self.failed_chats,
+        }
+
+
+def retry_delay(e: RetryAfter) -> float:
+    delay = e.retry_after
+    if isinstance(delay, timedelta):
+        return delay.total_seconds()
+    return float(delay)
+
+
+class Notifier:
+    """Рассылка сообщений с ограниченным параллелизмом и лимитами телеграма.
+
+    Один экземпляр на процесс: лимиты общие для всех одновременных рассылок.
+    """
+
+    def __init__(self, rate: float = 30, chat_interval: float = 1.0, concurrency: int = 20,
+                 max_retries: int = 3, backoff: float = 1.0):
+        self.bucket = TokenBucket(rate, capacity=rate)
+        self.chats = ChatLimiter(chat_interval)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    async def send_one(self, bot: Bot, chat_id: int, text: str, report: DeliveryReport, **kwargs) -> bool:
+        attempt = 0
+        while True:
+            await self.chats.acquire(chat_id)
+            await self.bucket.acquire()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                report.sent += 1
+                return True
+            except RetryAfter as e:
+                delay = retry_delay(e)
+                self.bucket.block(delay)
+            except (TimedOut, NetworkError) as e:
+                if isinstance(e, BadRequest):
+                    # BadRequest наследуется от NetworkError, повтор не поможет
+                    break
+                delay = self.backoff * 2 ** attempt + random.uniform(0, self.backoff)
+            except Exception:
+                # Forbidden (бот заблокирован) и прочее - без повторов
+                break
+            attempt += 1
+            if attempt > self.max_retries:
+                break
+            report.retried += 1
+            await asyncio.sleep(delay)
+        report.failed += 1
+        report.failed_chats.append(chat_id)
+        return False
+
+    async def send(self, bot: Bot, messages: Iterable[Tuple[int, str]], **kwargs) -> DeliveryReport:
+        report = DeliveryReport()
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def worker(chat_id: int, text: str):
+            async with sem:
+                await self.send_one(bot, chat_id, text, report, **kwargs)
+
+        await asyncio.gather(*(worker(chat_id, text) for chat_id, text in messages))
+        return report
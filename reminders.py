@@ -0,0 +1,154 @@
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Iterable, List, Optional, Set
+
+from sqlalchemy import select, delete, and_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import Session, Reminder, ReminderOffset, participants_sessions
+
+# дольше не спим, чтобы не разъезжаться с часами после перевода времени
+MAX_SLEEP_SEC = 300
+# через сколько повторить обход, упавший с ошибкой (например, database is locked)
+RETRY_SEC = 30
+
+logger = logging.getLogger(__name__)
+
+
+class ReminderScheduler:
+    """Куча моментов напоминаний, срабатывающая точно в срок без опроса БД.
+
+    Заполняется из журнала один раз при старте, дальше только дополняется
+    через add, который можно вызывать из любого потока. В наступивший момент
+    вызывается fire (обход журнала); лишние моменты дают пустой обход.
+    """
+
+    def __init__(self, fire: Callable[[], Awaitable]):
+        self.fire = fire
+        self.heap: List[datetime] = []
+        self.queued: Set[datetime] = set()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.wakeup: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self, instants: Iterable[datetime]):
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self._add(list(instants))
+        # всё, что наступило пока бот лежал, отправляем сразу
+        self._add([datetime.now()])
+        self.task = self.loop.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def add(self, instants: Iterable[datetime]):
+        if self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(self._add, list(instants))
+
+    def _add(self, instants: List[datetime]):
+        for at in instants:
+            if at not in self.queued:
+                self.queued.add(at)
+                heapq.heappush(self.heap, at)
+        self.wakeup.set()
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            now = datetime.now()
+            due = False
+            while self.heap and self.heap[0] <= now:
+                self.queued.discard(heapq.heappop(self.heap))
+                due = True
+            if due:
+                # несколько наступивших моментов схлопываются в один обход
+                try:
+                    await self.fire()
+                except Exception:
+                    # задача не должна умирать: pending-строки журнала подберёт повторный обход
+                    logger.exception("reminder sweep failed, retrying in %ss", RETRY_SEC)
+                    self._add([datetime.now() + timedelta(seconds=RETRY_SEC)])
+                continue
+            timeout = MAX_SLEEP_SEC
+            if self.heap:
+                timeout = min(timeout, (self.heap[0] - now).total_seconds())
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+def sync_session_reminders(conn, session_ids: Iterable[int], reset: bool = False) -> List[datetime]:
+    """Пересобирает pending-строки журнала для занятий, возвращает новые моменты.
+
+    reset=True удаляет и уже отправленные (время занятия сменилось).
+    """
+    session_ids = list(session_ids)
+    if not session_ids:
+        return []
+    cond = Reminder.session_id.in_(session_ids)
+    if not reset:
+        cond = and_(cond, Reminder.state == 'pending')
+    conn.execute(delete(Reminder).where(cond))
+    return insert_reminders(conn, participants_sessions.c.session_id.in_(session_ids))
+
+
+def sync_participant_reminders(conn, participant_ids: Iterable[int]) -> List[datetime]:
+    """То же для участника после смены его смещений."""
+    participant_ids = list(participant_ids)
+    if not participant_ids:
+        return []
+    conn.execute(delete(Reminder).where(
+        Reminder.participant_id.in_(participant_ids),
+        Reminder.state == 'pending'
+    ))
+    return insert_reminders(conn, participants_sessions.c.participant_id.in_(participant_ids))
+
+
+def drop_registration_reminders(conn, session_id: int, participant_id: int):
+    """Отписка: pending-строки только этого участника на этом занятии."""
+    conn.execute(delete(Reminder).where(
+        Reminder.session_id == session_id,
+        Reminder.participant_id == participant_id,
+        Reminder.state == 'pending'
+    ))
+
+
+def insert_reminders(conn, where) -> List[datetime]:
+    now = datetime.now()
+    rows = conn.execute(
+        select(participants_sessions.c.session_id, participants_sessions.c.participant_id,
+               ReminderOffset.minutes, Session.date_time)
+        .join(Session, Session.id == participants_sessions.c.session_id)
+        .join(ReminderOffset, ReminderOffset.participant_id == participants_sessions.c.participant_id)
+        .where(where, Session.status == 'planned', Session.date_time > now)
+    ).all()
+    values = [
+        {
+            'session_id': s_id,
+            'participant_id': p_id,
+            'offset_minutes': minutes,
+            'due_at': s_dt - timedelta(minutes=minutes),
+            'state': 'pending',
+        }
+        for s_id, p_id, minutes, s_dt in rows
+        if s_dt - timedelta(minutes=minutes) > now
+    ]
+    if not values:
+        return []
+    conn.execute(sqlite_insert(Reminder).on_conflict_do_nothing(), values)
+    return sorted({v['due_at'] for v in values})
+
+
+def fmt_offset(minutes: int) -> str:
+    if minutes % 1440 == 0:
+        return f"{minutes // 1440} дн."
+    if minutes % 60 == 0:
+        return f"{minutes // 60} ч."
+    return f"{minutes} мин."
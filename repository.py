@@ -0,0 +1,277 @@
+import json
+from datetime import date, datetime, time, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import select, update, func
+from sqlalchemy.engine import URL
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import joinedload, selectinload, configure_mappers
+
+from extensions import sqlite_pragmas, apply_sqlite_pragmas
+from models import Course, Participant, Session, SessionSeries, Reminder, ReminderOffset, NotificationOutbox
+from notify import session_notice, notice_chats
+from reminders import sync_participant_reminders
+import bus
+import series
+
+
+def day_sessions_query(sel_date: date):
+    start_of_day = datetime.combine(sel_date, time.min)
+    end_of_day = datetime.combine(sel_date, time.max)
+    return select(Session).where(
+        Session.date_time >= start_of_day,
+        Session.date_time <= end_of_day
+    ).order_by(Session.date_time)
+
+
+def month_counts_query(year: int, month: int):
+    start = datetime(year, month, 1)
+    end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    day = func.date(Session.date_time)
+    return select(day, func.count()).where(
+        Session.date_time >= start,
+        Session.date_time < end
+    ).group_by(day)
+
+
+def upcoming_sessions_query(now: datetime):
+    two_m_from_now = now + timedelta(days=60)
+    return select(Session).where(
+        Session.date_time >= now - timedelta(hours=1),
+        Session.date_time <= two_m_from_now,
+        Session.status.in_(['planned', 'rescheduled'])
+    ).order_by(Session.date_time)
+
+
+def due_reminders_query(now: datetime, limit: int):
+    return (
+        select(
+            Reminder.id, Reminder.session_id, Reminder.offset_minutes,
+            Participant.telegram_id, Participant.notifications_enabled,
+            Session.date_time, Session.location, Session.instructor, Session.comment, Course.name
+        )
+        .join(Session, Session.id == Reminder.session_id)
+        .join(Participant, Participant.id == Reminder.participant_id)
+        .outerjoin(Course, Course.id == Session.course_id)
+        .where(Reminder.state == 'pending', Reminder.due_at <= now)
+        .order_by(Reminder.due_at)
+        .limit(limit)
+    )
+
+
+def async_url(url: URL) -> URL:
+    if url.get_backend_name() == 'sqlite':
+        return url.set(drivername='sqlite+aiosqlite')
+    return url
+
+
+class Repository:
+    """Асинхронный доступ к БД для бота: те же модели, что у flask-части,
+    но через AsyncSession на своём движке, без потоков и app_context.
+
+    ORM-события (журнал напоминаний, сброс кэшей) срабатывают так же,
+    как на синхронной сессии. Объекты возвращаются отсоединёнными
+    (expire_on_commit=False), связи, нужные вызывающему, подгружаются сразу.
+    """
+
+    def __init__(self):
+        self.engine = None
+        self.session = None
+
+    def init_app(self, app, sync_engine):
+        # Session.course - backref, появляется только после настройки мапперов
+        configure_mappers()
+        config = app.config
+        options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        self.engine = create_async_engine(async_url(sync_engine.url), **options)
+        apply_sqlite_pragmas(self.engine.sync_engine, sqlite_pragmas(config))
+        self.session: async_sessionmaker[AsyncSession] = async_sessionmaker(self.engine, expire_on_commit=False)
+
+    async def dispose(self):
+        if self.engine is not None:
+            await self.engine.dispose()
+
+    # участники
+
+    async def get_profile(self, telegram_id: int) -> Optional[Dict[str, Any]]:
+        async with self.session() as s:
+            part = await s.scalar(select(Participant).where(Participant.telegram_id == telegram_id))
+            if not part:
+                return None
+            offsets = await s.scalars(select(ReminderOffset.minutes).where(ReminderOffset.participant_id == part.id))
+            return {
+                'id': part.id,
+                'name': part.name,
+                'contact': part.contact,
+                'notifications_enabled': part.notifications_enabled,
+                'offsets': frozenset(offsets),
+            }
+
+    async def save_profile(self, telegram_id: int, name: str, contact: str) -> Participant:
+        async with self.session() as s:
+            part = await s.scalar(select(Participant).where(Participant.telegram_id == telegram_id))
+            if not part:
+                part = Participant(
+                    telegram_id=telegram_id,
+                    name=name,
+                    contact=contact,
+                    notifications_enabled=True,
+                    warn_5_min=False
+                )
+                s.add(part)
+            else:
+                part.name = name
+                part.contact = contact
+            await s.commit()
+            return part
+
+    async def toggle_notifications(self, telegram_id: int) -> Optional[bool]:
+        async with self.session() as s:
+            part = await s.scalar(select(Participant).where(Participant.telegram_id == telegram_id))
+            if not part:
+                return None
+            part.notifications_enabled = not part.notifications_enabled
+            await s.commit()
+            return part.notifications_enabled
+
+    async def toggle_reminder(self, telegram_id: int, minutes: int) -> Tuple[Optional[bool], List[datetime]]:
+        """Включает/выключает смещение; возвращает новое значение и новые моменты журнала."""
+        async with self.session() as s:
+            part = await s.scalar(select(Participant).where(Participant.telegram_id == telegram_id))
+            if not part:
+                return None, []
+            offset = await s.scalar(select(ReminderOffset).where(
+                ReminderOffset.participant_id == part.id, ReminderOffset.minutes == minutes
+            ))
+            if offset:
+                await s.delete(offset)
+            else:
+                s.add(ReminderOffset(participant_id=part.id, minutes=minutes))
+            if minutes == 5:
+                part.warn_5_min = not offset
+            await s.flush()
+            p_id = part.id
+            instants = await s.run_sync(lambda sync_s: sync_participant_reminders(sync_s.connection(), [p_id]))
+            await s.commit()
+            return not offset, instants
+
+    # курсы и занятия
+
+    async def list_courses(self) -> List[Course]:
+        async with self.session() as s:
+            return list(await s.scalars(select(Course).order_by(Course.name)))
+
+    async def get_session(self, s_id: int) -> Optional[Session]:
+        async with self.session() as s:
+            return await s.get(Session, s_id, options=[joinedload(Session.course)])
+
+    async def create_session(self, **values) -> Session:
+        async with self.session() as s:
+            sess = Session(**values)
+            s.add(sess)
+            await s.commit()
+            await s.refresh(sess, ['course'])
+            return sess
+
+    async def edit_session(self, s_id: int, apply: Callable[[Session], Optional[str]]) -> Optional[Tuple[Session, Optional[str]]]:
+        """Загружает занятие, даёт apply поменять поля и коммитит. None - занятия нет.
+
+        apply возвращает текст уведомления участникам: он попадает в outbox
+        в той же транзакции, что и правки."""
+        async with self.session() as s:
+            sess = await s.get(Session, s_id, options=[joinedload(Session.course)])
+            if not sess:
+                return None
+            notice = apply(sess)
+            if notice:
+                s.add(NotificationOutbox(session_id=s_id, message=notice))
+            await s.commit()
+            return sess, notice
+
+    async def delete_session(self, s_id: int, notice: Optional[Callable[[Session], str]] = None) -> Optional[Session]:
+        """Удаляет занятие. notice даёт текст уведомления участникам: строка outbox
+        пишется в той же транзакции со снимком текста и получателей - после
+        удаления их уже не из чего собрать."""
+        async with self.session() as s:
+            sess = await s.get(Session, s_id, options=[joinedload(Session.course), selectinload(Session.participants)])
+            if not sess:
+                return None
+            if notice:
+                msg = notice(sess)
+                s.add(NotificationOutbox(session_id=s_id, message=msg, text=session_notice(sess, msg),
+                                         recipients=json.dumps(notice_chats(sess))))
+            await s.delete(sess)
+            await s.commit()
+            return sess
+
+    async def day_sessions(self, sel_date: date) -> List[Session]:
+        async with self.session() as s:
+            return list(await s.scalars(day_sessions_query(sel_date).options(joinedload(Session.course))))
+
+    async def month_counts(self, year: int, month: int) -> Dict[int, int]:
+        async with self.session() as s:
+            rows = (await s.execute(month_counts_query(year, month))).all()
+            # date() в sqlite отдаёт строку YYYY-MM-DD
+            return {int(d[8:10]): n for d, n in rows}
+
+    async def upcoming_sessions(self, now: datetime) -> List[Session]:
+        async with self.session() as s:
+            return list(await s.scalars(upcoming_sessions_query(now).options(joinedload(Session.course))))
+
+    async def session_recipients(self, s_id: int) -> Optional[Session]:
+        async with self.session() as s:
+            return await s.get(Session, s_id, options=[joinedload(Session.course), joinedload(Session.participants)])
+
+    # серии занятий
+
+    async def create_series(self, **values) -> SessionSeries:
+        async with self.session() as s:
+            ser = SessionSeries(**values)
+            s.add(ser)
+            await s.commit()
+            await s.refresh(ser, ['course'])
+            return ser
+
+    async def occurrences(self, start: datetime, end: datetime) -> List[series.Occurrence]:
+        async with self.session() as s:
+            return await s.run_sync(lambda sync_s: series.occurrences(sync_s, start, end))
+
+    async def occurrence(self, series_id: int, on: date) -> Optional[Any]:
+        async with self.session() as s:
+            return await s.run_sync(lambda sync_s: series.occurrence(sync_s, series_id, on))
+
+    async def materialize(self, series_id: int, on: date) -> Optional[int]:
+        async with self.session() as s:
+            s_id = await s.run_sync(lambda sync_s: series.materialize(sync_s, series_id, on))
+            await s.commit()
+            return s_id
+
+    # журнал напоминаний
+
+    async def due_reminders(self, now: datetime, limit: int) -> List[Any]:
+        async with self.session() as s:
+            return (await s.execute(due_reminders_query(now, limit))).all()
+
+    async def mark_reminders(self, now: datetime, states: Dict[str, List[int]], warned_s_ids: List[int]):
+        async with self.session() as s:
+            for state, r_ids in states.items():
+                if r_ids:
+                    await s.execute(update(Reminder).where(Reminder.id.in_(r_ids)).values(state=state, sent_at=now))
+            if warned_s_ids:
+                await s.execute(update(Session).where(Session.id.in_(warned_s_ids)).values(five_min_warn_sent=True))
+            await s.commit()
+
+    # шина событий
+
+    async def bus_head(self) -> int:
+        async with self.session() as s:
+            return await s.scalar(bus.head_query())
+
+    async def bus_events(self, after: int, limit: int) -> List[Any]:
+        async with self.session() as s:
+            return (await s.execute(bus.fetch_query(after, limit))).all()
+
+    async def prune_bus(self, before: datetime):
+        async with self.session() as s:
+            await s.execute(bus.prune_query(before))
+            await s.commit()
@@ -0,0 +1,58 @@
+from sqlalchemy import text
+
+from extensions import db
+from models import BusEvent
+
+
+def dedupe_registrations(conn):
+    # до уникального индекса в participants_sessions могли попасть дубли
+    conn.execute(text(
+        "DELETE FROM participants_sessions WHERE rowid NOT IN ("
+        "SELECT min(rowid) FROM participants_sessions GROUP BY session_id, participant_id)"
+    ))
+
+
+def add_missing_columns(conn):
+    # create_all не трогает существующие таблицы; новые колонки моделей nullable
+    for table in db.metadata.sorted_tables:
+        existing = {row[1] for row in conn.execute(text(f'PRAGMA table_info("{table.name}")'))}
+        if not existing:
+            continue
+        for column in table.columns:
+            if column.name not in existing:
+                col_type = column.type.compile(dialect=conn.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {col_type}'))
+
+
+def autoincrement_bus(conn):
+    # bus_event без AUTOINCREMENT после очистки выдаёт id заново с 1,
+    # а курсор бота стоит на старом максимуме - пересоздаём с сохранением событий
+    table = BusEvent.__table__
+    ddl = conn.execute(text(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"
+    ), {'name': table.name}).scalar()
+    if not ddl or 'AUTOINCREMENT' in ddl.upper():
+        return
+    for index in table.indexes:
+        index.drop(conn, checkfirst=True)
+    conn.execute(text(f'ALTER TABLE "{table.name}" RENAME TO "{table.name}_old"'))
+    table.create(conn)
+    columns = ', '.join(f'"{c.name}"' for c in table.columns)
+    conn.execute(text(f'INSERT INTO "{table.name}" ({columns}) SELECT {columns} FROM "{table.name}_old"'))
+    conn.execute(text(f'DROP TABLE "{table.name}_old"'))
+
+
+def upgrade_schema():
+    """Доводит существующий sqdb.db до текущих моделей: новые таблицы, колонки и индексы.
+
+    Повторный запуск ничего не меняет. Вызывать внутри app_context.
+    """
+    db.create_all()
+    with db.engine.begin() as conn:
+        add_missing_columns(conn)
+        autoincrement_bus(conn)
+        dedupe_registrations(conn)
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        conn.execute(text("PRAGMA optimize"))
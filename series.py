@@ -0,0 +1,203 @@
+import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy import event, or_, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session as OrmSession, joinedload, selectinload
+
+import bus
+import changelog
+import versions
+from events import SessionChange, record_changes
+from models import Session, SeriesException, SessionSeries
+
+
+class Occurrence:
+    """Дата серии, ещё не сохранённая строкой Session.
+
+    Поля как у Session, чтобы рендеры и сериализация работали с обоими;
+    id нет, адрес - (series_id, occurrence_date). Записей на неё нет:
+    запись сначала сохраняет занятие.
+    """
+
+    def __init__(self, series: SessionSeries, on: datetime.date):
+        self.id = None
+        self.series_id = series.id
+        self.occurrence_date = on
+        self.course_id = series.course_id
+        self.course = series.course
+        self.date_time = datetime.datetime.combine(on, series.start_time)
+        self.duration_minutes = series.duration_minutes
+        self.instructor = series.instructor
+        self.location = series.location
+        self.comment = series.comment
+        self.status = 'planned'
+        self.five_min_warn_sent = False
+        self.participants = []
+
+
+def sort_key(s) -> Tuple[datetime.datetime, int]:
+    # id у сохранённых занятий положительные, даты серий идут перед ними с -series_id
+    return s.date_time, s.id if s.id is not None else -s.series_id
+
+
+def occurrence_dates(series: SessionSeries, start: datetime.date, end: datetime.date) -> Iterator[datetime.date]:
+    """Даты по правилу в [start, end], без учёта исключений."""
+    step = 7 * series.interval_weeks
+    last = min(end, series.until) if series.until else end
+    first = max(start, series.start_date)
+    if first > last:
+        return
+    k = -(-(first - series.start_date).days // step)
+    on = series.start_date + datetime.timedelta(days=k * step)
+    while on <= last:
+        yield on
+        on += datetime.timedelta(days=step)
+
+
+def is_occurrence(series: SessionSeries, on: datetime.date) -> bool:
+    return next(occurrence_dates(series, on, on), None) == on
+
+
+def window_query(start: datetime.date, end: datetime.date, course_id: Optional[int] = None):
+    query = select(SessionSeries).where(
+        SessionSeries.start_date <= end,
+        or_(SessionSeries.until.is_(None), SessionSeries.until >= start)
+    )
+    if course_id is not None:
+        query = query.where(SessionSeries.course_id == course_id)
+    return query
+
+
+def skips_query(series_ids: List[int], start: datetime.date, end: datetime.date):
+    """Даты серий, которые не разворачиваются: исключения и уже сохранённые занятия."""
+    return select(SeriesException.series_id, SeriesException.occurrence_date).where(
+        SeriesException.series_id.in_(series_ids),
+        SeriesException.occurrence_date.between(start, end)
+    ).union_all(select(Session.series_id, Session.occurrence_date).where(
+        Session.series_id.in_(series_ids),
+        Session.occurrence_date.between(start, end)
+    ))
+
+
+def expand(series_rows: Iterable[SessionSeries], skips: Set[Tuple[int, datetime.date]],
+           start: datetime.datetime, end: datetime.datetime) -> List[Occurrence]:
+    out = []
+    for series in series_rows:
+        for on in occurrence_dates(series, start.date(), end.date()):
+            if (series.id, on) in skips:
+                continue
+            occ = Occurrence(series, on)
+            if start <= occ.date_time <= end:
+                out.append(occ)
+    return sorted(out, key=sort_key)
+
+
+def occurrences(orm_session, start: datetime.datetime, end: datetime.datetime,
+                course_id: Optional[int] = None) -> List[Occurrence]:
+    """Несохранённые даты серий в окне [start, end] (синхронная сессия flask)."""
+    rows = orm_session.scalars(
+        window_query(start.date(), end.date(), course_id).options(selectinload(SessionSeries.course))
+    ).all()
+    if not rows:
+        return []
+    skips = set(orm_session.execute(skips_query([r.id for r in rows], start.date(), end.date())).all())
+    return expand(rows, skips, start, end)
+
+
+def occurrence_values(series: SessionSeries, on: datetime.date) -> Dict[str, Any]:
+    return {
+        'course_id': series.course_id,
+        'date_time': datetime.datetime.combine(on, series.start_time),
+        'duration_minutes': series.duration_minutes,
+        'instructor': series.instructor,
+        'location': series.location,
+        'comment': series.comment,
+        'status': 'planned',
+        'five_min_warn_sent': False,
+        'series_id': series.id,
+        'occurrence_date': on,
+    }
+
+
+def materialized_query(series_id: int, on: datetime.date):
+    return select(Session.id).where(Session.series_id == series_id, Session.occurrence_date == on)
+
+
+def exception_query(series_id: int, on: datetime.date):
+    return select(SeriesException.id).where(SeriesException.series_id == series_id,
+                                            SeriesException.occurrence_date == on)
+
+
+def occurrence(orm_session, series_id: int, on: datetime.date):
+    """Занятие на дату серии без сохранения: строка Session, если дату уже сохранили,
+    иначе Occurrence. None - такой даты в серии нет (или она в исключениях)."""
+    s_id = orm_session.scalar(materialized_query(series_id, on))
+    if s_id:
+        return orm_session.get(Session, s_id, options=[joinedload(Session.course)])
+    series = orm_session.get(SessionSeries, series_id, options=[selectinload(SessionSeries.course)])
+    if not series or not is_occurrence(series, on) or orm_session.scalar(exception_query(series_id, on)):
+        return None
+    return Occurrence(series, on)
+
+
+def materialize(orm_session, series_id: int, on: datetime.date) -> Optional[int]:
+    """id занятия для даты серии, при первом обращении сохраняет его строкой.
+
+    None - такой даты в серии нет (или она в исключениях). Вставка идёт мимо
+    unit of work с ON CONFLICT DO NOTHING по ux_session_series_occurrence:
+    две одновременные первые правки дают одну строку. Коммитит вызывающий.
+    """
+    s_id = orm_session.scalar(materialized_query(series_id, on))
+    if s_id:
+        return s_id
+    series = orm_session.get(SessionSeries, series_id)
+    if not series or not is_occurrence(series, on) or orm_session.scalar(exception_query(series_id, on)):
+        return None
+    values = occurrence_values(series, on)
+    s_id = orm_session.scalar(
+        sqlite_insert(Session).values(**values).on_conflict_do_nothing().returning(Session.id)
+    )
+    if s_id is None:
+        return orm_session.scalar(materialized_query(series_id, on))
+    record_changes(orm_session, [SessionChange(s_id, values['date_time'], values['status'])])
+    return s_id
+
+
+@event.listens_for(OrmSession, 'after_flush')
+def collect_series_changes(orm_session, flush_context):
+    changed: Dict[int, str] = {}
+    skipped: List[Tuple[int, datetime.date]] = []
+    for obj in list(orm_session.new) + list(orm_session.dirty) + list(orm_session.deleted):
+        if isinstance(obj, SessionSeries):
+            changed[obj.id] = 'delete' if obj in orm_session.deleted else 'upsert'
+        elif isinstance(obj, SeriesException):
+            changed.setdefault(obj.series_id, 'upsert')
+        elif isinstance(obj, Session) and obj in orm_session.deleted and obj.series_id:
+            # удалённая сохранённая дата не должна снова развернуться из правила
+            skipped.append((obj.series_id, obj.occurrence_date))
+    if changed:
+        orm_session.info['flushed_series'] = changed
+    skipped = [(s_id, on) for s_id, on in skipped if changed.get(s_id) != 'delete']
+    if skipped:
+        orm_session.info['skipped_occurrences'] = skipped
+
+
+@event.listens_for(OrmSession, 'after_flush_postexec')
+def record_series_changes(orm_session, flush_context):
+    # серия меняет много дат сразу: версия 'global', журнал изменений и шина
+    # (бот сбрасывает кэши дней и месяцев целиком)
+    skipped = orm_session.info.pop('skipped_occurrences', None)
+    if skipped:
+        # внутри flush: мимо unit of work, повтор даты уже в исключениях не мешает
+        orm_session.connection().execute(
+            sqlite_insert(SeriesException).on_conflict_do_nothing(),
+            [{'series_id': s_id, 'occurrence_date': on} for s_id, on in skipped]
+        )
+    changed = orm_session.info.pop('flushed_series', None)
+    if not changed:
+        return
+    conn = orm_session.connection()
+    versions.bump(conn, [versions.GLOBAL])
+    changelog.record(conn, 'series', sorted(changed.items()))
+    bus.publish(conn, 'series', sorted(changed))
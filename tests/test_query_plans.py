@@ -0,0 +1,22 @@
+"""Горячие запросы должны идти по своим индексам (EXPLAIN QUERY PLAN)."""
+import pytest
+
+import main
+from schema import upgrade_schema
+
+
+with main.app.app_context():
+    CHECKS = main.plan_checks()
+
+
+@pytest.fixture(scope='module', autouse=True)
+def schema():
+    with main.app.app_context():
+        upgrade_schema()
+        yield
+
+
+@pytest.mark.parametrize('name, query, index', CHECKS, ids=[c[0] for c in CHECKS])
+def test_query_uses_index(name, query, index):
+    plan = main.query_plan(query)
+    assert any(index in step for step in plan), f"{name}: {index} not in plan {plan}"
@@ -0,0 +1,67 @@
+import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session as OrmSession
+
+from events import SessionChange, on_sessions_flushed
+from models import Course, DataVersion, Participant
+
+GLOBAL = 'global'
+REFS = 'refs'
+
+
+def session_key(session_id: int) -> str:
+    return f'session:{session_id}'
+
+
+def bump(conn: Connection, keys: Iterable[str]):
+    """+1 к версиям в транзакции вызывающего; строки создаются при первом изменении."""
+    keys = sorted(set(keys))
+    if not keys:
+        return
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    stmt = sqlite_insert(DataVersion).values([{'key': k, 'version': 1, 'updated_at': now} for k in keys])
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=[DataVersion.key],
+        set_={'version': DataVersion.version + 1, 'updated_at': stmt.excluded.updated_at}
+    ))
+
+
+def read(conn: Connection, keys: List[str]) -> Dict[str, Tuple[int, Optional[datetime.datetime]]]:
+    """Версия и время изменения по ключам; (0, None) для ещё не менявшихся."""
+    rows = conn.execute(
+        select(DataVersion.key, DataVersion.version, DataVersion.updated_at).where(DataVersion.key.in_(keys))
+    ).all()
+    found = {k: (v, at) for k, v, at in rows}
+    return {k: found.get(k, (0, None)) for k in keys}
+
+
+@on_sessions_flushed
+def bump_session_versions(conn: Connection, changes: List[SessionChange]):
+    # регистрации тоже приходят сюда: ORM-append меняет занятие, Core-пути зовут record_changes
+    bump(conn, [GLOBAL] + [session_key(ch.session_id) for ch in changes])
+
+
+def renamed(obj) -> bool:
+    hist = inspect(obj).attrs.name.history
+    return bool(hist.deleted)
+
+
+@event.listens_for(OrmSession, 'after_flush')
+def collect_ref_changes(orm_session, flush_context):
+    # имена курсов и участников видны в ответах по занятиям; новые строки ещё нигде не видны
+    for obj in orm_session.dirty:
+        if isinstance(obj, (Course, Participant)) and renamed(obj):
+            orm_session.info['refs_changed'] = True
+    for obj in orm_session.deleted:
+        if isinstance(obj, (Course, Participant)):
+            orm_session.info['refs_changed'] = True
+
+
+@event.listens_for(OrmSession, 'after_flush_postexec')
+def bump_ref_versions(orm_session, flush_context):
+    if orm_session.info.pop('refs_changed', False):
+        bump(orm_session.connection(), [GLOBAL, REFS])
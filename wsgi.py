@@ -0,0 +1,8 @@
+"""Точка входа REST API для WSGI-сервера, например:
+
+    gunicorn -w 4 -b 0.0.0.0:5000 wsgi:app
+
+Бот запускается отдельно: python main.py bot (он же обновляет схему БД).
+Изменения занятий доходят до бота через шину событий в БД (bus.py).
+"""
+from main import app